@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017 Gearóid Fox
+#
+# This file is part of Alvin.
+#
+# Alvin is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Alvin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Alvin.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+On-disk cache of parsed alignments.
+
+Each cached alignment is one file: a magic line, the length of a JSON
+header as a little-endian uint64, the JSON header, then the arrays of an
+AlignmentMatrix at 64-byte aligned offsets, so that they can be
+memory-mapped when the file is opened again.
+"""
+
+import hashlib
+import json
+import os
+import struct
+import time
+import numpy as np
+from alnmatrix import AlignmentMatrix
+
+
+# Changed whenever entries need arrays that older entries lack, e.g. the
+# class counts of the columns (version 2).
+MAGIC = b'ALVINCACHE2\n'
+
+# Suffix of cache entries, and of entries still being written.
+SUFFIX = '.aln'
+TMP_SUFFIX = '.tmp'
+
+# Bytes read from the start, middle and end of a file to compute its
+# content hash.
+SAMPLE_SIZE = 1024 * 1024
+
+# Unfinished entries older than this many seconds are deleted.
+TMP_MAX_AGE = 3600
+
+
+def align(offset):
+    """
+    Args:
+        offset (int): a position in a cache entry
+
+    Returns:
+        int the next multiple of 64 at or after offset
+    """
+    return -(-offset // 64) * 64
+
+
+def default_cache_dir():
+    """
+    Returns:
+        str directory to keep cached alignments in
+    """
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+            os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'alvin')
+
+
+def content_hash(path, size):
+    """
+    Hash samples from the start, middle and end of a file, to tell whether
+    it has changed without reading all of it.
+    Args:
+        path (str): path to the file
+        size (int): size of the file in bytes
+
+    Returns:
+        str hex digest
+    """
+    digest = hashlib.sha1(str(size).encode('ascii'))
+    with open(path, 'rb') as handle:
+        for start in sorted(set([0, max(0, size // 2 - SAMPLE_SIZE // 2),
+                max(0, size - SAMPLE_SIZE)])):
+            handle.seek(start)
+            digest.update(handle.read(SAMPLE_SIZE))
+    return digest.hexdigest()
+
+
+class DiskCache:
+    """
+    Directory of parsed alignments, keyed by the path of the alignment file
+    and checked against its size, modification time and content hash. The
+    least recently used entries are deleted when the total size exceeds a
+    budget.
+    """
+    def __init__(self, directory=None, max_bytes=2*1024*1024*1024):
+        """
+        Args:
+            directory (str): directory to keep cached alignments in, or None
+                for the default
+            max_bytes (int): budget for the total size of the cache
+
+        Returns: None
+        """
+        self.directory = directory or default_cache_dir()
+        self.max_bytes = max_bytes
+
+    def entry_path(self, path, fmt):
+        """
+        Args:
+            path (str): path to an alignment file
+            fmt (str): format of the alignment file
+
+        Returns:
+            str path of the cache entry for the file
+        """
+        key = "{}\0{}".format(os.path.abspath(path), fmt)
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name + SUFFIX)
+
+    @staticmethod
+    def file_info(path):
+        """
+        Args:
+            path (str): path to an alignment file
+
+        Returns:
+            dict describing the version of the file, to store in its entry
+        """
+        stat = os.stat(path)
+        return {
+                'path': os.path.abspath(path),
+                'size': stat.st_size,
+                'mtime_ns': stat.st_mtime_ns,
+                'content_hash': content_hash(path, stat.st_size),
+                }
+
+    def load(self, path, fmt):
+        """
+        Open a cached alignment, with its arrays memory-mapped.
+        Args:
+            path (str): path to the alignment file
+            fmt (str): format of the alignment file
+
+        Returns:
+            AlignmentMatrix, or None if the file is not cached or has changed
+            since it was cached
+        """
+        entry = self.entry_path(path, fmt)
+        try:
+            with open(entry, 'rb') as handle:
+                if handle.read(len(MAGIC)) != MAGIC:
+                    return None
+                header_len, = struct.unpack('<Q', handle.read(8))
+                header = json.loads(handle.read(header_len).decode('utf-8'))
+            if header['file'] != self.file_info(path):
+                return None
+            start = align(len(MAGIC) + 8 + header_len)
+            arrays = {}
+            for name, info in header['arrays'].items():
+                shape = tuple(info['shape'])
+                if 0 in shape:
+                    arrays[name] = np.zeros(shape, dtype=info['dtype'])
+                else:
+                    arrays[name] = np.memmap(entry, dtype=info['dtype'],
+                            mode='r', offset=start + info['offset'],
+                            shape=shape)
+            os.utime(entry)
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+        column_stats = dict((name[len('stat_'):], array) for name, array in
+                arrays.items() if name.startswith('stat_'))
+        return AlignmentMatrix.from_arrays(arrays['residues'],
+                arrays['id_offsets'], arrays['id_data'], column_stats)
+
+    def store(self, path, fmt, matrix):
+        """
+        Write an alignment to the cache, then evict old entries if the cache
+        is over budget. Alignments larger than the whole budget are not
+        stored. Failure to write is not an error.
+        Args:
+            path (str): path to the alignment file
+            fmt (str): format of the alignment file
+            matrix (AlignmentMatrix): the parsed alignment
+
+        Returns: None
+        """
+        arrays = [
+                ('residues', matrix.residues),
+                ('id_offsets', np.asarray(matrix.id_offsets, dtype=np.int64)),
+                ('id_data', np.frombuffer(bytes(matrix.id_data),
+                    dtype=np.uint8)),
+                ]
+        for name, array in sorted(matrix.column_stats.items()):
+            arrays.append(('stat_' + name, np.asarray(array)))
+        entry = self.entry_path(path, fmt)
+        tmp = "{}.{}{}".format(entry, os.getpid(), TMP_SUFFIX)
+        try:
+            header = {'file': self.file_info(path), 'format': fmt,
+                    'arrays': {}}
+            offset = 0
+            for name, array in arrays:
+                header['arrays'][name] = {'dtype': array.dtype.str,
+                        'shape': list(array.shape), 'offset': offset}
+                offset = align(offset + array.nbytes)
+            encoded = json.dumps(header).encode('utf-8')
+            start = align(len(MAGIC) + 8 + len(encoded))
+            if start + offset > self.max_bytes:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            with open(tmp, 'wb') as handle:
+                handle.write(MAGIC)
+                handle.write(struct.pack('<Q', len(encoded)))
+                handle.write(encoded)
+                for name, array in arrays:
+                    handle.seek(start + header['arrays'][name]['offset'])
+                    np.ascontiguousarray(array).tofile(handle)
+            os.replace(tmp, entry)
+        except (IOError, OSError):
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return
+        self.evict(keep=entry)
+
+    def evict(self, keep=None):
+        """
+        Delete least recently used entries until the cache is within its
+        budget, and delete abandoned unfinished entries.
+        Args:
+            keep (str): path of an entry not to delete, e.g. the one just
+                written
+
+        Returns: None
+        """
+        entries = []
+        total = 0
+        now = time.time()
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            entry = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(entry)
+                if name.endswith(TMP_SUFFIX):
+                    if now - stat.st_mtime > TMP_MAX_AGE:
+                        os.remove(entry)
+                    continue
+            except OSError:
+                continue
+            if name.endswith(SUFFIX):
+                entries.append((stat.st_mtime, stat.st_size, entry))
+                total += stat.st_size
+        for _, size, entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if entry == keep:
+                continue
+            try:
+                os.remove(entry)
+                total -= size
+            except OSError:
+                pass
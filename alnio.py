@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017 Gearóid Fox
+#
+# This file is part of Alvin.
+#
+# Alvin is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Alvin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Alvin.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Functions to read alignment files into an AlignmentMatrix """
+
+import os
+from alnmatrix import AlignmentMatrix
+from alnmmap import READ_SIZE, MappedFasta, iter_records
+from colstats import ColumnStatsJob, default_workers
+from compressed import DECOMPRESSION_ERRORS, decompress_stream, \
+        detect_compression, open_text
+
+
+# Formats which the native and mmap readers can parse.
+NATIVE_FORMATS = ['fasta', 'a2m']
+
+# Files larger than this are read with the mmap reader by default, rather
+# than loaded into memory.
+MMAP_THRESHOLD = 4 * 1024 * 1024 * 1024
+
+
+def iter_fasta(handle, read_size=READ_SIZE):
+    """
+    Split a FASTA file into records, reading it in large chunks (see
+    alnmmap.iter_records).
+    Args:
+        handle: file object opened in binary mode
+        read_size (int): largest number of bytes to read at once
+
+    Yields:
+        (id, residues, record_size) for each record, where id is the first
+        word of the header line as a str, residues are bytes with
+        whitespace removed and record_size is the size of the record in the
+        file in bytes.
+    """
+    for header_offset, header, body_offset, body in iter_records(handle,
+            read_size):
+        words = header.split(None, 1)
+        seq_id = words[0].decode('utf-8', 'replace') if words else ''
+        yield (seq_id, body.translate(None, b' \t\r\n'),
+                body_offset - header_offset + len(body) + 1)
+
+
+def read_fasta(path, matrix=None, progress=None):
+    """
+    Read a FASTA (or A2M) alignment with the native reader. The file may be
+    compressed.
+    Args:
+        path (str): path to the alignment file
+        matrix (AlignmentMatrix): empty matrix to append the sequences to, or
+            None to create one
+        progress (function): called with the number of bytes of the file
+            read so far after each sequence is added, if given
+
+    Returns:
+        AlignmentMatrix
+    Raises:
+        IOError if the file can't be read
+        ValueError if the file isn't a valid alignment
+    """
+    if matrix is None:
+        matrix = AlignmentMatrix()
+    compression = detect_compression(path)
+    size = os.path.getsize(path)
+    with open(path, 'rb') as raw:
+        handle = decompress_stream(raw, compression)
+        for seq_id, seq, record_size in iter_fasta(handle):
+            if matrix.num_seq == 0 and compression is None:
+                matrix.reserve(size // max(1, record_size) + 1, len(seq))
+            matrix.append(seq_id, seq)
+            if progress is not None:
+                progress(raw.tell())
+    if matrix.num_seq == 0:
+        raise ValueError("No sequences found")
+    matrix.trim()
+    return matrix
+
+
+def read_biopython(path, fmt):
+    """
+    Read an alignment in any format supported by Biopython. The file may be
+    compressed.
+    Args:
+        path (str): path to the alignment file
+        fmt (str): Biopython name of the alignment format
+
+    Returns:
+        AlignmentMatrix
+    Raises:
+        IOError if the file can't be read
+        ValueError if the file isn't a valid alignment
+    """
+    from Bio import AlignIO
+    with open_text(path) as handle:
+        return AlignmentMatrix.from_alignment(AlignIO.read(handle, fmt))
+
+
+def choose_reader(fmt, reader='auto', size=0, compression=None):
+    """
+    Args:
+        fmt (str): format of the alignment file
+        reader (str): 'native' to use the native reader, 'mmap' to read
+            sequences on demand from a memory-mapped file, 'biopython' to use
+            Biopython, or 'auto' to use the native or mmap reader for formats
+            they support, depending on the size of the file, and Biopython
+            otherwise.
+        size (int): size of the alignment file in bytes
+        compression (str): compression of the file, as returned by
+            detect_compression
+
+    Returns:
+        str 'native', 'mmap' or 'biopython'
+    Raises:
+        ValueError if the native or mmap reader was requested for a format it
+            doesn't support, or the mmap reader for a file which can't be
+            read at random positions
+    """
+    random_access = compression in [None, 'bgzf']
+    if reader == 'auto':
+        if fmt not in NATIVE_FORMATS:
+            return 'biopython'
+        if size > MMAP_THRESHOLD and random_access:
+            return 'mmap'
+        return 'native'
+    if reader in ['native', 'mmap'] and fmt not in NATIVE_FORMATS:
+        raise ValueError("The {} reader can't read {} format".format(reader,
+            fmt))
+    if reader == 'mmap' and not random_access:
+        raise ValueError("The mmap reader can't read {} compressed files, "
+                "only uncompressed or bgzip compressed files".format(
+                    compression))
+    return reader
+
+
+def read_alignment(path, fmt, reader='auto'):
+    """
+    Read an alignment file.
+    Args:
+        path (str): path to the alignment file
+        fmt (str): format of the alignment file
+        reader (str): 'native', 'mmap', 'biopython' or 'auto', see
+            choose_reader
+
+    Returns:
+        AlignmentMatrix, or MappedFasta for the mmap reader
+    Raises:
+        IOError if the file can't be read
+        ValueError if the file isn't a valid alignment, or the native reader
+            was requested for a format it doesn't support
+    """
+    reader = choose_reader(fmt, reader, os.path.getsize(path),
+            detect_compression(path))
+    if reader == 'native':
+        return read_fasta(path)
+    if reader == 'mmap':
+        alignment = MappedFasta(path)
+        alignment.scan()
+        return alignment
+    return read_biopython(path, fmt)
+
+
+class AlignmentLoader:
+    """
+    Read an alignment file on a background thread, by running run there,
+    e.g. with tasks.run_in_thread.
+
+    With the native reader, sequences appear in the matrix as they are
+    parsed, so the first screenful can be drawn before the whole file has
+    been read. Biopython parses the whole file before any sequences appear.
+
+    With the mmap reader, sequences appear as the file is indexed, and are
+    read from the file when they are displayed.
+
+    If a DiskCache is given, an alignment loaded into memory is opened from
+    the cache when possible. Otherwise, once parsed, its column statistics
+    are computed and it is written to the cache.
+
+    The column statistics of large alignments are computed by a pool of
+    processes once the sequences are loaded (see colstats), as the
+    ColumnStatsJob in stats.
+    """
+    def __init__(self, path, fmt, reader='auto', cache=None):
+        """
+        Args:
+            path (str): path to the alignment file
+            fmt (str): format of the alignment file
+            reader (str): 'native', 'mmap', 'biopython' or 'auto', see
+                choose_reader
+            cache (DiskCache): cache of parsed alignments, if any
+
+        Returns: None
+        Raises:
+            IOError if the file can't be read
+            ValueError if the native reader was requested for a format it
+                doesn't support
+        """
+        self.path = path
+        self.fmt = fmt
+        self.total_bytes = os.path.getsize(path)
+        self.reader = choose_reader(fmt, reader, self.total_bytes,
+                detect_compression(path))
+        self.cache = cache
+        if self.reader == 'mmap':
+            self.cache = None
+        self.from_cache = False
+        self.bytes_read = 0
+        if self.reader == 'mmap':
+            self.matrix = MappedFasta(path)
+        else:
+            self.matrix = AlignmentMatrix()
+        self.stats = None
+        self.done = False
+        self.error = None
+
+    def run(self):
+        """
+        Read the file. Runs on the background thread.
+
+        Returns: None
+        """
+        try:
+            if self.cache is not None:
+                matrix = self.cache.load(self.path, self.fmt)
+                if matrix is not None:
+                    self.matrix = matrix
+                    self.from_cache = True
+            if not self.from_cache and self.reader == 'mmap':
+                self.matrix.scan(self.set_progress)
+            elif not self.from_cache and self.reader == 'native':
+                read_fasta(self.path, self.matrix, self.set_progress)
+            elif not self.from_cache:
+                self.matrix = read_biopython(self.path, self.fmt)
+            self.bytes_read = self.total_bytes
+            workers = 0
+            if isinstance(self.matrix, AlignmentMatrix) and \
+                    'class_counts' not in self.matrix.column_stats:
+                workers = default_workers(self.matrix)
+            if workers:
+                self.stats = ColumnStatsJob(self.matrix, workers)
+            else:
+                self.matrix.column_class_counts()
+                self.matrix.gap_fractions()
+                self.matrix.column_entropy()
+        except (IOError, ValueError) + DECOMPRESSION_ERRORS as e:
+            self.error = e
+        finally:
+            self.done = True
+        if self.stats is not None:
+            self.stats.run()
+        if self.cache is not None and not self.from_cache and \
+                self.error is None and 'entropy' in self.matrix.column_stats:
+            self.cache.store(self.path, self.fmt, self.matrix)
+
+    def set_progress(self, bytes_read):
+        """
+        Args:
+            bytes_read (int): number of bytes of the file read so far
+
+        Returns: None
+        """
+        self.bytes_read = bytes_read
+
+    def progress(self):
+        """
+        Returns:
+            str describing how much of the file has been read
+        """
+        percent = 100
+        if self.total_bytes:
+            percent = 100 * self.bytes_read // self.total_bytes
+        return "Loading: {:.1f}/{:.1f} MB, {} sequences, {}%".format(
+                self.bytes_read / 1e6, self.total_bytes / 1e6,
+                self.matrix.num_seq, percent)
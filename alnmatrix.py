@@ -0,0 +1,446 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017 Gearóid Fox
+#
+# This file is part of Alvin.
+#
+# Alvin is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Alvin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Alvin.  If not, see <http://www.gnu.org/licenses/>.
+
+""" In-memory representation of a multiple sequence alignment """
+
+from multiprocessing import shared_memory
+import numpy as np
+
+
+# Byte values of the characters treated as gaps.
+GAP_CODES = np.frombuffer(b'-.', dtype=np.uint8)
+
+# Classes of characters counted when summarising the residues in a column
+# or block: 0 for gaps, 1-26 for the letters, which are counted regardless
+# of case since both cases are drawn in the same colour, and 27 for
+# anything else.
+NUM_CLASSES = 28
+RESIDUE_CLASS = np.full(256, NUM_CLASSES - 1, dtype=np.uint8)
+RESIDUE_CLASS[GAP_CODES] = 0
+for _letter in range(26):
+    RESIDUE_CLASS[ord('A') + _letter] = _letter + 1
+    RESIDUE_CLASS[ord('a') + _letter] = _letter + 1
+
+# Character code standing for each class, e.g. in a consensus.
+CLASS_CODES = np.frombuffer(b"-ABCDEFGHIJKLMNOPQRSTUVWXYZ?", dtype=np.uint8)
+
+# Number of residues to process at once when summarising columns, to bound
+# the size of temporary arrays.
+CHUNK_SIZE = 16 * 1024 * 1024
+
+
+def class_counts(block):
+    """
+    Count the residues of each class in each column of a block of rows, with
+    one numpy.bincount.
+    Args:
+        block (numpy.ndarray): (rows, align_width) uint8 character codes
+
+    Returns:
+        numpy.ndarray (align_width, NUM_CLASSES) number of residues of each
+        class in each column
+    """
+    width = block.shape[1]
+    index = np.arange(width) * NUM_CLASSES + RESIDUE_CLASS[block]
+    return np.bincount(index.ravel(), minlength=width * NUM_CLASSES
+            ).reshape(width, NUM_CLASSES)
+
+
+def counting_rows(width):
+    """
+    Args:
+        width (int): number of columns in each row
+
+    Returns:
+        int number of rows to count at once with class_counts, so that its
+        temporary arrays take about CHUNK_SIZE bytes
+    """
+    # Each residue needs an 8 byte index for counting.
+    return max(1, CHUNK_SIZE // 8 // max(1, width))
+
+
+def count_classes(alignment, left=0, right=None):
+    """
+    Count the residues of each class in each column of a stripe of an
+    alignment, a chunk of rows at a time.
+    Args:
+        alignment: AlignmentMatrix, or anything else with num_seq,
+            align_width and rows, such as alnmmap.MappedFasta
+        left (int): index of the first column to count
+        right (int): index after the last column to count, defaults to the
+            end of the alignment
+
+    Returns:
+        numpy.ndarray (right - left, NUM_CLASSES) number of residues of each
+        class in each column
+    """
+    if right is None:
+        right = alignment.align_width
+    counts = np.zeros((right - left, NUM_CLASSES), dtype=np.int64)
+    step = counting_rows(right - left)
+    for top in range(0, alignment.num_seq, step):
+        counts += class_counts(alignment.rows(top,
+            min(alignment.num_seq, top + step), left, right))
+    return counts
+
+
+def entropy(counts):
+    """
+    Args:
+        counts (numpy.ndarray): (align_width, NUM_CLASSES) number of residues
+            of each class in each column
+
+    Returns:
+        numpy.ndarray Shannon entropy in bits of the residues in each
+        column, ignoring gaps; 0 for columns of only gaps
+    """
+    residues = counts[:, 1:]
+    totals = residues.sum(axis=1, keepdims=True)
+    p = residues / np.maximum(totals, 1)
+    terms = np.zeros(p.shape)
+    np.log2(p, out=terms, where=p > 0)
+    return -(p * terms).sum(axis=1)
+
+
+def counts_dtype(num_seq):
+    """
+    Args:
+        num_seq (int): number of sequences in an alignment
+
+    Returns:
+        numpy.dtype smallest unsigned integer type which holds the class
+        counts of its columns, for keeping them in column_stats
+    """
+    return np.min_scalar_type(num_seq)
+
+
+def consensus(counts):
+    """
+    Args:
+        counts (numpy.ndarray): (align_width, NUM_CLASSES) number of residues
+            of each class in each column
+
+    Returns:
+        bytes the most common class in each column, as an upper case letter,
+        '-' where gaps are the most common, or '?' for other characters
+    """
+    return CLASS_CODES[counts.argmax(axis=1)].tobytes()
+
+
+class ColumnStatistics:
+    """
+    Statistics of each column of an alignment, worked out a chunk of rows at
+    a time the first time they are asked for, and kept in column_stats.
+
+    Shared by the alignment backends, which provide num_seq, align_width,
+    rows and a column_stats dict.
+    """
+    def chunk_rows(self):
+        """
+        Returns:
+            int number of rows to process at once when summarising columns
+        """
+        return max(1, CHUNK_SIZE // max(1, self.align_width))
+
+    def gap_counts(self):
+        """
+        Count the gaps in each column, a chunk of rows at a time.
+
+        Returns:
+            numpy.ndarray number of gaps in each column
+        """
+        counts = np.zeros(self.align_width, dtype=np.int64)
+        step = self.chunk_rows()
+        for top in range(0, self.num_seq, step):
+            block = self.rows(top, min(self.num_seq, top + step))
+            gaps = block == GAP_CODES[0]
+            for code in GAP_CODES[1:]:
+                gaps |= block == code
+            counts += np.count_nonzero(gaps, axis=0)
+        return counts
+
+    def gap_fractions(self):
+        """
+        Returns:
+            numpy.ndarray fraction of gaps in each column
+        """
+        if 'gap_fractions' not in self.column_stats:
+            num_seq = self.num_seq
+            if num_seq == 0:
+                return np.zeros(self.align_width)
+            if 'class_counts' in self.column_stats:
+                # Gaps are the residues of class 0.
+                gaps = self.column_stats['class_counts'][:, 0]
+            else:
+                gaps = self.gap_counts()
+            self.column_stats['gap_fractions'] = gaps / num_seq
+        return self.column_stats['gap_fractions']
+
+    def column_class_counts(self):
+        """
+        Returns:
+            numpy.ndarray (align_width, NUM_CLASSES) number of residues of
+            each class in each column (see count_classes), of type
+            counts_dtype(num_seq)
+        """
+        if 'class_counts' not in self.column_stats:
+            self.column_stats['class_counts'] = count_classes(self).astype(
+                    counts_dtype(self.num_seq))
+        return self.column_stats['class_counts']
+
+    def column_entropy(self):
+        """
+        Returns:
+            numpy.ndarray Shannon entropy in bits of the residues in each
+            column (see entropy)
+        """
+        if 'entropy' not in self.column_stats:
+            self.column_stats['entropy'] = entropy(self.column_class_counts())
+        return self.column_stats['entropy']
+
+
+class AlignmentMatrix(ColumnStatistics):
+    """
+    A multiple sequence alignment held as a (num_seq, align_width) array of
+    uint8 character codes, plus a table of sequence ids.
+
+    The ids are stored as one block of UTF-8 encoded bytes and an array of
+    offsets into it, rather than as one str object per sequence.
+
+    Sequences can be appended while other threads read the matrix: readers
+    only see the first num_seq rows, and num_seq is increased after a row
+    has been written.
+    """
+    def __init__(self, residues=None, ids=()):
+        """
+        Args:
+            residues (numpy.ndarray): (num_seq, align_width) uint8 array of
+                character codes, or None for an empty matrix to append to
+            ids (list): sequence ids, one str per row of residues
+
+        Returns: None
+        """
+        encoded = [seq_id.encode('utf-8') for seq_id in ids]
+        self._id_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(seq_id) for seq_id in encoded],
+                out=self._id_offsets[1:])
+        self.id_data = bytearray(b''.join(encoded))
+        self.max_id_len = max([len(seq_id) for seq_id in encoded] or [0])
+        # Statistics computed over every row, such as 'gap_fractions' and
+        # 'class_counts'.
+        self.column_stats = {}
+        if residues is None:
+            self._residues = None
+            self.align_width = 0
+            self.num_seq = 0
+        else:
+            self._residues = np.ascontiguousarray(residues, dtype=np.uint8)
+            self.num_seq, self.align_width = self._residues.shape
+
+    @classmethod
+    def from_alignment(cls, alignment):
+        """
+        Build a matrix from a Biopython alignment.
+        Args:
+            alignment (Bio.Align.MultipleSeqAlignment): MSA
+
+        Returns:
+            AlignmentMatrix
+        """
+        num_seq = len(alignment)
+        align_width = alignment.get_alignment_length()
+        residues = np.empty((num_seq, align_width), dtype=np.uint8)
+        for i, record in enumerate(alignment):
+            residues[i] = np.frombuffer(bytes(record.seq), dtype=np.uint8)
+        return cls(residues, [record.id for record in alignment])
+
+    @classmethod
+    def from_arrays(cls, residues, id_offsets, id_data, column_stats=None):
+        """
+        Build a matrix from arrays, without copying them. The arrays may be
+        memory-mapped.
+        Args:
+            residues (numpy.ndarray): (num_seq, align_width) uint8 array of
+                character codes
+            id_offsets (numpy.ndarray): int64 offset of each id in id_data,
+                followed by the end of id_data
+            id_data (numpy.ndarray): uint8 array of UTF-8 encoded ids
+            column_stats (dict): precomputed column statistics, if any
+
+        Returns:
+            AlignmentMatrix
+        """
+        matrix = cls(residues)
+        matrix._id_offsets = id_offsets
+        matrix.id_data = id_data
+        if len(id_offsets) > 1:
+            matrix.max_id_len = int(np.diff(id_offsets).max())
+        matrix.column_stats = dict(column_stats or {})
+        return matrix
+
+    @property
+    def residues(self):
+        """ (num_seq, align_width) uint8 array of character codes """
+        num_seq = self.num_seq
+        if self._residues is None:
+            return np.empty((0, 0), dtype=np.uint8)
+        return self._residues[:num_seq]
+
+    def __len__(self):
+        return self.num_seq
+
+    def reserve(self, num_seq, align_width):
+        """
+        Allocate space for sequences before appending them.
+        Args:
+            num_seq (int): number of sequences expected in total
+            align_width (int): number of columns in the alignment
+
+        Returns: None
+        """
+        if self._residues is None:
+            self._residues = np.empty((num_seq, align_width), dtype=np.uint8)
+            self.align_width = align_width
+        elif num_seq > self._residues.shape[0]:
+            self._grow(num_seq)
+
+    def _grow(self, capacity):
+        """
+        Move the residues to a larger array.
+        Args:
+            capacity (int): number of sequences the new array can hold
+
+        Returns: None
+        """
+        grown = np.empty((capacity, self.align_width), dtype=np.uint8)
+        grown[:self.num_seq] = self._residues[:self.num_seq]
+        self._residues = grown
+
+    def append(self, seq_id, seq):
+        """
+        Add a sequence to the end of the alignment.
+        Args:
+            seq_id (str): id of the sequence
+            seq (bytes): residues of the sequence
+
+        Returns: None
+        Raises:
+            ValueError if seq is not the same length as earlier sequences
+        """
+        if self._residues is None:
+            self.reserve(1, len(seq))
+        elif len(seq) != self.align_width:
+            raise ValueError("Sequence {} has length {}, expected {}".format(
+                seq_id, len(seq), self.align_width))
+        num_seq = self.num_seq
+        if num_seq == self._residues.shape[0]:
+            self._grow(2 * num_seq)
+        self._residues[num_seq] = np.frombuffer(seq, dtype=np.uint8)
+        encoded = seq_id.encode('utf-8')
+        if num_seq + 1 == len(self._id_offsets):
+            offsets = np.zeros(2 * len(self._id_offsets), dtype=np.int64)
+            offsets[:num_seq + 1] = self._id_offsets[:num_seq + 1]
+            self._id_offsets = offsets
+        self.id_data += encoded
+        self._id_offsets[num_seq + 1] = len(self.id_data)
+        if len(encoded) > self.max_id_len:
+            self.max_id_len = len(encoded)
+        self.column_stats.clear()
+        self.num_seq = num_seq + 1
+
+    def trim(self):
+        """
+        Release space reserved for sequences which never arrived.
+
+        Returns: None
+        """
+        if self._residues is not None and \
+                self._residues.shape[0] > self.num_seq:
+            self._residues = self._residues[:self.num_seq].copy()
+        self._id_offsets = self._id_offsets[:self.num_seq + 1].copy()
+
+    def share(self):
+        """
+        Copy the residues into a block of shared memory, so that other
+        processes can read them without copying them again (see colstats).
+        The matrix uses the copy from then on, and its own array is freed
+        unless something else refers to it, but until then the residues
+        take twice their size.
+
+        Returns:
+            multiprocessing.shared_memory.SharedMemory holding the residues.
+            Unlink it once other processes have opened it; the matrix keeps
+            it open.
+        """
+        residues = self.residues
+        block = shared_memory.SharedMemory(create=True,
+                size=max(1, residues.nbytes))
+        shared = np.ndarray(residues.shape, dtype=np.uint8, buffer=block.buf)
+        shared[:] = residues
+        self._residues = shared
+        self._shared_block = block
+        return block
+
+    @property
+    def id_offsets(self):
+        """ Offset of each id in id_data, followed by the end of id_data """
+        return self._id_offsets[:self.num_seq + 1]
+
+    def id(self, i):
+        """
+        Args:
+            i (int): index of a sequence
+
+        Returns:
+            str id of sequence i
+        """
+        return bytes(self.id_data[self._id_offsets[i]:self._id_offsets[i+1]]
+                ).decode('utf-8')
+
+    def max_id_length(self):
+        """
+        Returns:
+            int length of the longest sequence id, in bytes
+        """
+        return self.max_id_len
+
+    def row(self, i, left=0, right=None):
+        """
+        Args:
+            i (int): index of a sequence
+            left (int): index of the first column to return
+            right (int): index after the last column to return
+
+        Returns:
+            str residues of sequence i between columns left and right
+        """
+        return self.residues[i, left:right].tobytes().decode('latin-1')
+
+    def rows(self, top, bottom, left=0, right=None):
+        """
+        Args:
+            top (int): index of the first sequence to return
+            bottom (int): index after the last sequence to return
+            left (int): index of the first column to return
+            right (int): index after the last column to return
+
+        Returns:
+            numpy.ndarray (bottom - top, right - left) uint8 character codes
+        """
+        return self.residues[top:bottom, left:right]
@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017 Gearóid Fox
+#
+# This file is part of Alvin.
+#
+# Alvin is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Alvin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Alvin.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Random access to FASTA alignments too large to hold in memory.
+
+The file is scanned once to index where each record's header and sequence
+lines start. Residues are then read on demand from a memory map of the
+file, or from the blocks of a BGZF compressed file.
+"""
+
+from array import array
+import mmap
+import numpy as np
+from alnmatrix import (NUM_CLASSES, ColumnStatistics, class_counts,
+        counting_rows, counts_dtype, entropy)
+from compressed import BgzfReader, decompress_stream, detect_compression
+
+
+# Number of bytes to read from the file at once while scanning it.
+READ_SIZE = 16 * 1024 * 1024
+FIRST_READ_SIZE = 64 * 1024
+
+
+def iter_records(handle, read_size=READ_SIZE):
+    """
+    Split a FASTA file into records, reading it in large chunks and keeping
+    track of where each one is. Each chunk is only searched once for the
+    start of the next record, so a record spanning many chunks takes time in
+    proportion to its size.
+    Args:
+        handle: file object opened in binary mode
+        read_size (int): largest number of bytes to read at once
+
+    Yields:
+        (header_offset, header, body_offset, body) for each record, where
+        header is the header line without '>', body is the rest of the
+        record, and the offsets are positions in the file.
+    """
+    buffer = bytearray()
+    offset = 0  # position of buffer in the file
+    # Position in buffer of the '>' of the record being read, or -1 before
+    # the first record, and of the first byte not yet searched for the
+    # start of the next record.
+    start = -1
+    searched = 0
+    size = min(FIRST_READ_SIZE, read_size)
+    while True:
+        chunk = handle.read(size)
+        size = min(2 * size, read_size)
+        buffer += chunk
+        if start < 0:
+            start = buffer.find(b'>')
+            if start < 0:
+                if not chunk:
+                    return
+                offset += len(buffer)
+                del buffer[:]
+                continue
+            searched = start
+        while True:
+            end = buffer.find(b'\n>', searched)
+            if end < 0:
+                if chunk:
+                    break
+                end = len(buffer)
+            header, _, body = bytes(buffer[start + 1:end]).partition(b'\n')
+            yield (offset + start, header, offset + start + len(header) + 2,
+                    body)
+            if end == len(buffer):
+                return
+            start = searched = end + 1
+        # Keep the record being read, and search its new data next time,
+        # from its last byte in case that is the '\n' before a '>'.
+        del buffer[:start]
+        offset += start
+        start = 0
+        searched = max(0, len(buffer) - 1)
+
+
+def line_layout(body):
+    """
+    Find the sequence lines in the body of a FASTA record.
+    Args:
+        body (bytes): the record after its header line
+
+    Returns:
+        (starts, lengths) numpy arrays giving the position of each non-empty
+        line in body and its length, excluding line endings
+    """
+    newlines = body.count(b'\n')
+    if newlines == 0 or (newlines == 1 and body[-1:] == b'\n'):
+        # The usual case of a sequence on one line.
+        length = len(body.rstrip(b'\r\n'))
+        if length == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return np.zeros(1, dtype=np.int64), np.array([length])
+    codes = np.frombuffer(body, dtype=np.uint8)
+    ends = np.flatnonzero(codes == ord('\n'))
+    if len(body) and body[-1:] != b'\n':
+        ends = np.append(ends, len(body))
+    starts = np.empty_like(ends)
+    starts[:1] = 0
+    starts[1:] = ends[:-1] + 1
+    lengths = ends - starts
+    has_cr = lengths > 0
+    has_cr[has_cr] = codes[ends[has_cr] - 1] == ord('\r')
+    lengths -= has_cr
+    keep = lengths > 0
+    return starts[keep], lengths[keep]
+
+
+class MappedFasta(ColumnStatistics):
+    """
+    A FASTA alignment read on demand from a memory-mapped file.
+
+    Offers the same interface to the display as AlignmentMatrix. Records
+    whose lines all have the same length, apart from the last one, are
+    indexed by the position of their first sequence line and the distance
+    between lines. Other records keep the position of each line.
+
+    Records are indexed by scan, which can run on another thread while the
+    display reads the records indexed so far.
+    """
+    def __init__(self, path):
+        """
+        Args:
+            path (str): path to a FASTA file, uncompressed or compressed with
+                bgzip
+
+        Returns: None
+        Raises:
+            IOError if the file can't be read
+            ValueError if the file is compressed other than with bgzip
+        """
+        self.path = path
+        self.compression = detect_compression(path)
+        if self.compression == 'bgzf':
+            self.map = BgzfReader(path)
+        elif self.compression is not None:
+            raise ValueError("Can't read {} compressed files at random "
+                    "positions".format(self.compression))
+        else:
+            self.handle = open(path, 'rb')
+            self.map = None
+            if self.handle.seek(0, 2) > 0:
+                self.map = mmap.mmap(self.handle.fileno(), 0,
+                        access=mmap.ACCESS_READ)
+        self.header_offsets = array('q')
+        self.id_lengths = array('l')
+        self.seq_offsets = array('q')
+        self.line_lengths = array('q')
+        self.line_strides = array('q')
+        # Line positions of irregularly wrapped records, by record index:
+        # (positions in the file, column at which each line starts)
+        self.irregular = {}
+        self.align_width = 0
+        self.num_seq = 0
+        self.max_id_len = 0
+        self.column_stats = {}
+
+    def __len__(self):
+        return self.num_seq
+
+    def scan(self, progress=None):
+        """
+        Index the records in the file, and count gaps and the residues of
+        each class in each column on the way.
+        Args:
+            progress (function): called with the number of bytes of the
+                file read so far after each record is indexed, if given
+
+        Returns: None
+        Raises:
+            IOError if the file can't be read
+            ValueError if the file isn't a valid alignment
+        """
+        # Rows waiting to be counted together, in one numpy.bincount:
+        pending = []
+        with open(self.path, 'rb') as raw:
+            handle = decompress_stream(raw, self.compression)
+            for header_offset, header, body_offset, body in \
+                    iter_records(handle):
+                words = header.split(None, 1)
+                id_length = len(words[0]) if words else 0
+                starts, lengths = line_layout(body)
+                seq_len = int(lengths.sum())
+                if self.num_seq == 0:
+                    self.align_width = seq_len
+                    counts = np.zeros((seq_len, NUM_CLASSES), dtype=np.int64)
+                    step = counting_rows(seq_len)
+                elif seq_len != self.align_width:
+                    raise ValueError("Sequence {} has length {}, "
+                        "expected {}".format(words[0].decode('utf-8',
+                            'replace'), seq_len, self.align_width))
+                residues = np.frombuffer(body.translate(None, b'\r\n'),
+                        dtype=np.uint8)
+                if len(residues) != seq_len:
+                    raise ValueError("Whitespace inside sequence lines is "
+                            "not supported")
+                pending.append(residues)
+                if len(pending) == step:
+                    counts += class_counts(np.stack(pending))
+                    pending = []
+                self.add_record(header_offset, id_length, body_offset, starts,
+                        lengths)
+                if progress is not None:
+                    progress(raw.tell())
+        if self.num_seq == 0:
+            raise ValueError("No sequences found")
+        if pending:
+            counts += class_counts(np.stack(pending))
+        # Gaps are the residues of class 0.
+        self.column_stats['gap_fractions'] = counts[:, 0] / self.num_seq
+        self.column_stats['class_counts'] = counts.astype(
+                counts_dtype(self.num_seq))
+        self.column_stats['entropy'] = entropy(counts)
+
+    def add_record(self, header_offset, id_length, body_offset, starts,
+            lengths):
+        """
+        Add a record to the index.
+        Args:
+            header_offset (int): position of the record's '>' in the file
+            id_length (int): length of the sequence id in bytes
+            body_offset (int): position of the line after the header
+            starts (numpy.ndarray): positions of the sequence lines, relative
+                to body_offset
+            lengths (numpy.ndarray): lengths of the sequence lines
+
+        Returns: None
+        """
+        i = self.num_seq
+        line_length = int(lengths[0]) if len(lengths) else 0
+        stride = int(starts[1] - starts[0]) if len(starts) > 1 else 0
+        regular = len(starts) < 2 or (starts[0] == 0 and
+                (lengths[:-1] == line_length).all() and
+                lengths[-1] <= line_length and
+                (np.diff(starts) == stride).all())
+        if not regular:
+            columns = np.zeros(len(lengths), dtype=np.int64)
+            np.cumsum(lengths[:-1], out=columns[1:])
+            self.irregular[i] = (starts + body_offset, columns)
+        self.header_offsets.append(header_offset)
+        self.id_lengths.append(id_length)
+        self.seq_offsets.append(body_offset)
+        self.line_lengths.append(line_length)
+        self.line_strides.append(stride)
+        if id_length > self.max_id_len:
+            self.max_id_len = id_length
+        self.num_seq = i + 1
+
+    def id(self, i):
+        """
+        Args:
+            i (int): index of a sequence
+
+        Returns:
+            str id of sequence i
+        """
+        start = self.header_offsets[i] + 1
+        return self.map[start:start + self.id_lengths[i]].decode('utf-8')
+
+    def max_id_length(self):
+        """
+        Returns:
+            int length of the longest sequence id, in bytes
+        """
+        return self.max_id_len
+
+    def row_bytes(self, i, left=0, right=None):
+        """
+        Args:
+            i (int): index of a sequence
+            left (int): index of the first column to return
+            right (int): index after the last column to return
+
+        Returns:
+            bytes residues of sequence i between columns left and right
+        """
+        if right is None or right > self.align_width:
+            right = self.align_width
+        if left >= right:
+            return b''
+        if i in self.irregular:
+            starts, columns = self.irregular[i]
+            first = np.searchsorted(columns, left, side='right') - 1
+            last = np.searchsorted(columns, right - 1, side='right') - 1
+            parts = []
+            for k in range(first, last + 1):
+                start = starts[k] + max(0, left - columns[k])
+                end = starts[k] + right - columns[k]
+                if k < len(columns) - 1:
+                    end = min(end, starts[k] + columns[k+1] - columns[k])
+                parts.append(self.map[start:end])
+            return b''.join(parts)
+        width = self.line_lengths[i]
+        stride = self.line_strides[i]
+        base = self.seq_offsets[i]
+        first = left // width
+        last = (right - 1) // width
+        start = base + first * stride
+        end = base + last * stride + min(width, self.align_width - last * width)
+        data = self.map[start:end]
+        if first != last:
+            data = data.translate(None, b'\r\n')
+        skip = left - first * width
+        return data[skip:skip + right - left]
+
+    def row(self, i, left=0, right=None):
+        """
+        Args:
+            i (int): index of a sequence
+            left (int): index of the first column to return
+            right (int): index after the last column to return
+
+        Returns:
+            str residues of sequence i between columns left and right
+        """
+        return self.row_bytes(i, left, right).decode('latin-1')
+
+    def rows(self, top, bottom, left=0, right=None):
+        """
+        Args:
+            top (int): index of the first sequence to return
+            bottom (int): index after the last sequence to return
+            left (int): index of the first column to return
+            right (int): index after the last column to return
+
+        Returns:
+            numpy.ndarray (bottom - top, right - left) uint8 character codes
+        """
+        if right is None or right > self.align_width:
+            right = self.align_width
+        bottom = min(bottom, self.num_seq)
+        block = np.empty((max(0, bottom - top), max(0, right - left)),
+                dtype=np.uint8)
+        for i in range(top, bottom):
+            block[i - top] = np.frombuffer(self.row_bytes(i, left, right),
+                    dtype=np.uint8)
+        return block
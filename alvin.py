@@ -26,17 +26,28 @@ Usage: python3 alvin.py -h
 """
 
 import argparse
+import asyncio
 import curses
+import os
 import signal
 import sys
+import time
 
+# Checked before importing the other modules, which all need NumPy, so this
+# can't use util.die either.
 try:
-    from Bio import AlignIO
+    import numpy
 except ImportError as e:
-    die("FATAL: BioPython is required.\n", e)
+    sys.stderr.write("FATAL: NumPy is required.\n\n[%s]\n" % e)
+    sys.exit(1)
 
 import vcolours
+from alncache import DiskCache
+from alnio import AlignmentLoader, choose_reader
+from compressed import detect_compression
 from msavis import MSAVis
+from profiling import Profiler
+from tasks import BackgroundTasks, run_in_thread, run_steps, wake_every
 from util import guess_format, guess_nucleotide, die, die_curses
 
 
@@ -50,6 +61,11 @@ class KilledException(Exception):
 
 
 
+# Keys which quit the program.
+QUIT_KEYS = ['q', 'Q', 'KEY_EXIT', 'KEY_CLOSE']
+
+
+
 def interrupt_handler(signal, frame):
     """
     We'll use this to handle getting interrupted by SIGINT
@@ -58,127 +74,403 @@ def interrupt_handler(signal, frame):
 
 
 
-def curses_main(stdscr, args):
+def check_loader(stdscr, loader, args):
+    """
+    Exit with an error message if the alignment could not be read.
+
+    Args:
+        stdscr :
+        loader (AlignmentLoader): loader reading the alignment
+        args : arguments passed along from argparse
+    """
+    if isinstance(loader.error, IOError):
+        die_curses(stdscr, " FATAL: Can't read from file [%s]" % args.aln_file,
+                loader.error)
+    elif loader.error is not None:
+        die_curses(stdscr, " FATAL: Can't read sequences in %s "
+                "format from file [%s]" % (args.format, args.aln_file),
+                loader.error)
+
+
+
+async def wait_for_first_screen(stdscr, loader, loaded):
+    """
+    Wait until a screenful of sequences has been read, or reading has
+    stopped, showing how much of the file has been read meanwhile. The
+    Biopython reader only has sequences once the whole file is parsed.
+
+    Args:
+        stdscr : with a timeout of 0 set
+        loader (AlignmentLoader): loader reading the alignment
+        loaded (asyncio.Future): resolved once the loader has finished
+
+    Returns:
+        False if the user quit while waiting, True otherwise
+    """
+    while not loader.done and loader.matrix.num_seq < curses.LINES:
+        if any(inkey in QUIT_KEYS for inkey in get_keys(stdscr)):
+            return False
+        lines, cols = stdscr.getmaxyx()
+        stdscr.erase()
+        stdscr.addstr(lines - 1, 0, loader.progress().ljust(cols - 1)[
+            :cols - 1], curses.A_REVERSE)
+        stdscr.refresh()
+        await asyncio.wait([loaded], timeout=0.1)
+    return True
+
+
+
+def get_key(stdscr):
+    """
+    Wait for a key press, as long as the timeout set on stdscr allows.
+
+    Args:
+        stdscr :
+
+    Returns:
+        the key pressed as a str, or None if no key was pressed in time
+    """
+    try:
+        return stdscr.getkey()
+    except curses.error:
+        return None
+
+
+
+def get_keys(stdscr):
+    """
+    Collect every key press waiting to be handled, without blocking.
+
+    Args:
+        stdscr : with a timeout of 0 set
+
+    Returns:
+        list of keys pressed, in order, empty if there are none
+    """
+    keys = []
+    inkey = get_key(stdscr)
+    while inkey is not None:
+        keys.append(inkey)
+        inkey = get_key(stdscr)
+    return keys
+
+
+
+def handle_key(stdscr, msaVis, args, inkey, pending):
+    """
+    Carry out the command for a key press.
+
+    Args:
+        stdscr :
+        msaVis (MSAVis): the display
+        args : arguments passed along from argparse
+        inkey (str): the key pressed
+        pending (list): keys pressed after inkey which have not been handled
+            yet. Keys which complete a command starting with inkey are
+            removed from it, so it must not be empty if inkey is 'g'.
+
+    Returns:
+        False if the key quits the program, True otherwise
+    """
+    msaVis.clear_message()
+    # quitting:
+    if inkey in QUIT_KEYS:
+        return False
+    # moving the cursor, while it is shown:
+    elif msaVis.cursor is not None and inkey in ['s', 'S', 'j', 'KEY_DOWN']:
+        msaVis.move_cursor(1, 0)
+    elif msaVis.cursor is not None and inkey in ["KEY_UP", 'w', 'W', 'k']:
+        msaVis.move_cursor(-1, 0)
+    elif msaVis.cursor is not None and \
+            inkey in ["KEY_RIGHT", "d", "D", 'l']:
+        msaVis.move_cursor(0, 1)
+    elif msaVis.cursor is not None and inkey in ["KEY_LEFT", "a", "A", 'h']:
+        msaVis.move_cursor(0, -1)
+    # moving around the alignment:
+    elif inkey in ['s', 'S', 'j', 'KEY_DOWN']:
+        msaVis.move_view_down()
+    elif inkey in ["KEY_UP", 'w', 'W', 'k']:
+        msaVis.move_view_up()
+    elif inkey in [ "KEY_RIGHT","d", "D", 'l']:
+        msaVis.move_view_right()
+    elif inkey in ["KEY_LEFT", "a", "A", 'h']:
+        msaVis.move_view_left()
+    elif inkey in ['g']:
+        inkey = pending.pop(0)
+        if inkey == 'g':
+            msaVis.move_view_top()
+    elif inkey in ['KEY_PPAGE']:
+        msaVis.move_view_top()
+    elif inkey in ['G', 'KEY_NPAGE']:
+        msaVis.move_view_bottom()
+    elif inkey in ['^', 'KEY_HOME']:
+        msaVis.move_view_begin_left()
+    elif inkey in ["$", 'KEY_END']:
+        msaVis.move_view_end_right()
+    # adjusting the width of the sequence id panel:
+    elif inkey in ["-"]:
+        msaVis.decrease_id_width()
+    elif inkey in ["+"]:
+        msaVis.increase_id_width()
+    elif inkey in ['0']:
+        msaVis.minimise_id_width()
+    elif inkey in ['=']:
+        msaVis.maximise_id_width()
+    # showing performance figures:
+    elif inkey in ['P']:
+        msaVis.toggle_latency()
+    # zooming out to an overview of the alignment, and back in:
+    elif inkey in ['z']:
+        msaVis.zoom_out()
+    elif inkey in ['Z']:
+        msaVis.zoom_in()
+    # showing a minimap of the whole alignment:
+    elif inkey in ['m']:
+        msaVis.toggle_minimap()
+    # searching the sequences for a motif, and moving between the hits:
+    elif inkey in ['/']:
+        msaVis.start_search()
+    elif inkey in ['n']:
+        msaVis.next_hit(1)
+    elif inkey in ['N']:
+        msaVis.next_hit(-1)
+    # finding a sequence by the start of its id:
+    elif inkey in ['f']:
+        msaVis.start_id_search()
+    # showing a cursor, and going to a column or residue number:
+    elif inkey in ['c']:
+        msaVis.toggle_cursor()
+    elif inkey in [':']:
+        msaVis.start_goto_column()
+    elif inkey in ['r']:
+        msaVis.start_goto_residue()
+    # changing colour scheme:
+    # Numeric keys have different effects based on terminal capabilities,
+    # and whether we're viewing protein or nucleotide sequences.
+    # 1: Dark background scheme suitable for the terminal and data
+    elif inkey == "1" and curses.has_colors():
+        if curses.can_change_color() and args.nucleotide:
+            vcolours.init_colours_nt_256_dark()
+        elif curses.can_change_color(): 
+            vcolours.init_colours_aa_256_dark()
+        elif args.nucleotide:
+            vcolours.init_colours_nt_xterm_dark()
+        else:
+            vcolours.init_colours_aa_xterm_dark()
+    # 2: Dark coloured scheme suitable for the terminal and data
+    elif inkey == "2" and curses.has_colors():
+        if curses.can_change_color() and args.nucleotide:
+            vcolours.init_colours_nt_256_dark_reverse()
+        elif curses.can_change_color(): 
+            vcolours.init_colours_aa_256_dark_reverse()
+        elif args.nucleotide:
+            vcolours.init_colours_nt_xterm_dark_reverse()
+        else:
+            vcolours.init_colours_aa_xterm_dark_reverse()
+    # 3: Light background scheme suitable for the terminal and data
+    elif inkey == "3" and curses.has_colors():
+        if curses.can_change_color() and args.nucleotide:
+            vcolours.init_colours_nt_256_light()
+        elif curses.can_change_color(): 
+            vcolours.init_colours_aa_256_light()
+        elif args.nucleotide:
+            vcolours.init_colours_nt_xterm_light()
+        else:
+            vcolours.init_colours_aa_xterm_light()
+    # 4: Light coloured scheme suitable for the terminal and data
+    elif inkey == "4" and curses.has_colors():
+        if curses.can_change_color() and args.nucleotide:
+            vcolours.init_colours_nt_256_light_reverse()
+        elif curses.can_change_color(): 
+            vcolours.init_colours_aa_256_light_reverse()
+        elif args.nucleotide:
+            vcolours.init_colours_nt_xterm_light_reverse()
+        else:
+            vcolours.init_colours_aa_xterm_light_reverse()
+    # 5: Black and white
+    elif inkey == "5" and curses.has_colors():
+        vcolours.init_alignment_colours_white()
+    if inkey in ["1", "2", "3", "4", "5"]:
+        msaVis.invalidate()
+    return True
+
+
+
+def curses_main(stdscr, args, profiler):
     """
     Handle file input, initialise the curses display and wait for user input.
 
     Args:
         stdscr :
         args : arguments passed along from argparse
+        profiler (Profiler): records how long each stage takes
         
-    Attempts to read an alignment, initialises an MSAVis object to display the
-    alignment, then enters a loop and waits for keyboard input.
+    Prepares to read the alignment, then runs the display in an asyncio
+    event loop (see run_viewer) until the user quits.
     """
     signal.signal(signal.SIGINT, interrupt_handler)
+    cache = None
+    if not args.no_disk_cache:
+        cache = DiskCache(args.disk_cache_dir,
+                args.disk_cache_size * 1024 * 1024)
     try:
-        alignment = AlignIO.read(args.aln_file, args.format)
+        loader = AlignmentLoader(args.aln_file, args.format, args.reader,
+                cache)
     except IOError as e:
         die_curses(stdscr, " FATAL: Can't read from file [%s]" % args.aln_file, e)
     except ValueError as e:
         die_curses(stdscr, " FATAL: Can't read sequences in %s "
                 "format from file [%s]" % (args.format, args.aln_file), e)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    tasks = BackgroundTasks()
+    try:
+        loop.run_until_complete(run_viewer(stdscr, args, loader, tasks,
+            profiler))
+    finally:
+        loop.run_until_complete(tasks.cancel_all())
+        loop.close()
+        if loader.stats is not None:
+            loader.stats.cancel()
+
+
+
+async def run_viewer(stdscr, args, loader, tasks, profiler):
+    """
+    Display the alignment and respond to user input until the user quits.
+
+    Args:
+        stdscr :
+        args : arguments passed along from argparse
+        loader (AlignmentLoader): loader for the alignment, not yet started
+        tasks (BackgroundTasks): tasks to run alongside the display
+        profiler (Profiler): records how long each stage takes
+
+    The display is redrawn whenever it is woken up: by input on stdin, the
+    terminal being resized, or background work finishing or making
+    progress. Reading the file happens on a background thread, so keys
+    are handled while it loads.
+    """
+    loop = asyncio.get_running_loop()
+    profiler.begin('read')
+    loaded = run_in_thread(loader.run)
+    stdscr.timeout(0)
+    with profiler.phase('read first screen'):
+        if not await wait_for_first_screen(stdscr, loader, loaded):
+            return
+    check_loader(stdscr, loader, args)
+    alignment = loader.matrix
     if args.nucleotide is False:
-        args.nucleotide = guess_nucleotide(alignment)
+        with profiler.phase('guess_nucleotide'):
+            args.nucleotide = guess_nucleotide(alignment)
 
     stdscr.refresh()
     ymax, xmax = curses.LINES-1, curses.COLS-1
 
     msaVis = MSAVis(0, 0, ymax, xmax, args.aln_file, alignment,
-            preserve_gaps=args.gapsym, nucleotide=args.nucleotide)
-
-
-    while True:
-        inkey = stdscr.getkey()
-        # quitting:
-        if inkey in ['q', 'Q', 'KEY_EXIT', 'KEY_CLOSE']:
-            break
-        # moving around the alignment:
-        elif inkey in ['s', 'S', 'j', 'KEY_DOWN']:
-            msaVis.move_view_down()
-        elif inkey in ["KEY_UP", 'w', 'W', 'k']:
-            msaVis.move_view_up()
-        elif inkey in [ "KEY_RIGHT","d", "D", 'l']:
-            msaVis.move_view_right()
-        elif inkey in ["KEY_LEFT", "a", "A", 'h']:
-            msaVis.move_view_left()
-        elif inkey in ['g']:
-            inkey = stdscr.getkey()
-            if inkey == 'g':
-                msaVis.move_view_top()
-            else:
-                continue
-        elif inkey in ['KEY_PPAGE']:
-            msaVis.move_view_top()
-        elif inkey in ['G', 'KEY_NPAGE']:
-            msaVis.move_view_bottom()
-        elif inkey in ['^', 'KEY_HOME']:
-            msaVis.move_view_begin_left()
-        elif inkey in ["$", 'KEY_END']:
-            msaVis.move_view_end_right()
-        # adjusting the width of the sequence id panel:
-        elif inkey in ["-"]:
-            msaVis.decrease_id_width()
-        elif inkey in ["+"]:
-            msaVis.increase_id_width()
-        elif inkey in ['0']:
-            msaVis.minimise_id_width()
-        elif inkey in ['=']:
-            msaVis.maximise_id_width()
-        # changing colour scheme:
-        # Numeric keys have different effects based on terminal capabilities,
-        # and whether we're viewing protein or nucleotide sequences.
-        # 1: Dark background scheme suitable for the terminal and data
-        elif inkey == "1" and curses.has_colors():
-            if curses.can_change_color() and args.nucleotide:
-                vcolours.init_colours_nt_256_dark()
-            elif curses.can_change_color(): 
-                vcolours.init_colours_aa_256_dark()
-            elif args.nucleotide:
-                vcolours.init_colours_nt_xterm_dark()
-            else:
-                vcolours.init_colours_aa_xterm_dark()
-        # 2: Dark coloured scheme suitable for the terminal and data
-        elif inkey == "2" and curses.has_colors():
-            if curses.can_change_color() and args.nucleotide:
-                vcolours.init_colours_nt_256_dark_reverse()
-            elif curses.can_change_color(): 
-                vcolours.init_colours_aa_256_dark_reverse()
-            elif args.nucleotide:
-                vcolours.init_colours_nt_xterm_dark_reverse()
-            else:
-                vcolours.init_colours_aa_xterm_dark_reverse()
-        # 3: Light background scheme suitable for the terminal and data
-        elif inkey == "3" and curses.has_colors():
-            if curses.can_change_color() and args.nucleotide:
-                vcolours.init_colours_nt_256_light()
-            elif curses.can_change_color(): 
-                vcolours.init_colours_aa_256_light()
-            elif args.nucleotide:
-                vcolours.init_colours_nt_xterm_light()
-            else:
-                vcolours.init_colours_aa_xterm_light()
-        # 4: Light coloured scheme suitable for the terminal and data
-        elif inkey == "4" and curses.has_colors():
-            if curses.can_change_color() and args.nucleotide:
-                vcolours.init_colours_nt_256_light_reverse()
-            elif curses.can_change_color(): 
-                vcolours.init_colours_aa_256_light_reverse()
-            elif args.nucleotide:
-                vcolours.init_colours_nt_xterm_light_reverse()
-            else:
-                vcolours.init_colours_aa_xterm_light_reverse()
-        # 5: Black and white
-        elif inkey == "5" and curses.has_colors():
-            vcolours.init_alignment_colours_white()
-       
-        # Know when the terminal has been resized:
-        if curses.is_term_resized(ymax+1, xmax+1):
-            stdscr.clear()
-            ymax, xmax = stdscr.getmaxyx()
-            curses.resizeterm(ymax, xmax)
-            ymax -= 1
-            xmax -= 1
-        msaVis.update(0, 0, ymax, xmax)
+            preserve_gaps=args.gapsym, nucleotide=args.nucleotide,
+            cache_size=args.cache_size * 1024 * 1024, debug=args.debug,
+            loader=None if loader.done else loader, stats=loader.stats,
+            profiler=profiler)
+    loading = not loader.done
+
+    wake = asyncio.Event()
+    wake.set()
+    # When input on stdin became readable, if it hasn't been read since, so
+    # that the latency of keys includes the time they wait for the loop,
+    # e.g. while other tasks run.
+    input_ready = None
+    def readable():
+        nonlocal input_ready
+        if input_ready is None:
+            input_ready = time.perf_counter()
+        wake.set()
+    loop.add_reader(sys.stdin.fileno(), readable)
+    # This replaces curses' own handler, so update its idea of the
+    # terminal size here.
+    def resized():
+        size = os.get_terminal_size(sys.stdin.fileno())
+        curses.resizeterm(size.lines, size.columns)
+        wake.set()
+    loop.add_signal_handler(signal.SIGWINCH, resized)
+    def finished(future):
+        profiler.end('read', 'read (%s)' % (
+            'disk cache' if loader.from_cache else loader.reader))
+        wake.set()
+    loaded.add_done_callback(finished)
+    if loading or loader.stats is not None:
+        tasks.start('progress', wake_every(wake, 0.1))
+
+    # keys waiting for the rest of a multi-key command
+    held = []
+    prefetched = None
+    try:
+        while True:
+            await wake.wait()
+            wake.clear()
+            woken = time.perf_counter()
+            if loading and loader.done:
+                check_loader(stdscr, loader, args)
+                msaVis.finish_loading(loader.stats)
+                loading = False
+            ready, input_ready = input_ready, None
+            # A held key doesn't count as a new key press when the display
+            # is woken by something else, e.g. progress.
+            read = get_keys(stdscr)
+            keys = held + read
+            pressed = bool(read)
+            held = []
+            # Movement commands only change the offsets of the view, so a
+            # burst of them is folded into one net move and drawn once.
+            while keys:
+                inkey = keys.pop(0)
+                # Keys typed into a prompt in the status bar are text:
+                if msaVis.prompt is not None:
+                    msaVis.prompt_key(inkey)
+                    continue
+                if inkey == 'g' and not keys:
+                    held = [inkey]
+                    break
+                if not handle_key(stdscr, msaVis, args, inkey, keys):
+                    return
+
+            # Know when the terminal has been resized:
+            if curses.is_term_resized(ymax+1, xmax+1):
+                stdscr.clear()
+                stdscr.refresh()
+                ymax, xmax = stdscr.getmaxyx()
+                curses.resizeterm(ymax, xmax)
+                ymax -= 1
+                xmax -= 1
+            # Run slow work, such as reducing an overview to zoom out to, on
+            # background threads, and draw its results once it is done.
+            for name, work in msaVis.take_work():
+                tasks.start(name, run_in_thread(work)).add_done_callback(
+                        lambda future: wake.set())
+            msaVis.update(0, 0, ymax, xmax)
+            # Redraw regularly while anything reports its progress.
+            if msaVis.load_progress() is None:
+                tasks.cancel('progress')
+            elif not tasks.running('progress'):
+                tasks.start('progress', wake_every(wake, 0.1))
+            if pressed:
+                # From the keys arriving until they have been drawn, or
+                # from waking if they were read before the loop saw them.
+                if ready is None:
+                    ready = woken
+                latency = time.perf_counter() - ready
+                profiler.record_latency(latency)
+                msaVis.record_latency(latency)
+            view = (msaVis.zoom, msaVis.offset_y, msaVis.offset_x, ymax,
+                    xmax)
+            tasks.cancel_stale(view)
+            # Render what the user is likely to look at next while idle.
+            if view != prefetched:
+                prefetched = view
+                tasks.start('prefetch', run_steps(msaVis.prefetch()), view)
+    finally:
+        loop.remove_reader(sys.stdin.fileno())
+        loop.remove_signal_handler(signal.SIGWINCH)
 
 
 
@@ -211,13 +503,60 @@ def main():
             action='store_true', default=False)
     parser.add_argument('--nucleotide', '-n', action='store_true',
             default=False, help="Nucleotide alignment.")
+    parser.add_argument('--reader',
+            choices=['auto', 'native', 'mmap', 'biopython'], default='auto',
+            help="Parser to read the alignment with. 'native' is a fast "
+            "reader for FASTA files. 'mmap' indexes a FASTA file and reads "
+            "sequences from it as they are displayed, for files too large "
+            "to load into memory. 'auto' uses 'mmap' for FASTA files over "
+            "4 GB, 'native' for other FASTA files and BioPython for other "
+            "formats (default: %(default)s).")
+    parser.add_argument('--cache-size', type=int, default=64, metavar='MB',
+            help="Memory budget for rendered parts of the alignment "
+            "(default: %(default)s MB).")
+    parser.add_argument('--no-disk-cache', action='store_true', default=False,
+            help="Don't cache parsed alignments on disk.")
+    parser.add_argument('--disk-cache-dir', metavar='DIR', default=None,
+            help="Directory to cache parsed alignments in "
+            "(default: ~/.cache/alvin).")
+    parser.add_argument('--disk-cache-size', type=int, default=2048,
+            metavar='MB', help="Size limit of the cache of parsed alignments "
+            "(default: %(default)s MB).")
+    parser.add_argument('--debug', action='store_true', default=False,
+            help="Show debugging information in the status bar.")
+    parser.add_argument('--profile', action='store_true', default=False,
+            help="On exit, print how long each stage of reading and "
+            "displaying the alignment took and how much memory it used, and "
+            "how long the display took to respond to key presses.")
+    parser.add_argument('--profile-stats', metavar='FILE', default=None,
+            help="Also save cProfile statistics of the main thread to FILE, "
+            "e.g. alvin.pstats. Implies --profile.")
     args = parser.parse_args()
+    profiler = Profiler(args.profile or args.profile_stats is not None,
+            args.profile_stats)
+    profiler.start()
 
     if args.format is None:
-        args.format = guess_format(args.aln_file)
+        with profiler.phase('guess_format'):
+            args.format = guess_format(args.aln_file)
         if args.format is None:
             die( "FATAL: can't determine format of %s. Try specifying the "
                     "alignment format manually.\n" % args.aln_file, None)
+    try:
+        reader = choose_reader(args.format, args.reader,
+                os.path.getsize(args.aln_file),
+                detect_compression(args.aln_file))
+    except ValueError as e:
+        die("FATAL: Can't read %s format with the %s reader.\n" % (
+            args.format, args.reader), e)
+    except OSError as e:
+        die("FATAL: Can't read from file [%s]\n" % args.aln_file, e)
+    if reader == 'biopython':
+        # Only imported when needed, as importing it slows down startup.
+        try:
+            import Bio
+        except ImportError as e:
+            die("FATAL: BioPython is required.\n", e)
     try:
         stdscr=curses.initscr()
         curses.noecho()
@@ -225,7 +564,7 @@ def main():
         stdscr.keypad(1)
         if curses.has_colors():
             curses.start_color()
-        curses_main(stdscr, args)
+        curses_main(stdscr, args, profiler)
     # don't print a stack trace if killed by, e.g, SIGINT
     # we just want to clean up the environment and quit
     except KilledException: 
@@ -237,6 +576,9 @@ def main():
         curses.echo()
         curses.nocbreak()
         curses.endwin()
+        profiler.stop()
+        if profiler.enabled:
+            sys.stderr.write(profiler.report())
     return 0
 
 
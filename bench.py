@@ -0,0 +1,459 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017 Gearóid Fox
+#
+# This file is part of Alvin.
+#
+# Alvin is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Alvin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Alvin.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Headless benchmarks for Alvin.
+
+Generates synthetic alignments of increasing size, then reads and displays
+each one against an off-screen stand-in for curses, measuring load time,
+MSAVis construction time, the latency of moving the view, and peak memory.
+Each alignment is measured in a separate process, so that peak memory
+figures don't carry over from one to the next.
+
+Results are written as JSON lines: a header describing the environment,
+followed by one record per alignment, so runs of different versions can be
+compared.
+
+Usage: python3 bench.py -h
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+import numpy as np
+
+
+FORMATS = ['fasta', 'stockholm', 'clustal', 'phylip']
+AMINO_ACIDS = b'ACDEFGHIKLMNPQRSTVWY'
+NUCLEOTIDES = b'ACGT'
+
+# Sequence of moves made through each alignment, repeated as needed.
+MOVES = (['move_view_down'] * 8 + ['move_view_right'] * 4 +
+        ['move_view_up'] * 8 + ['move_view_left'] * 4 +
+        ['move_view_bottom', 'move_view_end_right', 'move_view_top',
+            'move_view_begin_left'])
+
+
+
+def generate_alignment(num_seq, align_width, nucleotide=False,
+        gap_density=0.3, seed=0):
+    """
+    Generate a random alignment.
+
+    Each column gets its own gap fraction, spread evenly between none and
+    twice the gap density, so that columns vary as in real alignments.
+    Args:
+        num_seq (int): number of sequences
+        align_width (int): number of columns
+        nucleotide (bool): generate nucleotide rather than protein sequences
+        gap_density (float): average fraction of gaps in the alignment
+        seed (int): seed for the random number generator
+
+    Returns:
+        list of (id, sequence) tuples of str
+    """
+    rng = np.random.default_rng(seed)
+    alphabet = np.frombuffer(NUCLEOTIDES if nucleotide else AMINO_ACIDS,
+            np.uint8)
+    residues = alphabet[rng.integers(0, len(alphabet),
+        (num_seq, align_width))]
+    column_gaps = rng.uniform(0, min(1.0, 2 * gap_density), align_width)
+    residues[rng.random((num_seq, align_width)) < column_gaps] = ord('-')
+    return [("seq_%d" % i, residues[i].tobytes().decode('ascii'))
+            for i in range(num_seq)]
+
+
+def write_fasta(handle, records):
+    """ FASTA, with sequences wrapped at 60 characters """
+    for seq_id, seq in records:
+        handle.write(">%s\n" % seq_id)
+        for i in range(0, len(seq), 60):
+            handle.write(seq[i:i+60] + "\n")
+
+
+def write_stockholm(handle, records):
+    """ Stockholm, with each sequence on one line """
+    width = max(len(seq_id) for seq_id, seq in records) + 1
+    handle.write("# STOCKHOLM 1.0\n")
+    for seq_id, seq in records:
+        handle.write(seq_id.ljust(width) + seq + "\n")
+    handle.write("//\n")
+
+
+def write_clustal(handle, records):
+    """ CLUSTAL, in blocks of 60 columns """
+    width = max(len(seq_id) for seq_id, seq in records) + 6
+    align_width = len(records[0][1])
+    handle.write("CLUSTAL W (1.83) multiple sequence alignment\n\n\n")
+    for i in range(0, align_width, 60):
+        for seq_id, seq in records:
+            handle.write(seq_id.ljust(width) + seq[i:i+60] + "\n")
+        handle.write("\n")
+
+
+def write_phylip(handle, records):
+    """ Interleaved PHYLIP, with ids of up to 10 characters """
+    align_width = len(records[0][1])
+    handle.write(" %d %d\n" % (len(records), align_width))
+    def blocks(seq):
+        return " ".join(seq[i:i+10] for i in range(0, len(seq), 10))
+    for seq_id, seq in records:
+        handle.write(seq_id[:10].ljust(11) + blocks(seq[:50]) + "\n")
+    for i in range(50, align_width, 50):
+        handle.write("\n")
+        for seq_id, seq in records:
+            handle.write(" " * 11 + blocks(seq[i:i+50]) + "\n")
+
+
+WRITERS = {'fasta': write_fasta, 'stockholm': write_stockholm,
+        'clustal': write_clustal, 'phylip': write_phylip}
+
+
+def write_alignment(path, records, fmt):
+    """
+    Args:
+        path (str): file to write
+        records (list): (id, sequence) tuples
+        fmt (str): one of FORMATS
+
+    Returns: None
+    """
+    with open(path, 'w') as handle:
+        WRITERS[fmt](handle, records)
+
+
+
+class FakePad:
+    """
+    Off-screen stand-in for a curses pad. Checks writes are in bounds, as
+    curses does, and counts them, but doesn't keep their contents.
+    """
+    def __init__(self, module, nlines, ncols):
+        if nlines <= 0 or ncols <= 0:
+            raise module.error("newpad() returned NULL")
+        self.module = module
+        self.nlines = nlines
+        self.ncols = ncols
+
+    def addstr(self, y, x, text, attr=0):
+        # Like curses, text runs on to the following lines, and it is an
+        # error to run off the end of the pad.
+        if (y < 0 or x < 0 or y >= self.nlines or x >= self.ncols or
+                y * self.ncols + x + len(text) > self.nlines * self.ncols):
+            raise self.module.error("addstr() returned ERR")
+        self.module.stats['addstr'] += 1
+        self.module.stats['chars'] += len(text)
+
+    def erase(self):
+        pass
+
+    def getmaxyx(self):
+        return self.nlines, self.ncols
+
+    def noutrefresh(self, *args):
+        self.module.stats['noutrefresh'] += 1
+
+    def refresh(self, *args):
+        self.module.stats['noutrefresh'] += 1
+
+
+def fake_curses(lines, cols):
+    """
+    Make a module which stands in for curses, for the parts of it used to
+    draw the display, on a 256 colour terminal of a given size.
+    Args:
+        lines (int): height of the terminal
+        cols (int): width of the terminal
+
+    Returns:
+        module, with a stats dict counting the calls made to draw
+    """
+    module = types.ModuleType('curses')
+    module.error = type('error', (Exception,), {})
+    module.stats = {'addstr': 0, 'chars': 0, 'noutrefresh': 0,
+            'doupdate': 0}
+    module.LINES = lines
+    module.COLS = cols
+    module.A_NORMAL = 0
+    module.A_REVERSE = 1 << 18
+    module.A_BOLD = 1 << 21
+    for i, name in enumerate(['BLACK', 'RED', 'GREEN', 'YELLOW', 'BLUE',
+        'MAGENTA', 'CYAN', 'WHITE']):
+        setattr(module, 'COLOR_' + name, i)
+    module.has_colors = lambda: True
+    module.can_change_color = lambda: True
+    module.init_pair = lambda pair, fg, bg: None
+    module.init_color = lambda colour, r, g, b: None
+    module.color_pair = lambda pair: pair << 8
+    module.curs_set = lambda visibility: None
+    module.newpad = lambda nlines, ncols: FakePad(module, nlines, ncols)
+    def doupdate():
+        module.stats['doupdate'] += 1
+    module.doupdate = doupdate
+    return module
+
+
+def measure(path, lines, cols, moves, prefetch=False, workers=0):
+    """
+    Read and display an alignment off-screen, timing each stage. Replaces
+    curses with a fake, so must run in a process of its own.
+    Args:
+        path (str): alignment file
+        lines (int): height of the fake terminal
+        cols (int): width of the fake terminal
+        moves (int): number of moves to make through the alignment
+        prefetch (bool): prefetch tiles between moves, as the event loop
+            does while waiting for the next key
+        workers (int): also time computing the column statistics with a
+            pool of this many processes, if any
+
+    Returns:
+        dict of results
+    """
+    curses = fake_curses(lines, cols)
+    sys.modules['curses'] = curses
+    from alnio import read_alignment
+    from colstats import ColumnStatsJob
+    from msavis import MSAVis
+    from profiling import peak_memory, summarise
+    from util import guess_format, guess_nucleotide
+
+    result = {}
+    start = time.perf_counter()
+    fmt = guess_format(path)
+    result['guess_format_s'] = time.perf_counter() - start
+    result['guessed_format'] = fmt
+
+    start = time.perf_counter()
+    alignment = read_alignment(path, fmt)
+    result['read_s'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    nucleotide = guess_nucleotide(alignment)
+    result['guess_nucleotide_s'] = time.perf_counter() - start
+    result['guessed_nucleotide'] = bool(nucleotide)
+
+    if workers:
+        start = time.perf_counter()
+        ColumnStatsJob(alignment, workers).run()
+        result['column_stats_pool_s'] = time.perf_counter() - start
+        alignment.column_stats.clear()
+
+    start = time.perf_counter()
+    alignment.gap_fractions()
+    alignment.column_entropy()
+    result['column_stats_s'] = time.perf_counter() - start
+
+    ymax, xmax = lines - 1, cols - 1
+    start = time.perf_counter()
+    msaVis = MSAVis(0, 0, ymax, xmax, path, alignment,
+            nucleotide=nucleotide)
+    msaVis.update(0, 0, ymax, xmax)
+    result['msavis_init_s'] = time.perf_counter() - start
+
+    latencies = []
+    for i in range(moves):
+        if prefetch:
+            for _ in msaVis.prefetch():
+                pass
+        start = time.perf_counter()
+        getattr(msaVis, MOVES[i % len(MOVES)])()
+        msaVis.update(0, 0, ymax, xmax)
+        latencies.append(time.perf_counter() - start)
+    result['update_ms'] = summarise(seconds * 1000 for seconds in latencies)
+    result['tile_hit_rate'] = msaVis.seqPanel.tiles.hit_rate()
+    result['curses_calls'] = dict(curses.stats)
+    # On Linux, ru_maxrss carries over the parent's peak across fork and
+    # exec, so it would report the memory used generating the alignments.
+    peak = peak_memory()
+    if peak is None:
+        # ru_maxrss is in kilobytes on Linux, bytes on macOS.
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform != 'darwin':
+            peak *= 1024
+    result['peak_rss_mb'] = peak / (1024 * 1024)
+    return result
+
+
+def environment():
+    """
+    Returns:
+        dict describing the software being benchmarked
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=here,
+                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    try:
+        import Bio
+        biopython = Bio.__version__
+    except ImportError:
+        biopython = None
+    return {'record': 'environment', 'commit': commit,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__, 'biopython': biopython,
+            'platform': platform.platform()}
+
+
+def run_case(args, directory, fmt, num_seq, align_width):
+    """
+    Generate an alignment and measure it in a child process.
+    Args:
+        args : arguments passed along from argparse
+        directory (str): directory to write the alignment to
+        fmt (str): format to write it in
+        num_seq (int): number of sequences
+        align_width (int): number of columns
+
+    Returns:
+        dict of results
+    """
+    result = {'record': 'case', 'format': fmt, 'num_seq': num_seq,
+            'align_width': align_width, 'nucleotide': args.nucleotide,
+            'gap_density': args.gaps, 'lines': args.lines, 'cols': args.cols}
+    path = os.path.join(directory, "bench_%d_%d.%s" % (num_seq, align_width,
+        fmt))
+    records = generate_alignment(num_seq, align_width, args.nucleotide,
+            args.gaps, args.seed)
+    write_alignment(path, records, fmt)
+    del records
+    result['file_bytes'] = os.path.getsize(path)
+    command = [sys.executable, os.path.abspath(__file__), '--measure', path,
+            '--lines', str(args.lines), '--cols', str(args.cols),
+            '--moves', str(args.moves)]
+    if args.prefetch:
+        command.append('--prefetch')
+    if args.workers:
+        command.extend(['--workers', str(args.workers)])
+    child = subprocess.run(command, capture_output=True, text=True)
+    if child.returncode == 0:
+        result.update(json.loads(child.stdout))
+    else:
+        lines = child.stderr.strip().splitlines()
+        result['error'] = lines[-1] if lines else "exit status %d" % (
+                child.returncode)
+    os.remove(path)
+    return result
+
+
+def int_list(text):
+    """ Parse a comma-separated list of integers from the command line """
+    return [int(word) for word in text.split(',')]
+
+
+def main():
+    """
+    Handle command line arguments, then run the benchmarks, or measure a
+    single alignment when run as a child process with --measure.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark reading and "
+            "displaying synthetic alignments, without a terminal.")
+    parser.add_argument('--formats', default=','.join(FORMATS),
+            help="Comma-separated formats to benchmark (default: "
+            "%(default)s).")
+    parser.add_argument('--rows', type=int_list, default=[1000, 10000],
+            help="Comma-separated numbers of sequences (default: 1000,10000).")
+    parser.add_argument('--columns', type=int_list, default=[300, 3000],
+            help="Comma-separated alignment widths (default: 300,3000).")
+    parser.add_argument('--nucleotide', '-n', action='store_true',
+            default=False, help="Generate nucleotide alignments.")
+    parser.add_argument('--gaps', type=float, default=0.3,
+            help="Average fraction of gaps (default: %(default)s).")
+    parser.add_argument('--seed', type=int, default=0,
+            help="Random seed (default: %(default)s).")
+    parser.add_argument('--lines', type=int, default=50,
+            help="Height of the fake terminal (default: %(default)s).")
+    parser.add_argument('--cols', type=int, default=200,
+            help="Width of the fake terminal (default: %(default)s).")
+    parser.add_argument('--moves', type=int, default=200,
+            help="Moves to make through each alignment (default: "
+            "%(default)s).")
+    parser.add_argument('--prefetch', action='store_true', default=False,
+            help="Prefetch tiles between moves, as happens while waiting "
+            "for a key press.")
+    parser.add_argument('--workers', type=int, default=0, metavar='N',
+            help="Also time computing the column statistics with a pool of "
+            "N processes (default: don't).")
+    parser.add_argument('--output', '-o', default=None, metavar='FILE',
+            help="Write results to FILE instead of stdout, e.g. "
+            "bench_output.txt.")
+    parser.add_argument('--measure', metavar='PATH', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure is not None:
+        result = measure(args.measure, args.lines, args.cols, args.moves,
+                args.prefetch, args.workers)
+        print(json.dumps(result))
+        return 0
+
+    formats = args.formats.split(',')
+    for fmt in formats:
+        if fmt not in WRITERS:
+            parser.error("unknown format: %s" % fmt)
+    out = sys.stdout if args.output is None else open(args.output, 'w')
+    try:
+        out.write(json.dumps(environment()) + "\n")
+        with tempfile.TemporaryDirectory(prefix='alvin-bench-') as directory:
+            for fmt in formats:
+                for num_seq in args.rows:
+                    for align_width in args.columns:
+                        result = run_case(args, directory, fmt, num_seq,
+                                align_width)
+                        out.write(json.dumps(result) + "\n")
+                        out.flush()
+                        sys.stderr.write(describe(result) + "\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+
+def describe(result):
+    """
+    Args:
+        result (dict): results for one alignment
+
+    Returns:
+        str summarising the results on one line
+    """
+    name = "{format} {num_seq}x{align_width}".format(**result)
+    if 'error' in result:
+        return "{:<24} error: {}".format(name, result['error'])
+    return ("{:<24} read {:8.3f} s  init {:7.3f} s  update mean {:6.2f} ms "
+            "p95 {:6.2f} ms  peak RSS {:7.1f} MB".format(name,
+                result['read_s'], result['msavis_init_s'],
+                result['update_ms']['mean'], result['update_ms']['p95'],
+                result['peak_rss_mb']))
+
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017 Gearóid Fox
+#
+# This file is part of Alvin.
+#
+# Alvin is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Alvin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Alvin.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Column statistics of large alignments, computed by a pool of processes
+which each count the residues in a stripe of columns
+"""
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import math
+import multiprocessing
+from multiprocessing import shared_memory
+import os
+import numpy as np
+from alnmatrix import NUM_CLASSES, AlignmentMatrix, count_classes, \
+        counts_dtype, entropy
+
+# Alignments with fewer residues than this are summarised on one core, as
+# starting the processes would take longer than it saves.
+MIN_PARALLEL_RESIDUES = 256 * 1024 * 1024
+
+# Number of stripes given to each process, so that processes which finish
+# early can take more work, and the tracks fill in steadily.
+STRIPES_PER_WORKER = 4
+
+# Narrowest stripe, in columns, so that each row of a stripe is read in
+# whole cache lines.
+MIN_STRIPE_WIDTH = 64
+
+# Memory left free, beyond the copy of the residues in shared memory, for
+# the pool to be used: room for the worker processes and the counts.
+MEMORY_HEADROOM = 256 * 1024 * 1024
+
+# Largest number of residues in a stripe, unless it is as narrow as can be,
+# so that the tracks fill in steadily and a cancelled job stops soon.
+MAX_STRIPE_RESIDUES = 64 * 1024 * 1024
+
+
+def available_memory():
+    """
+    Returns:
+        bytes of memory which can be allocated without swapping, or None
+        where that can't be found out (it is read from /proc)
+    """
+    try:
+        with open('/proc/meminfo') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def default_workers(matrix):
+    """
+    The pool reads a copy of the residues in shared memory (see
+    AlignmentMatrix.share), so it is only used if there is room for the
+    copy.
+    Args:
+        matrix (AlignmentMatrix): MSA, completely loaded
+
+    Returns:
+        int number of processes worth summarising the columns of the
+        alignment with, 0 to summarise them in this process
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    size = matrix.num_seq * matrix.align_width
+    if cpus < 2 or size < MIN_PARALLEL_RESIDUES:
+        return 0
+    available = available_memory()
+    if available is not None and available < size + MEMORY_HEADROOM:
+        return 0
+    return cpus
+
+
+def stripe_counts(name, shape, left, right):
+    """
+    Count the residues of each class in a stripe of columns. Runs in a
+    worker process.
+    Args:
+        name (str): name of the shared memory block holding the residues
+        shape (tuple): (num_seq, align_width) of the residues
+        left (int): index of the first column of the stripe
+        right (int): index after the last column of the stripe
+
+    Returns:
+        (left, right, counts) with counts a (right - left, NUM_CLASSES)
+        numpy.ndarray, as in alnmatrix.count_classes
+    """
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        residues = np.ndarray(shape, dtype=np.uint8, buffer=block.buf)
+        counts = count_classes(AlignmentMatrix(residues), left, right)
+        del residues
+    finally:
+        block.close()
+    return left, right, counts
+
+
+class ColumnStatsJob:
+    """
+    Compute the class counts, gap fraction and entropy of each column of an
+    alignment in a pool of processes.
+
+    The residues are copied into shared memory, so that the processes read
+    them without the matrix being pickled. Until the matrix's own copy is
+    freed, this needs as much memory again as the residues; see
+    default_workers. Each process counts the residues
+    of each class in a stripe of columns. As each stripe finishes, its
+    statistics are filled in and it is added to the finished stripes, so
+    that other threads can draw the statistics as they arrive. Once every
+    stripe has finished, the statistics are stored in the matrix's
+    column_stats, unless the job was cancelled.
+    """
+    def __init__(self, matrix, workers):
+        """
+        Args:
+            matrix (AlignmentMatrix): MSA, completely loaded
+            workers (int): number of processes to use
+
+        Returns: None
+        """
+        self.matrix = matrix
+        self.workers = workers
+        width = matrix.align_width
+        stripe = max(MIN_STRIPE_WIDTH, min(
+            math.ceil(width / (workers * STRIPES_PER_WORKER)),
+            MAX_STRIPE_RESIDUES // max(1, matrix.num_seq)))
+        self.stripes = [(left, min(width, left + stripe))
+                for left in range(0, width, stripe)]
+        self.counts = np.zeros((width, NUM_CLASSES),
+                dtype=counts_dtype(matrix.num_seq))
+        self.gap_fractions = np.zeros(width)
+        self.entropy = np.zeros(width)
+        # (left, right) of each stripe whose statistics are filled in, in
+        # the order they finished. Only ever appended to.
+        self.finished = []
+        self.done = False
+        self.cancelled = False
+        self.pool = None
+        self.block = None
+
+    def run(self):
+        """
+        Compute the statistics, waiting until they are all done. Falls back
+        to computing them in this process if shared memory or processes
+        aren't available.
+
+        Returns: None
+        """
+        try:
+            self.run_pool()
+        except (OSError, ImportError, BrokenProcessPool):
+            if not self.cancelled:
+                self.run_serial()
+        finally:
+            self.done = True
+
+    def run_pool(self):
+        """
+        Compute the statistics in a pool of processes.
+
+        Returns: None
+        """
+        matrix = self.matrix
+        num_seq = matrix.num_seq
+        self.block = matrix.share()
+        try:
+            # Processes are spawned rather than forked, as forking copies the
+            # state of this process's other threads.
+            with ProcessPoolExecutor(max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn')) as pool:
+                self.pool = pool
+                futures = [pool.submit(stripe_counts, self.block.name,
+                    matrix.residues.shape, left, right)
+                    for left, right in self.stripes]
+                # In case the job was cancelled before the pool was made:
+                if self.cancelled:
+                    pool.shutdown(wait=False, cancel_futures=True)
+                for future in as_completed(futures):
+                    if future.cancelled():
+                        continue
+                    left, right, counts = future.result()
+                    self.counts[left:right] = counts
+                    self.gap_fractions[left:right] = counts[:, 0] / num_seq
+                    self.entropy[left:right] = entropy(counts)
+                    self.finished.append((left, right))
+        finally:
+            self.release()
+        if self.cancelled:
+            return
+        matrix.column_stats['class_counts'] = self.counts
+        matrix.column_stats['gap_fractions'] = self.gap_fractions
+        matrix.column_stats['entropy'] = self.entropy
+
+    def cancel(self):
+        """
+        Stop computing the statistics, e.g. on exit, without waiting for
+        the pool. Stripes which have started still finish.
+
+        Returns: None
+        """
+        self.cancelled = True
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+        self.release()
+
+    def release(self):
+        """
+        Unlink the shared memory block, if it hasn't been already. The
+        matrix keeps using the memory, which is freed once it is closed.
+
+        Returns: None
+        """
+        block, self.block = self.block, None
+        if block is not None:
+            block.unlink()
+
+    def run_serial(self):
+        """
+        Compute the statistics in this process.
+
+        Returns: None
+        """
+        self.counts[:] = self.matrix.column_class_counts()
+        self.gap_fractions[:] = self.matrix.gap_fractions()
+        self.entropy[:] = self.matrix.column_entropy()
+        self.finished.extend(stripe for stripe in self.stripes
+                if stripe not in self.finished)
+
+    def progress(self):
+        """
+        Returns:
+            str describing how many of the columns have been summarised
+        """
+        columns = sum(right - left for left, right in self.finished)
+        return "Column statistics: {}%".format(
+                100 * columns // max(1, self.matrix.align_width))
@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017 Gearóid Fox
+#
+# This file is part of Alvin.
+#
+# Alvin is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Alvin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Alvin.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Reading compressed alignment files.
+
+gzip and xz files are decompressed as a stream. BGZF files (as written by
+bgzip) are also gzip files, but are made of independently compressed
+blocks, so they can be read at random positions with the help of an index
+of the blocks, kept next to the file with the suffix '.gzi' as by htslib.
+"""
+
+from collections import OrderedDict
+import gzip
+import io
+import lzma
+import os
+import struct
+import threading
+import zlib
+import numpy as np
+
+
+GZIP_MAGIC = b'\x1f\x8b'
+XZ_MAGIC = b'\xfd7zXZ\x00'
+
+# Exceptions raised when a compressed file is corrupt or truncated, other
+# than IOError.
+DECOMPRESSION_ERRORS = (EOFError, lzma.LZMAError, zlib.error)
+
+# Number of decompressed BGZF blocks to keep in memory.
+BLOCK_CACHE_SIZE = 64
+
+
+def detect_compression(path):
+    """
+    Recognise a compressed file by its first bytes.
+    Args:
+        path (str): path to the file
+
+    Returns:
+        'bgzf', 'gzip' or 'xz', or None if the file isn't compressed
+    """
+    with open(path, 'rb') as handle:
+        header = handle.read(18)
+    if header.startswith(XZ_MAGIC):
+        return 'xz'
+    if not header.startswith(GZIP_MAGIC):
+        return None
+    # BGZF: gzip with extra fields (FLG.FEXTRA) and a 'BC' subfield.
+    if len(header) == 18 and header[3] & 4 and header[12:14] == b'BC':
+        return 'bgzf'
+    return 'gzip'
+
+
+def decompress_stream(raw, compression):
+    """
+    Args:
+        raw: file object opened in binary mode
+        compression (str): as returned by detect_compression
+
+    Returns:
+        a binary file object reading the decompressed contents of raw
+    """
+    if compression in ['gzip', 'bgzf']:
+        return gzip.GzipFile(fileobj=raw, mode='rb')
+    if compression == 'xz':
+        return lzma.LZMAFile(raw, mode='rb')
+    return raw
+
+
+def open_text(path):
+    """
+    Open a file, which may be compressed, for reading text.
+    Args:
+        path (str): path to the file
+
+    Returns:
+        a text file object
+    """
+    raw = open(path, 'rb')
+    return io.TextIOWrapper(decompress_stream(raw, detect_compression(path)),
+            encoding='utf-8', errors='replace')
+
+
+def read_block_header(handle):
+    """
+    Read the header of the BGZF block at the current position of handle.
+    Args:
+        handle: file object opened in binary mode
+
+    Returns:
+        int total size of the block in bytes, or None at the end of the file
+    Raises:
+        ValueError if the block isn't a BGZF block
+    """
+    header = handle.read(12)
+    if len(header) == 0:
+        return None
+    if len(header) < 12 or not header.startswith(GZIP_MAGIC) or \
+            not header[3] & 4:
+        raise ValueError("Not a BGZF file")
+    xlen, = struct.unpack('<H', header[10:12])
+    extra = handle.read(xlen)
+    pos = 0
+    while pos + 4 <= len(extra):
+        subfield = extra[pos:pos+2]
+        length, = struct.unpack('<H', extra[pos+2:pos+4])
+        if subfield == b'BC' and length == 2:
+            bsize, = struct.unpack('<H', extra[pos+4:pos+6])
+            return bsize + 1
+        pos += 4 + length
+    raise ValueError("Not a BGZF file")
+
+
+def build_bgzf_index(path):
+    """
+    Find the blocks of a BGZF file from their headers, without decompressing
+    them.
+    Args:
+        path (str): path to a BGZF file
+
+    Returns:
+        (compressed, uncompressed) int64 arrays of the offset at which each
+        block starts, in the file and in the decompressed contents, followed
+        by the size of the file and of the decompressed contents
+    Raises:
+        ValueError if the file isn't a BGZF file
+    """
+    compressed = [0]
+    uncompressed = [0]
+    with open(path, 'rb') as handle:
+        while True:
+            size = read_block_header(handle)
+            if size is None:
+                break
+            handle.seek(compressed[-1] + size - 4)
+            isize, = struct.unpack('<I', handle.read(4))
+            compressed.append(compressed[-1] + size)
+            uncompressed.append(uncompressed[-1] + isize)
+    return (np.array(compressed, dtype=np.int64),
+            np.array(uncompressed, dtype=np.int64))
+
+
+def read_gzi(path):
+    """
+    Read a BGZF index in htslib's .gzi format: the number of entries, then
+    the compressed and uncompressed offset of each block after the first, as
+    little-endian uint64s.
+    Args:
+        path (str): path to the .gzi file
+
+    Returns:
+        (compressed, uncompressed) int64 arrays of block offsets
+    """
+    with open(path, 'rb') as handle:
+        count, = struct.unpack('<Q', handle.read(8))
+        entries = np.frombuffer(handle.read(16 * count), dtype='<u8')
+    if len(entries) != 2 * count:
+        raise ValueError("Truncated index")
+    entries = entries.reshape(count, 2).astype(np.int64)
+    return (np.concatenate(([0], entries[:, 0])),
+            np.concatenate(([0], entries[:, 1])))
+
+
+def write_gzi(path, compressed, uncompressed):
+    """
+    Write a BGZF index in htslib's .gzi format.
+    Args:
+        path (str): path to the .gzi file
+        compressed (numpy.ndarray): offsets of blocks in the file
+        uncompressed (numpy.ndarray): offsets of blocks in the decompressed
+            contents
+
+    Returns: None
+    """
+    entries = np.empty((len(compressed) - 1, 2), dtype='<u8')
+    entries[:, 0] = compressed[1:]
+    entries[:, 1] = uncompressed[1:]
+    with open(path, 'wb') as handle:
+        handle.write(struct.pack('<Q', len(entries)))
+        handle.write(entries.tobytes())
+
+
+class BgzfReader:
+    """
+    Random access to the decompressed contents of a BGZF file.
+
+    Slicing a BgzfReader returns bytes of the decompressed contents, as
+    slicing an mmap of an uncompressed file does. It can be sliced from
+    several threads at once.
+    """
+    def __init__(self, path):
+        """
+        Reuses the file's .gzi index if it is up to date, or else builds the
+        index and tries to save it.
+        Args:
+            path (str): path to a BGZF file
+
+        Returns: None
+        Raises:
+            IOError if the file can't be read
+            ValueError if the file isn't a BGZF file
+        """
+        self.handle = open(path, 'rb')
+        gzi = path + '.gzi'
+        index = None
+        try:
+            if os.path.getmtime(gzi) >= os.path.getmtime(path):
+                index = read_gzi(gzi)
+        except (IOError, OSError, ValueError, struct.error):
+            index = None
+        if index is None:
+            self.compressed, self.uncompressed = build_bgzf_index(path)
+            try:
+                write_gzi(gzi, self.compressed, self.uncompressed)
+            except (IOError, OSError):
+                pass
+        else:
+            # A .gzi file doesn't record where the last block ends.
+            compressed, uncompressed = index
+            self.handle.seek(compressed[-1])
+            size = read_block_header(self.handle)
+            if size is None:
+                self.compressed, self.uncompressed = compressed, uncompressed
+            else:
+                self.handle.seek(compressed[-1] + size - 4)
+                isize, = struct.unpack('<I', self.handle.read(4))
+                self.compressed = np.append(compressed, compressed[-1] + size)
+                self.uncompressed = np.append(uncompressed,
+                        uncompressed[-1] + isize)
+        self.size = int(self.uncompressed[-1])
+        self.blocks = OrderedDict()
+        # Guards the file position and the cache of decompressed blocks.
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.size
+
+    def block(self, k):
+        """
+        Args:
+            k (int): index of a block
+
+        Returns:
+            bytes decompressed contents of block k
+        """
+        with self.lock:
+            data = self.blocks.get(k)
+            if data is not None:
+                self.blocks.move_to_end(k)
+                return data
+            start = int(self.compressed[k])
+            self.handle.seek(start)
+            raw = self.handle.read(int(self.compressed[k+1]) - start)
+        data = zlib.decompress(raw, 31)
+        with self.lock:
+            self.blocks[k] = data
+            if len(self.blocks) > BLOCK_CACHE_SIZE:
+                self.blocks.popitem(last=False)
+        return data
+
+    def __getitem__(self, index):
+        """
+        Args:
+            index (slice): range of positions in the decompressed contents
+
+        Returns:
+            bytes
+        """
+        start, stop, step = index.indices(self.size)
+        if step != 1:
+            raise ValueError("BgzfReader only supports contiguous slices")
+        if start >= stop:
+            return b''
+        first = np.searchsorted(self.uncompressed, start, side='right') - 1
+        last = np.searchsorted(self.uncompressed, stop - 1, side='right') - 1
+        parts = []
+        for k in range(first, last + 1):
+            offset = int(self.uncompressed[k])
+            parts.append(self.block(k)[max(0, start - offset):stop - offset])
+        return b''.join(parts)
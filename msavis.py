@@ -20,7 +20,158 @@
 from __future__ import division
 import curses
 from curses import error
+import math
+import re
+import time
+import numpy as np
 import vcolours 
+from alnmatrix import consensus, count_classes
+from overview import Overview, block_gap_fractions
+from profiling import Profiler, RecentLatencies, memory_in_use
+from search import IdIndex, ResidueIndex, ResidueNumbers
+from tilecache import TileCache, render_row
+
+# Gap fractions separating the levels of the gaps track. A column whose gap
+# fraction exceeds n of these bounds is drawn with GAP_GLYPHS[n].
+GAP_LEVELS = np.array([.11, .22, .33, .44, .55, .66, .77, .89])
+GAP_GLYPHS = np.array(["\u2588", "\u2587", "\u2586", "\u2585", "\u2584",
+        "\u2583", "\u2582", "\u2581", " "])
+
+# Shades of the minimap, from blocks of only gaps to blocks without gaps.
+MINIMAP_GLYPHS = np.array([" ", "\u2591", "\u2592", "\u2593", "\u2588"])
+
+
+def conservation(entropy, gap_fractions, nucleotide=False):
+    """
+    Score how conserved columns of an alignment are, from 0 for columns of
+    only gaps or of residues as varied as can be, to 1 for columns of one
+    residue without gaps.
+    Args:
+        entropy (numpy.ndarray): entropy of each column, see
+            AlignmentMatrix.column_entropy
+        gap_fractions (numpy.ndarray): fraction of gaps in each column
+        nucleotide (bool): the sequences are nucleotides rather than amino
+            acids, so that the residues in a column can vary less
+
+    Returns:
+        numpy.ndarray score of each column
+    """
+    max_entropy = np.log2(4 if nucleotide else 20)
+    scores = np.clip(1 - entropy / max_entropy, 0, 1)
+    return scores * (1 - gap_fractions)
+
+
+class ScrollTracker:
+    """
+    Estimate the direction and speed in which the view is scrolling, from
+    the moves made by the user.
+    """
+    # Moves further apart than this many seconds start a new scroll.
+    idle_time = 0.5
+    # Seconds of scrolling to prefetch ahead of the view.
+    lookahead = 0.25
+    # Largest number of pages to prefetch ahead of the view.
+    max_depth = 16
+
+    def __init__(self):
+        self.direction = (0, 0)
+        self.rate = 0.0
+        self.last = None
+
+    def record(self, dy, dx, now=None):
+        """
+        Record a move of the view.
+        Args:
+            dy (int): -1, 0 or 1 for a move up, across or down
+            dx (int): -1, 0 or 1 for a move left, vertically or right
+            now (float): time of the move in seconds, defaults to now
+
+        Returns: None
+        """
+        if now is None:
+            now = time.monotonic()
+        if (self.last is None or now - self.last > self.idle_time or
+                (dy, dx) != self.direction):
+            self.rate = 0.0
+        else:
+            # Smoothed number of moves per second. Keys handled in one
+            # batch arrive together, which counts as very fast scrolling.
+            interval = max(now - self.last, 0.001)
+            self.rate = (self.rate + 1 / interval) / 2
+        self.direction = (dy, dx)
+        self.last = now
+
+    def depth(self, now=None):
+        """
+        Args:
+            now (float): current time in seconds, defaults to now
+
+        Returns:
+            number of pages worth prefetching in the direction of scrolling
+        """
+        if now is None:
+            now = time.monotonic()
+        if self.last is None or now - self.last > self.idle_time:
+            return 1
+        return min(self.max_depth, 1 + int(self.rate * self.lookahead))
+
+
+class Prompt:
+    """
+    A line of text being typed into the status bar, e.g. a search pattern.
+    """
+    def __init__(self, label, on_enter, on_change=None, on_cancel=None):
+        """
+        Args:
+            label (str): shown before the text, e.g. "/"
+            on_enter: function called with the text when Enter is pressed
+            on_change: function called with the text after each edit, if
+                any, e.g. to narrow down matches as the text is typed
+            on_cancel: function called when the prompt is abandoned, if any
+
+        Returns: None
+        """
+        self.label = label
+        self.on_enter = on_enter
+        self.on_change = on_change
+        self.on_cancel = on_cancel
+        self.text = ""
+        # Shown after the text, e.g. the number of matches so far.
+        self.note = ""
+        self.active = True
+
+    def key(self, inkey):
+        """
+        Edit the text with a key press. Enter finishes the prompt, and
+        Escape, or Backspace when there is no text, abandons it.
+        Args:
+            inkey (str): the key pressed
+
+        Returns: None
+        """
+        text = self.text
+        if inkey in ['\n', '\r', 'KEY_ENTER']:
+            self.active = False
+            self.on_enter(self.text)
+        elif inkey == '\x1b' or (inkey in ['KEY_BACKSPACE', '\x7f', '\b']
+                and not self.text):
+            self.active = False
+            if self.on_cancel is not None:
+                self.on_cancel()
+        elif inkey in ['KEY_BACKSPACE', '\x7f', '\b']:
+            self.text = self.text[:-1]
+        elif len(inkey) == 1 and inkey.isprintable():
+            self.text += inkey
+        if self.active and self.text != text and self.on_change is not None:
+            self.on_change(self.text)
+
+    def display(self):
+        """
+        Returns:
+            str to show in the status bar
+        """
+        return self.label + self.text + self.note
+
 
 class MSAVis:
     """
@@ -36,13 +187,13 @@ class MSAVis:
                 y1 (int): bottom boundary
                 x1 (int): right boundary
                 filename (str): name of alignment file displayed
-                alignment (Bio.Align.MultipleSeqAlignment): MSA
+                alignment (AlignmentMatrix): MSA
 
             Returns: None
             """
             self.filename = filename
-            self.num_seq = len(alignment)
-            self.align_width = len(alignment[0])
+            self.alignment = alignment
+            self.align_width = alignment.align_width
             if curses.has_colors():
                 attr2 = curses.color_pair(2)
                 if not curses.can_change_color():
@@ -59,7 +210,9 @@ class MSAVis:
                     attr2)
             self.pad.noutrefresh(0, 0, y0, x0, y1, x1)
         
-        def update(self, y0, x0, y1, x1, offset_y, disp_height):
+        def update(self, y0, x0, y1, x1, offset_y, disp_height,
+                progress=None, debug_info=None, latency_info=None,
+                zoom_info=None, cursor_info=None, message=None, prompt=None):
             """
             Update how the status bar is drawn.
             Args:
@@ -71,6 +224,18 @@ class MSAVis:
                     sequence area.
                 disp_height (int): number of lines displayed in the sequence
                     area.
+                progress (str): progress of loading the alignment, if it is
+                    still loading.
+                debug_info (str): extra information to show, if any.
+                latency_info (str): performance figures to show at the right
+                    hand end of the bar, over the rest of the status, if any.
+                zoom_info (str): description of the zoom level, if zoomed
+                    out.
+                cursor_info (str): description of the position under the
+                    cursor, if it is shown.
+                message (str): outcome of the last command, if any.
+                prompt (str): text being typed into the bar, shown instead
+                    of the status, if any.
 
             Returns: None
             """
@@ -85,19 +250,41 @@ class MSAVis:
                 self.pad = curses.newpad(1, self.pad_width + 1)
 
             self.pad.addstr(0,0, " " * (x1 - x0 + 1), attr2)
-            if self.num_seq > disp_height:
+            num_seq = self.alignment.num_seq
+            if num_seq > disp_height:
                 viewmax = offset_y + disp_height
             else:
-                viewmax = self.num_seq
+                viewmax = num_seq
             status = "Viewing sequences: {}-{}/{}, Alignment length: {} [{}]"
             status = status.format(
-                    offset_y + 1, viewmax, self.num_seq, self.align_width,
+                    offset_y + 1, viewmax, num_seq, self.align_width,
                         self.filename)
+            if zoom_info is not None:
+                status += " " + zoom_info
+            if cursor_info is not None:
+                status += " " + cursor_info
+            if message is not None:
+                status += " " + message
+            if prompt is not None:
+                status = prompt
+            if progress is not None:
+                status += " " + progress
+            if debug_info is not None:
+                status += " " + debug_info
             self.pad.addstr(0, 0, status[0:self.pad_width], attr2)
+            if latency_info is not None:
+                width = x1 - x0 + 1
+                latency_info = latency_info[-width:]
+                self.pad.addstr(0, width - len(latency_info), latency_info,
+                        attr2 | curses.A_REVERSE)
             self.pad.noutrefresh(0, 0, y0, x0, y1, x1)
 
     class IDPanel:
         """ Panel displaying IDs of sequences in the alignment"""
+        # Extra rows painted above and below the visible window, so that
+        # small moves can be drawn without repainting.
+        margin_y = 16
+
         def __init__(self, y0, x0, y1, x1, alignment):
             """
             Args:
@@ -105,32 +292,43 @@ class MSAVis:
                 x0 (int): left boundary
                 y1 (int): bottom boundary
                 x1 (int): right boundary
-                alignment (Bio.Align.MultipleSeqAlignment): MSA
+                alignment (AlignmentMatrix): MSA
 
             Returns: None
             """
-            self.max_len = 0
-            for seq in alignment:
-                j = len(seq.id)
-                if j  > self.max_len:
-                    self.max_len = j
-            if self.max_len < 13:
-                self.max_len = 13
+            self.alignment = alignment
+            self.max_len = max(13, alignment.max_id_length())
             if self.max_len > 13:
                  self.width = 13
             else:
                  self.width = self.max_len - 1
+            self.pad = None
+            self.top = self.bottom = 0
+            self.update(y0, x0, y1, x1, 0)
+
+        def paint(self, top, bottom):
+            """
+            Paint the ids of sequences top to bottom - 1 into the pad.
+            Args:
+                top (int): index of the first sequence to paint
+                bottom (int): index after the last sequence to paint
+
+            Returns: None
+            """
             if curses.has_colors():
                 attr4 = curses.color_pair(4)
             else:
                 attr4 = curses.A_REVERSE
-            self.pad = curses.newpad(len(alignment)+1, self.max_len + 1)
-            j = 0
-            for seq in alignment:
-                self.pad.addstr(j, 0, (self.max_len + 1) * " ", attr4)
-                self.pad.addstr(j, 0, seq.id, attr4)
-                j += 1
-            self.pad.noutrefresh(0, 0, y0, x0, y1, x1)
+            height = bottom - top + 1
+            if self.pad is None or self.pad.getmaxyx()[0] < height:
+                self.pad = curses.newpad(height, self.max_len + 1)
+            else:
+                self.pad.erase()
+            for j in range(top, bottom):
+                self.pad.addstr(j - top, 0, (self.max_len + 1) * " ", attr4)
+                self.pad.addstr(j - top, 0, self.alignment.id(j), attr4)
+            self.top = top
+            self.bottom = bottom
 
         def update(self, y0, x0, y1, x1, offset):
             """
@@ -145,108 +343,92 @@ class MSAVis:
 
             Returns: None
             """
-            self.pad.noutrefresh(offset, 0, y0, x0, y1, x1)
+            if self.alignment.max_id_length() > self.max_len:
+                # A longer id has been loaded since the pad was painted.
+                self.max_len = self.alignment.max_id_length()
+                self.pad = None
+            num_seq = self.alignment.num_seq
+            end = min(num_seq, offset + y1 - y0 + 1)
+            if self.pad is None or offset < self.top or end > self.bottom:
+                self.paint(max(0, offset - self.margin_y),
+                        min(num_seq, end + self.margin_y))
+            self.pad.noutrefresh(offset - self.top, 0, y0, x0, y1, x1)
 
     
 
     class SeqPanel:
-        """Main panel displaying sequences of MSA"""
-        def __init__(self, y0, x0, y1, x1, alignment, preserve_gaps=False):
+        """
+        Main panel displaying sequences of MSA
+
+        Only the visible part of the alignment, plus a margin around it, is
+        painted into the pad, so memory use and drawing time depend on the
+        size of the terminal rather than the size of the alignment. The
+        residues are painted from a cache of rendered tiles.
+        """
+        # Extra rows and columns painted around the visible window, so that
+        # small moves can be drawn without repainting.
+        margin_y = 16
+        margin_x = 40
+
+        def __init__(self, y0, x0, y1, x1, alignment, preserve_gaps=False,
+                cache_size=64*1024*1024):
             """
             Args:
                 y0 (int): top boundary
                 x0 (int): left boundary
                 y1 (int): bottom boundary
                 x1 (int): right boundary
-                alignment (Bio.Align.MultipleSeqAlignment): MSA
+                alignment (AlignmentMatrix): MSA
                 preserve_gaps (bool): display the original gap characters from
                 MSA file, instead of displaying all gaps as '.' characters.
+                cache_size (int): memory budget in bytes for rendered tiles
 
             Returns: None
             """
-            if curses.has_colors():
-                attr11 = curses.color_pair(11)
+            self.tiles = TileCache(alignment, preserve_gaps=preserve_gaps,
+                    max_bytes=cache_size)
+            self.alignment = alignment
+            self.align_width = alignment.align_width
+            self.pad = None
+            self.top = self.bottom = 0
+            self.left = self.right = 0
+            self.update(y0, x0, y1, x1, 0, 0)
+
+        def paint(self, top, bottom, left, right):
+            """
+            Paint a block of the alignment into the pad.
+            Args:
+                top (int): index of the first sequence to paint
+                bottom (int): index after the last sequence to paint
+                left (int): index of the first column to paint
+                right (int): index after the last column to paint
+
+            Returns: None
+            """
+            height = bottom - top + 1
+            width = right - left
+            if self.pad is None:
+                self.pad = curses.newpad(height, width)
             else:
-                attr11 = curses.A_NORMAL
-            self.pad = curses.newpad(len(alignment)+1, len(alignment[0])+0)
-            y = 0
-            for seq in alignment: 
-                seq = str(seq.seq) 
-                x = 0  # counter for columns
-                hgap_count = 0; # count a run of '-' type gap symbols
-                pgap_count = 0; # count a run of '.' type gap symbols
-                for char in seq:
-                    if char == '-' and pgap_count == 0: # continue a run of '-'
-                        x += 1
-                        hgap_count += 1
-                        continue
-                    elif char == '.' and hgap_count == 0: # continue a run of '.'
-                        x += 1
-                        pgap_count += 1
-                        continue
-                    elif char not in ['.', '-'] and hgap_count != 0:
-                        # end of '-' gap
-                        if preserve_gaps:
-                            self.pad.addstr(y, x - hgap_count, '-' * hgap_count,
-                                    attr11 )
-                        else:
-                            self.pad.addstr(y, x - hgap_count, '.' * hgap_count,
-                                    attr11 )
-                        hgap_count = 0
-                    elif char not in ['.', '-'] and pgap_count != 0:
-                        # end of '.' gap
-                        self.pad.addstr(y, x - pgap_count, '.' * pgap_count,
-                                attr11 )
-                        pgap_count = 0
-                    elif char == '-' and pgap_count != 0:
-                        # run of '.'s changes to run of '-'s
-                        self.pad.addstr(y, x - pgap_count, '.' * pgap_count,
-                                attr11 )
-                        pgap_count = 0
-                        x += 1
-                        hgap_count += 1
-                        continue
-                    elif char == '.' and hgap_count != 0:
-                        # run of '-'s changes to run of '.'s
-                        if preserve_gaps:
-                            self.pad.addstr(y, x - hgap_count, '-' * hgap_count,
-                                    attr11 )
-                        else:
-                            self.pad.addstr(y, x - hgap_count, '.' * hgap_count,
-                                    attr11 )
-                        hgap_count = 0
-                        x += 1
-                        pgap_count += 1
-                        continue
-                    if char in vcolours.aa_dict: # recognised non-gap
-                        attr = curses.A_BOLD
-                        attr = curses.A_NORMAL
-                        if curses.has_colors():
-                            attr |= curses.color_pair(vcolours.aa_dict[char])
-                        self.pad.addstr(y, x, char, attr)
-                    else: # unrecognised non-gap
-                        self.pad.addstr(y, x, char, attr11)
-                    x += 1
-                # Trailing gaps:
-                if hgap_count and pgap_count:
-                    raise Exception
-                elif hgap_count:
-                    if preserve_gaps:
-                        self.pad.addstr(y, x - hgap_count, "-" * hgap_count,
-                                attr11)
-                    else:
-                        self.pad.addstr(y, x - hgap_count, "." * hgap_count,
-                                attr11)
-                elif pgap_count:
-                    self.pad.addstr(y, x - pgap_count, "." * pgap_count,
-                            attr11)
-                y += 1
-            self.height = y + 1
-            self.pad.noutrefresh(0, 0, y0, x0, y1, x1)
+                pad_height, pad_width = self.pad.getmaxyx()
+                if pad_height < height or pad_width < width:
+                    self.pad = curses.newpad(max(height, pad_height),
+                            max(width, pad_width))
+                else:
+                    self.pad.erase()
+            self.tiles.paint(self.pad, top, bottom, left, right)
+            self.top = top
+            self.bottom = bottom
+            self.left = left
+            self.right = right
 
-        def update(self, y0, x0, y1, x1, offset_y, offset_x):
+        def update(self, y0, x0, y1, x1, offset_y, offset_x, cursor=None):
             """
             Update how the sequence display panel is drawn.
+
+            Repaints the pad only if the requested window is not already
+            painted. The cursor is drawn by reversing the colours of its
+            position while the pad is copied to the screen.
             Args:
                 y0 (int): top boundary
                 x0 (int): left boundary
@@ -256,82 +438,374 @@ class MSAVis:
                     sequence area.
                 offset_x (int): index of leftmost column of MSA currently
                         displayed.
+                cursor (tuple): (sequence, column) index of the position to
+                    draw the cursor at, if any.
 
             Returns: None
             """
-            self.pad.noutrefresh(offset_y, offset_x, y0, x0, y1, x1)
+            num_seq = self.alignment.num_seq
+            end_y = min(num_seq, offset_y + y1 - y0 + 1)
+            end_x = min(self.align_width, offset_x + x1 - x0 + 1)
+            if (self.pad is None or offset_y < self.top or end_y > self.bottom
+                    or offset_x < self.left or end_x > self.right):
+                self.paint(max(0, offset_y - self.margin_y),
+                        min(num_seq, end_y + self.margin_y),
+                        max(0, offset_x - self.margin_x),
+                        min(self.align_width, end_x + self.margin_x))
+            attr = None
+            if cursor is not None and self.top <= cursor[0] < self.bottom \
+                    and self.left <= cursor[1] < self.right:
+                y, x = cursor[0] - self.top, cursor[1] - self.left
+                attr = self.pad.inch(y, x) & curses.A_ATTRIBUTES
+                self.pad.chgat(y, x, 1, attr ^ curses.A_REVERSE)
+            self.pad.noutrefresh(offset_y - self.top, offset_x - self.left,
+                    y0, x0, y1, x1)
+            if attr is not None:
+                self.pad.chgat(y, x, 1, attr)
 
 
     
-    class GapsTrack:
+    class ColumnTrack:
+        """
+        Base of the one line tracks above the sequences, which show
+        something about each column of the MSA.
+
+        As in SeqPanel, only the visible columns, plus a margin either side,
+        are painted into the pad, and the pad is repainted when the view
+        moves past them. curses can't make pads as wide as the largest
+        alignments. Subclasses say what to paint with render.
+        """
+        # Extra columns painted either side of the visible ones, so that
+        # small moves can be drawn without repainting.
+        margin_x = 40
+
+        def __init__(self, y0, x0, y1, x1, align_width):
+            """
+            Args:
+                y0 (int): top boundary
+                x0 (int): left boundary
+                y1 (int): bottom boundary
+                x1 (int): right boundary
+                align_width (int): number of columns in the alignment
+
+            Returns: None
+            """
+            self.align_width = align_width
+            self.pad = None
+            self.left = self.right = 0
+            # Whether what the painted columns show has changed.
+            self.stale = False
+            self.update(y0, x0, y1, x1, 0)
+
+        def render(self, left, right):
+            """
+            Args:
+                left (int): index of the first column to paint
+                right (int): index after the last column to paint
+
+            Returns:
+                list of (x, text, attr) runs of text to paint, with x
+                counted from left
+            """
+            raise NotImplementedError
+
+        def paint(self, left, right):
+            """
+            Paint some columns into the pad.
+            Args:
+                left (int): index of the first column to paint
+                right (int): index after the last column to paint
+
+            Returns: None
+            """
+            width = max(1, right - left)
+            if self.pad is None or self.pad.getmaxyx()[1] < width:
+                self.pad = curses.newpad(2, width)
+            else:
+                self.pad.erase()
+            for x, text, attr in self.render(left, right):
+                self.pad.addstr(0, x, text, attr)
+            self.left = left
+            self.right = right
+            self.stale = False
+
+        def changed(self, left, right):
+            """
+            Repaint the pad at the next update if some columns are painted in
+            it, e.g. once their statistics have been computed.
+            Args:
+                left (int): index of the first column which has changed
+                right (int): index after the last column which has changed
+
+            Returns: None
+            """
+            if left < self.right and right > self.left:
+                self.stale = True
+
+        def update(self, y0, x0, y1, x1, offset_x):
+            """
+            Redraw the track, repainting the pad only if the visible columns
+            aren't already painted.
+            Args:
+                y0 (int): top boundary
+                x0 (int): left boundary
+                y1 (int): bottom boundary
+                x1 (int): right boundary
+                offset_x (int): index of leftmost column of MSA currently
+                        displayed.
+            Returns: None
+            """
+            end = min(self.align_width, offset_x + x1 - x0 + 1)
+            if (self.pad is None or self.stale or offset_x < self.left
+                    or end > self.right):
+                self.paint(max(0, offset_x - self.margin_x),
+                        min(self.align_width, end + self.margin_x))
+            self.pad.noutrefresh(0, offset_x - self.left, y0, x0, y1, x1)
+
+    class GapsTrack(ColumnTrack):
         """
         Track showing the percentage of non-gap characters in each column of the 
         MSA
         """
-        def __init__(self, y0, x0, y1, x1, alignment):
+        def __init__(self, y0, x0, y1, x1, alignment, pending=False):
+            """
+            Args:
+                y0 (int): top boundary
+                x0 (int): left boundary
+                y1 (int): bottom boundary
+                x1 (int): right boundary
+                alignment (AlignmentMatrix): MSA
+                pending (bool): the gap fractions are still being computed,
+                    so leave the track blank until they are filled in
+
+            Returns: None
+            """
+            self.fractions = None
+            # Which columns' gap fractions are known, if not all of them.
+            self.known = None
+            if pending:
+                self.known = np.zeros(alignment.align_width, dtype=bool)
+            else:
+                self.fractions = alignment.gap_fractions()
+            super().__init__(y0, x0, y1, x1, alignment.align_width)
+
+        def fill(self, left, right, fractions):
+            """
+            Fill in the gap fractions of some columns, once they have been
+            computed.
+            Args:
+                left (int): index of the first column computed
+                right (int): index after the last column computed
+                fractions (numpy.ndarray): fraction of gaps in each column,
+                    computed for the columns filled in so far
+
+            Returns: None
+            """
+            self.fractions = fractions
+            self.known[left:right] = True
+            self.changed(left, right)
+
+        def render(self, left, right):
+            """
+            Args:
+                left (int): index of the first column to paint
+                right (int): index after the last column to paint
+
+            Returns:
+                list of (x, text, attr) runs of text to paint, see
+                ColumnTrack.render
+            """
+            if self.fractions is None:
+                return []
+            if curses.has_colors():
+                attr3 = curses.color_pair(3)
+            else:
+                attr3 = curses.A_NORMAL
+            levels = np.searchsorted(GAP_LEVELS, self.fractions[left:right])
+            glyphs = GAP_GLYPHS[levels]
+            if self.known is not None:
+                glyphs = np.where(self.known[left:right], glyphs, " ")
+            return [(0, "".join(glyphs), attr3)]
+
+    class ConservationTrack(ColumnTrack):
+        """
+        Track showing how conserved each column of the MSA is
+        """
+        def __init__(self, y0, x0, y1, x1, alignment, nucleotide=False,
+                pending=False):
             """
             Args:
                 y0 (int): top boundary
                 x0 (int): left boundary
                 y1 (int): bottom boundary
                 x1 (int): right boundary
-                alignment (Bio.Align.MultipleSeqAlignment): MSA
+                alignment (AlignmentMatrix): MSA
+                nucleotide (bool): the sequences are nucleotides rather than
+                    amino acids
+                pending (bool): the column statistics are still being
+                    computed, so leave the track blank until they are filled
+                    in
 
             Returns: None
             """
-            align_width = len(alignment[0])
-            num_seq = len(alignment)
-            self.pad = curses.newpad(2, align_width)
-            gap_count = {}
-            for seq in alignment:
-                seq = str(seq.seq)
-                for i in range(align_width):
-                    if i not in gap_count:
-                        gap_count[i] = 0
-                    if seq[i] in ['-', '.']:
-                        gap_count[i] += 1
+            self.nucleotide = nucleotide
+            self.entropy = self.gap_fractions = None
+            # Which columns' statistics are known, if not all of them.
+            self.known = None
+            if pending:
+                self.known = np.zeros(alignment.align_width, dtype=bool)
+            else:
+                self.entropy = alignment.column_entropy()
+                self.gap_fractions = alignment.gap_fractions()
+            super().__init__(y0, x0, y1, x1, alignment.align_width)
+
+        def fill(self, left, right, entropy, gap_fractions):
+            """
+            Fill in the statistics of some columns, once they have been
+            computed.
+            Args:
+                left (int): index of the first column computed
+                right (int): index after the last column computed
+                entropy (numpy.ndarray): entropy of each column, computed
+                    for the columns filled in so far
+                gap_fractions (numpy.ndarray): fraction of gaps in each
+                    column, likewise
+
+            Returns: None
+            """
+            self.entropy = entropy
+            self.gap_fractions = gap_fractions
+            self.known[left:right] = True
+            self.changed(left, right)
+
+        def render(self, left, right):
+            """
+            Args:
+                left (int): index of the first column to paint
+                right (int): index after the last column to paint
+
+            Returns:
+                list of (x, text, attr) runs of text to paint, see
+                ColumnTrack.render
+            """
+            if self.entropy is None:
+                return []
             if curses.has_colors():
                 attr3 = curses.color_pair(3)
             else:
                 attr3 = curses.A_NORMAL
-            for i in range(align_width):
-                pc = gap_count[i] / num_seq
-                if pc > .89:
-                    self.pad.addstr(0, i, " ", attr3)
-                elif pc > .77:
-                    self.pad.addstr(0, i, "\u2581", attr3)
-                elif pc > .66:
-                    self.pad.addstr(0, i, "\u2582", attr3)
-                elif pc > .55:
-                    self.pad.addstr(0, i, "\u2583", attr3)
-                elif pc > .44:
-                    self.pad.addstr(0, i, "\u2584", attr3)
-                elif pc > .33:
-                    self.pad.addstr(0, i, "\u2585", attr3)
-                elif pc > .22:
-                    self.pad.addstr(0, i, "\u2586", attr3)
-                elif pc > .11:
-                    self.pad.addstr(0, i, "\u2587", attr3)
-                else:
-                    self.pad.addstr(0, i, "\u2588", attr3)
-            self.pad.noutrefresh(0, 0, y0, x0, y1, x1)
-        
-        def update(self, y0, x0, y1, x1, offset_x):
-            """Redraw gaps track.
+            levels = np.searchsorted(GAP_LEVELS, 1 - conservation(
+                self.entropy[left:right], self.gap_fractions[left:right],
+                self.nucleotide))
+            glyphs = GAP_GLYPHS[levels]
+            if self.known is not None:
+                glyphs = np.where(self.known[left:right], glyphs, " ")
+            return [(0, "".join(glyphs), attr3)]
+
+    class ConsensusTrack(ColumnTrack):
+        """
+        Track showing the most common residue in each column of the MSA
+
+        The consensus is taken from the class counts of the columns once
+        they have been computed (see colstats). Until then, the residues are
+        counted a block of columns at a time as the blocks come into view,
+        and the consensus of each block counted is kept.
+        """
+        # Number of columns in a block.
+        block_width = 128
+
+        def __init__(self, y0, x0, y1, x1, alignment, preserve_gaps=False,
+                pending=False):
+            """
             Args:
                 y0 (int): top boundary
                 x0 (int): left boundary
                 y1 (int): bottom boundary
                 x1 (int): right boundary
-                offset_x (int): index of leftmost column of MSA currently
-                        displayed.
+                alignment (AlignmentMatrix): MSA, completely loaded
+                preserve_gaps (bool): display gaps as '-' rather than '.'
+                pending (bool): the column statistics are still being
+                    computed, and are filled in as they are
+
+            Returns: None
+            """
+            self.alignment = alignment
+            self.preserve_gaps = preserve_gaps
+            self.counts = None
+            # Which columns' class counts are known, if not all of them.
+            self.known = None
+            if pending:
+                self.known = np.zeros(alignment.align_width, dtype=bool)
+            else:
+                self.counts = alignment.column_stats.get('class_counts')
+            # Consensus of the blocks counted in view, by index.
+            self.blocks = {}
+            super().__init__(y0, x0, y1, x1, alignment.align_width)
+
+        def fill(self, left, right, counts):
+            """
+            Fill in the class counts of some columns, once they have been
+            computed.
+            Args:
+                left (int): index of the first column computed
+                right (int): index after the last column computed
+                counts (numpy.ndarray): (align_width, NUM_CLASSES) number of
+                    residues of each class in each column, computed for the
+                    columns filled in so far
+
             Returns: None
             """
-            self.pad.noutrefresh(0, offset_x, y0, x0, y1, x1)
+            self.counts = counts
+            self.known[left:right] = True
+            self.changed(left, right)
+
+        def block(self, k):
+            """
+            Args:
+                k (int): index of a block of columns
+
+            Returns:
+                bytes consensus of the block, from the stored class counts
+                if they are known, or else counted from the alignment
+            """
+            left = k * self.block_width
+            right = min(self.align_width, left + self.block_width)
+            if self.counts is not None and (self.known is None or
+                    self.known[left:right].all()):
+                return consensus(self.counts[left:right])
+            if k not in self.blocks:
+                self.blocks[k] = consensus(count_classes(self.alignment,
+                    left, right))
+            return self.blocks[k]
 
-    class PositionTrack:
+        def render(self, left, right):
+            """
+            Args:
+                left (int): index of the first column to paint
+                right (int): index after the last column to paint
+
+            Returns:
+                list of (x, text, attr) runs of text to paint, see
+                ColumnTrack.render
+            """
+            first = left // self.block_width
+            text = b"".join(self.block(k) for k in range(first,
+                math.ceil(right / self.block_width)))
+            skip = left - first * self.block_width
+            text = text[skip:skip + right - left].decode('latin-1')
+            if curses.has_colors():
+                attr_gap = curses.color_pair(11)
+                attr_dict = {char: curses.color_pair(pair)
+                        for char, pair in vcolours.aa_dict.items()}
+            else:
+                attr_gap = curses.A_NORMAL
+                attr_dict = {char: curses.A_NORMAL
+                        for char in vcolours.aa_dict}
+            return render_row(text, self.preserve_gaps, attr_gap, attr_dict)
+
+    class PositionTrack(ColumnTrack):
         """A one line track to mark column numbers in the alignment"""
-        def __init__(self, y0, x0, y1, x1, align_width):
+        def __init__(self, y0, x0, y1, x1, align_width, scale=1):
             """
             Args:
                 y0 (int): upper boundary for drawing
@@ -339,43 +813,170 @@ class MSAVis:
                 y1 (int): bottom boundary for drawing
                 x1 (int): right bottom for drawing
                 align_width (int): number of columns in alignment 
+                scale (int): number of alignment columns in each column of
+                    the track, when zoomed out
             Returns: None
             """
-            self.pad = curses.newpad(2, align_width)
-            if align_width <= 10:
-                position_string = "1" + (" " * (align_width - 1))
-            else:
-                position_string = "1" + (" " * 8)
-                topnum = int(align_width - (align_width % 10))
-                for i in range(1, topnum//10):
-                    position_string += str(i*10) + (" " * (9 - len(str(i))))
-                if align_width - topnum > len(str(topnum)):
-                   position_string += str(topnum)
-                padding =  align_width - len(position_string) + 1
-                if padding > 1:
-                    position_string += " " * padding
+            self.scale = scale
+            super().__init__(y0, x0, y1, x1, align_width)
+
+        def render(self, left, right):
+            """
+            Label the first column and every tenth column after it, the
+            labels starting at the columns they number. The last label is
+            left out unless there is a space after it.
+            Args:
+                left (int): index of the first column to paint
+                right (int): index after the last column to paint
+
+            Returns:
+                list of (x, text, attr) runs of text to paint, see
+                ColumnTrack.render
+            """
+            align_width = self.align_width
+            topnum = align_width - align_width % 10
+            line = [" "] * (right - left)
+            labels = [(0, "1")]
+            # Labels starting left of the columns painted can reach into
+            # them.
+            for number in range(max(10, (left // 10 - 1) * 10), right + 1,
+                    10):
+                label = str(number * self.scale)
+                if number < topnum or (number == topnum and
+                        align_width - topnum > len(label)):
+                    labels.append((number - 1, label))
+            for start, label in labels:
+                for x in range(max(start, left),
+                        min(start + len(label), right)):
+                    line[x - left] = label[x - start]
             if curses.has_colors():
                 attr1 = curses.color_pair(1)
             else:
                 attr1 = curses.A_NORMAL
-            self.pad.addstr(0, 0, position_string, attr1)
-            self.pad.noutrefresh(0, 0, y0, x0, y1, x1)
+            return [(0, "".join(line), attr1)]
+ 
+    class Minimap:
+        """
+        Pane showing the whole alignment shrunk to a few dozen positions,
+        shaded by the fraction of residues in each block of it, with the
+        part of the alignment in view marked.
 
-        def update(self, y0, x0, y1, x1, offset_x):
-            """Redraw position track 
+        The blocks are summarised once, by overview.block_gap_fractions,
+        which reads the whole alignment and so is run in the background;
+        updates only move the marker.
+        """
+        # Number of columns of blocks, not counting the space separating
+        # the pane from the sequences.
+        width = 24
+
+        @staticmethod
+        def size(y0, x0, y1, x1, alignment):
+            """
+            Args:
+                y0 (int): top boundary
+                x0 (int): left boundary, a space left of the blocks
+                y1 (int): bottom boundary
+                x1 (int): right boundary
+                alignment (AlignmentMatrix): MSA, completely loaded
+
+            Returns:
+                (height, width) number of rows and columns of blocks which
+                fit within the boundaries
+            """
+            return (max(1, min(y1 - y0 + 1, alignment.num_seq)),
+                    max(1, min(x1 - x0, alignment.align_width)))
+
+        def __init__(self, y0, x0, y1, x1, row_edges, col_edges, gaps):
+            """
+            Args:
+                y0 (int): top boundary
+                x0 (int): left boundary, a space left of the blocks
+                y1 (int): bottom boundary
+                x1 (int): right boundary
+                row_edges, col_edges, gaps: summary of the alignment from
+                    overview.block_gap_fractions, at the size given by
+                    size for these boundaries
+
+            Returns: None
+            """
+            height, width = gaps.shape
+            self.row_edges, self.col_edges = row_edges, col_edges
+            levels = np.ceil((1 - gaps) * (len(MINIMAP_GLYPHS) - 1))
+            self.lines = ["".join(row) for row in
+                    MINIMAP_GLYPHS[levels.astype(np.int64)]]
+            self.pad = curses.newpad(height + 1, width + 2)
+            self.marked = None
+            for j in range(height):
+                self.paint_row(j, None)
+
+        def paint_row(self, j, marker):
+            """
+            Paint a row of blocks into the pad.
+            Args:
+                j (int): index of the row of blocks
+                marker (tuple): (top, bottom, left, right) range of blocks
+                    to mark, bottom and right exclusive, or None
+
+            Returns: None
+            """
+            if curses.has_colors():
+                attr3 = curses.color_pair(3)
+            else:
+                attr3 = curses.A_NORMAL
+            line = self.lines[j]
+            self.pad.addstr(j, 0, " ", attr3)
+            self.pad.addstr(j, 1, line, attr3)
+            if marker is not None and marker[0] <= j < marker[1]:
+                left, right = marker[2], marker[3]
+                self.pad.addstr(j, 1 + left, line[left:right],
+                        attr3 | curses.A_REVERSE)
+
+        def blocks(self, edges, first, last):
+            """
+            Args:
+                edges (numpy.ndarray): first index of each block, followed
+                    by the end of the alignment
+                first (int): index of the first sequence or column in view
+                last (int): index after the last one in view
+
+            Returns:
+                (start, end) range of the blocks overlapping the view
+            """
+            start = int(np.searchsorted(edges, first, side='right')) - 1
+            end = int(np.searchsorted(edges, last, side='left'))
+            start = min(max(0, start), len(edges) - 2)
+            return start, max(start + 1, end)
+
+        def update(self, y0, x0, y1, x1, top, bottom, left, right):
+            """
+            Move the marker to the part of the alignment in view, and redraw
+            the pane.
             Args:
                 y0 (int): top boundary
                 x0 (int): left boundary
                 y1 (int): bottom boundary
                 x1 (int): right boundary
-                offset_x (int): index of leftmost column of MSA currently
-                        displayed.
+                top (int): index of the first sequence in view
+                bottom (int): index after the last sequence in view
+                left (int): index of the first column in view
+                right (int): index after the last column in view
+
             Returns: None
             """
-            self.pad.noutrefresh(0, offset_x, y0, x0, y1, x1)
- 
+            marker = self.blocks(self.row_edges, top, bottom) + \
+                    self.blocks(self.col_edges, left, right)
+            if marker != self.marked:
+                rows = set(range(marker[0], marker[1]))
+                if self.marked is not None:
+                    rows.update(range(self.marked[0], self.marked[1]))
+                for j in rows:
+                    self.paint_row(j, marker)
+                self.marked = marker
+            self.pad.noutrefresh(0, 0, y0, x0, y1, x1)
+
     def __init__(self, y0, x0, y1, x1, filename, alignment,
-            preserve_gaps=False, nucleotide=False):
+            preserve_gaps=False, nucleotide=False, cache_size=64*1024*1024,
+            debug=False, loader=None, stats=None, profiler=None):
         """
         Args:
             y0 (int): top boundary
@@ -383,12 +984,26 @@ class MSAVis:
             y1 (int): bottom boundary
             x1 (int): right boundary
             filename (str): name of alignment file displayed
-            alignment (Bio.Align.MultipleSeqAlignment): MSA
+            alignment (AlignmentMatrix): MSA
             preserve_gaps (bool): display the original gap characters from the
                 MSA file, instead of displaying all gaps as '.' characters.
+            nucleotide (bool): use nucleotide colour schemes.
+            cache_size (int): memory budget in bytes for rendered tiles of the
+                alignment.
+            debug (bool): show debugging information in the status bar.
+            loader (AlignmentLoader): loader still appending sequences to the
+                alignment, if any. Call finish_loading once it is done.
+            stats (ColumnStatsJob): job still computing the column
+                statistics of the alignment, if any. Its stripes of columns
+                are drawn in the tracks as they finish.
+            profiler (Profiler): records how long each panel takes to
+                create, if given.
 
         Returns: None
         """
+        if profiler is None:
+            profiler = Profiler(enabled=False)
+        self.profiler = profiler
         self.y0 = y0
         self.x0 = x0
         self.y1 = y1
@@ -397,8 +1012,67 @@ class MSAVis:
         self.offset_y = 0
         self.offset_x = 0
         self.nucleotide = nucleotide
-        self.total_seqs = len(alignment)
-        self.align_width = len(alignment[0])
+        self.debug = debug
+        # Layout and per-panel inputs at the last update, for redrawing only
+        # what has changed.
+        self.layout = None
+        self.drawn = {}
+        self.scroll = ScrollTracker()
+        # Performance figures for the latency overlay in the status bar.
+        self.show_latency = False
+        self.frame_time = None
+        self.key_latency = RecentLatencies()
+        self.alignment = alignment
+        self.loader = loader
+        self.stats_job = stats
+        # Number of the job's finished stripes drawn in the tracks so far.
+        self.stats_merged = 0
+        self.preserve_gaps = preserve_gaps
+        self.cache_size = cache_size
+        # The alignment, or an overview of it when zoomed out, and the
+        # number of sequences and columns in each position of it.
+        self.shown = alignment
+        self.zoom = (1, 1)
+        self.zoom_level = 0
+        # Overviews of the alignment by zoom factors, and the panels
+        # displaying the alignment itself while an overview is shown.
+        self.overviews = {}
+        self.full_panels = None
+        # Overview being reduced in the background to zoom out to, with the
+        # zoom level to show it at.
+        self.zoom_pending = None
+        # View offsets after the last zoom, and the centre of the view in
+        # the alignment which they were chosen for.
+        self.zoom_anchor = None
+        self.show_minimap = False
+        self.minimap = None
+        # Size in blocks of the minimap drawn, and of the last summary of
+        # the alignment for it, with the summary, which is made in the
+        # background (see summarise_minimap).
+        self.minimap_size = None
+        self.minimap_summary = None
+        self.minimap_pending = None
+        # Text being typed into the status bar, if any, and the outcome of
+        # the last command to report there.
+        self.prompt = None
+        self.message = None
+        # Index of the residues for searching, built in the background at
+        # the first search, the pattern waiting for it, and the hits of the
+        # last search with the one in view.
+        self.residue_index = None
+        self.search_pending = None
+        self.hits = None
+        self.hit = 0
+        # Index of the sequence ids, made at the first id search, and the
+        # view when the search started, to go back to if it is abandoned.
+        self.id_index = None
+        self.search_origin = None
+        # Work waiting to be started on background threads (see take_work).
+        self.work = []
+        # Position of the cursor in the alignment, if it is shown, and the
+        # numbers of the residues of the sequences it has been on.
+        self.cursor = None
+        self.residue_numbers = ResidueNumbers(alignment)
         
         try: # Not every terminal can make the cursor invisible:
             curses.curs_set(0)
@@ -427,15 +1101,19 @@ class MSAVis:
             self.bg.addstr(j, 0, line, attr1)
         self.bg.noutrefresh(0, 0, y0, x0, y1, x1)
 
-        self.bgcorner = curses.newpad(3, 13)
+        self.bgcorner = curses.newpad(4, 14)
         self.bgcorner.addstr(0, 0, " " * 13, attr3)
         self.bgcorner.addstr(1, 0, "Non-gap %    ", attr3)
-        self.bgcorner.noutrefresh(0, 0, y0, x0, 2, self.id_width) 
+        self.bgcorner.addstr(2, 0, "Conserved %  ", attr3)
+        self.bgcorner.addstr(3, 0, "Consensus    ", attr3)
+        self.bgcorner.noutrefresh(0, 0, y0, x0, 3, self.id_width) 
 
         position_y0 = position_y1 = y0
         gaps_y0 = gaps_y1 = position_y1 + 1
+        conservation_y0 = conservation_y1 = gaps_y1 + 1
+        consensus_y0 = consensus_y1 = conservation_y1 + 1
 
-        seq_y0 = id_y0 = gaps_y1 + 1
+        seq_y0 = id_y0 = consensus_y1 + 1
         status_y0 = status_y1 = y1
 
         if self.total_seqs < status_y0 - seq_y0:
@@ -445,21 +1123,40 @@ class MSAVis:
         self.view_height = seq_y1 - seq_y0 + 1
 
         # Quick to draw:
-        self.statusBar = MSAVis.StatusBar(status_y0, x0, status_y1, x1,
-                filename, alignment)
-        self.positionTrack = MSAVis.PositionTrack(position_y0,
-                x0 + self.id_width, position_y1, x1, self.align_width)
-        self.idPanel = MSAVis.IDPanel(id_y0, x0, id_y1, x0 + self.id_width-1,
-                alignment)
+        with profiler.phase('StatusBar'):
+            self.statusBar = MSAVis.StatusBar(status_y0, x0, status_y1, x1,
+                    filename, alignment)
+        with profiler.phase('PositionTrack'):
+            self.positionTrack = MSAVis.PositionTrack(position_y0,
+                    x0 + self.id_width, position_y1, x1, self.align_width)
+        with profiler.phase('IDPanel'):
+            self.idPanel = MSAVis.IDPanel(id_y0, x0, id_y1,
+                    x0 + self.id_width-1, alignment)
         curses.doupdate()
 
-        # Slow to draw:
-        self.gapTrack = MSAVis.GapsTrack(gaps_y0, x0 + self.id_width,
-                gaps_y1, x1, alignment)
-        self.seqPanel = MSAVis.SeqPanel(seq_y0, x0 + self.id_width, seq_y1,
-                x1, alignment, preserve_gaps=preserve_gaps)
+        # Slow to draw, and drawn once the whole alignment is loaded:
+        self.gapTrack = None
+        self.conservationTrack = None
+        self.consensusTrack = None
+        if loader is None:
+            pending = stats is not None
+            with profiler.phase('GapsTrack'):
+                self.gapTrack = MSAVis.GapsTrack(gaps_y0, x0 + self.id_width,
+                        gaps_y1, x1, alignment, pending)
+            with profiler.phase('ConservationTrack'):
+                self.conservationTrack = MSAVis.ConservationTrack(
+                        conservation_y0, x0 + self.id_width,
+                        conservation_y1, x1, alignment, nucleotide, pending)
+            with profiler.phase('ConsensusTrack'):
+                self.consensusTrack = MSAVis.ConsensusTrack(consensus_y0,
+                        x0 + self.id_width, consensus_y1, x1, alignment,
+                        preserve_gaps, pending)
+        with profiler.phase('SeqPanel'):
+            self.seqPanel = MSAVis.SeqPanel(seq_y0, x0 + self.id_width,
+                    seq_y1, x1, alignment, preserve_gaps=preserve_gaps,
+                    cache_size=cache_size)
         self.statusBar.update(status_y0, x0, status_y1, x1, self.offset_y,
-                self.view_height)
+                self.view_height, self.load_progress(), self.debug_info())
         curses.doupdate()
 
     def update(self, y0, x0, y1, x1):
@@ -473,17 +1170,23 @@ class MSAVis:
 
         Returns: None
         """
+        start = time.perf_counter()
         if self.offset_x < 0:
             self.offset_x = 0
         if self.offset_y < 0:
             self.offset_y = 0
+        self.merge_column_stats()
+        self.finish_zoom()
+        self.finish_search()
         if self.nucleotide:
             position_y0 = position_y1 = y0
             gaps_y0 = gaps_y1 = position_y1 + 1
         else:
             position_y0 = position_y1 = y0
             gaps_y0 = gaps_y1 = position_y1 + 1
-        seq_y0 = id_y0 = gaps_y1 + 1
+        conservation_y0 = conservation_y1 = gaps_y1 + 1
+        consensus_y0 = consensus_y1 = conservation_y1 + 1
+        seq_y0 = id_y0 = consensus_y1 + 1
         status_y0 = status_y1 = y1
 
         if self.total_seqs < status_y0 - seq_y0:
@@ -492,28 +1195,282 @@ class MSAVis:
             seq_y1 = id_y1 = status_y0 - 1
         self.view_height = seq_y1 - seq_y0 + 1
 
-        if curses.has_colors():
-            attr1 = curses.color_pair(1)
-        else:
-            attr1 = curses.A_NORMAL
+        # The minimap pane, if shown, takes columns from the right of the
+        # sequences and tracks.
+        seq_x1 = x1 - self.minimap_width(x1 - x0 + 1)
 
-        self.bg = curses.newpad(y1-y0+1, x1-x0+1)
-        line = " " * (x1 - x0 +1)
-        for j in range(y1 - y0 ):
-            self.bg.addstr(j, 0, line, attr1)
-        self.bg.noutrefresh(0, 0, y0, x0, y1, x1)
-        self.bgcorner.noutrefresh(0, 0, y0, x0, 3, self.id_width) 
+        # Only redraw the panels whose inputs have changed since they were
+        # last drawn, unless the layout has changed.
+        if (y0, x0, y1, x1, self.id_width, seq_x1) != self.layout:
+            self.layout = (y0, x0, y1, x1, self.id_width, seq_x1)
+            self.drawn = {}
+        if not self.drawn:
+            if curses.has_colors():
+                attr1 = curses.color_pair(1)
+            else:
+                attr1 = curses.A_NORMAL
+            self.bg = curses.newpad(y1-y0+1, x1-x0+1)
+            line = " " * (x1 - x0 +1)
+            for j in range(y1 - y0 ):
+                self.bg.addstr(j, 0, line, attr1)
+            self.bg.noutrefresh(0, 0, y0, x0, y1, x1)
+            self.bgcorner.noutrefresh(0, 0, y0, x0, 3, self.id_width) 
 
-        self.positionTrack.update(position_y0, x0 + self.id_width, position_y1,
-                x1, self.offset_x)
-        self.gapTrack.update(gaps_y0, x0 + self.id_width, gaps_y1, x1,
-                self.offset_x)
-        self.idPanel.update(id_y0, x0, id_y1, x0 + self.id_width, self.offset_y)
-        self.seqPanel.update(seq_y0, x0 + self.id_width, seq_y1, x1,
-                self.offset_y, self.offset_x)
-        self.statusBar.update(status_y0, x0, status_y1, x1, self.offset_y,
-                self.view_height)
+        num_seq = self.total_seqs
+        if self.damaged('position', self.offset_x):
+            self.positionTrack.update(position_y0, x0 + self.id_width,
+                    position_y1, seq_x1, self.offset_x)
+        if self.gapTrack is not None and \
+                self.damaged('gaps', self.offset_x, self.gapTrack,
+                    self.stats_merged):
+            self.gapTrack.update(gaps_y0, x0 + self.id_width, gaps_y1,
+                    seq_x1, self.offset_x)
+        if self.conservationTrack is not None and self.damaged('conservation',
+                self.offset_x, self.conservationTrack, self.stats_merged):
+            self.conservationTrack.update(conservation_y0, x0 + self.id_width,
+                    conservation_y1, seq_x1, self.offset_x)
+        if self.consensusTrack is not None and self.damaged('consensus',
+                self.offset_x, self.consensusTrack, self.stats_merged):
+            self.consensusTrack.update(consensus_y0, x0 + self.id_width,
+                    consensus_y1, seq_x1, self.offset_x)
+        if self.damaged('ids', self.offset_y, num_seq):
+            self.idPanel.update(id_y0, x0, id_y1, x0 + self.id_width,
+                    self.offset_y)
+        cursor = None
+        if self.cursor is not None:
+            cursor = (self.cursor[0] // self.zoom[0],
+                    self.cursor[1] // self.zoom[1])
+        if self.damaged('seqs', self.offset_y, self.offset_x, num_seq,
+                cursor):
+            self.seqPanel.update(seq_y0, x0 + self.id_width, seq_y1, seq_x1,
+                    self.offset_y, self.offset_x, cursor)
+        if seq_x1 < x1:
+            self.update_minimap(seq_y0, seq_x1 + 1, seq_y1, x1,
+                    seq_x1 - x0 - self.id_width + 1)
+        progress = self.load_progress()
+        debug_info = self.debug_info()
+        latency_info = self.latency_info()
+        zoom_info = self.zoom_info()
+        cursor_info = self.cursor_info()
+        # The status bar counts sequences of the alignment, not of overviews.
+        first_seq = self.offset_y * self.zoom[0]
+        disp_height = min(self.view_height * self.zoom[0],
+                self.alignment.num_seq - first_seq)
+        prompt = None
+        if self.prompt is not None:
+            prompt = self.prompt.display()
+        if self.damaged('status', first_seq, disp_height,
+                self.alignment.num_seq, progress, debug_info, latency_info,
+                zoom_info, cursor_info, self.message, prompt):
+            self.statusBar.update(status_y0, x0, status_y1, x1, first_seq,
+                    disp_height, progress, debug_info, latency_info, zoom_info,
+                    cursor_info, self.message, prompt)
         curses.doupdate()
+        self.frame_time = time.perf_counter() - start
+
+    def damaged(self, panel, *inputs):
+        """
+        Check whether a panel needs to be redrawn, and record that it will
+        be.
+        Args:
+            panel (str): name of the panel
+            inputs: everything that determines how the panel is drawn
+
+        Returns:
+            True if the panel has not been drawn with these inputs since the
+            whole display was last redrawn
+        """
+        if self.drawn.get(panel) == inputs:
+            return False
+        self.drawn[panel] = inputs
+        return True
+
+    def invalidate(self):
+        """
+        Redraw the whole display at the next update, e.g. after the colour
+        scheme changes.
+
+        Returns: None
+        """
+        self.drawn = {}
+
+    @property
+    def total_seqs(self):
+        """ Number of sequences loaded so far, or rows of the overview """
+        return self.shown.num_seq
+
+    @property
+    def align_width(self):
+        """ Number of columns in the alignment, or in the overview """
+        return self.shown.align_width
+
+    def finish_loading(self, stats=None):
+        """
+        Draw the parts of the display which need the whole alignment, once
+        the loader has finished. Takes effect at the next update.
+        Args:
+            stats (ColumnStatsJob): job still computing the column
+                statistics of the alignment, if any
+
+        Returns: None
+        """
+        self.loader = None
+        self.stats_job = stats
+        pending = stats is not None
+        with self.profiler.phase('GapsTrack'):
+            self.gapTrack = MSAVis.GapsTrack(self.y0 + 1,
+                    self.x0 + self.id_width, self.y0 + 1, self.x1,
+                    self.alignment, pending)
+        with self.profiler.phase('ConservationTrack'):
+            self.conservationTrack = MSAVis.ConservationTrack(self.y0 + 2,
+                    self.x0 + self.id_width, self.y0 + 2, self.x1,
+                    self.alignment, self.nucleotide, pending)
+        with self.profiler.phase('ConsensusTrack'):
+            self.consensusTrack = MSAVis.ConsensusTrack(self.y0 + 3,
+                    self.x0 + self.id_width, self.y0 + 3, self.x1,
+                    self.alignment, self.preserve_gaps, pending)
+
+    def merge_column_stats(self):
+        """
+        Draw the column statistics of the stripes which the ColumnStatsJob
+        has finished since the last update into the tracks.
+
+        Returns: None
+        """
+        job = self.stats_job
+        if job is None or self.gapTrack is None:
+            return
+        # Once the job is done, every stripe is in its list of finished ones.
+        done = job.done
+        finished = job.finished[self.stats_merged:]
+        for left, right in finished:
+            self.gapTrack.fill(left, right, job.gap_fractions)
+            self.conservationTrack.fill(left, right, job.entropy,
+                    job.gap_fractions)
+            self.consensusTrack.fill(left, right, job.counts)
+        self.stats_merged += len(finished)
+        if done:
+            self.stats_job = None
+
+    def load_progress(self):
+        """
+        Returns:
+            str describing progress of loading the alignment or computing
+            its column statistics, or None if neither is happening.
+        """
+        if self.loader is not None:
+            return self.loader.progress()
+        if self.stats_job is not None:
+            return self.stats_job.progress()
+        if self.zoom_pending is not None:
+            return self.zoom_pending[1].progress()
+        if self.search_pending is not None:
+            return self.residue_index.progress()
+        if self.minimap_width() and self.minimap_pending is not None and \
+                (self.minimap_summary is None or
+                    self.minimap_summary[0] != self.minimap_pending):
+            return "Summarising the alignment for the minimap..."
+        return None
+
+    def take_work(self):
+        """
+        Returns:
+            list of (name, function) pairs of slow work, such as reducing an
+            overview, for the caller to run on background threads. The
+            display is updated with its results once it is done. Each piece
+            of work is returned once.
+        """
+        work, self.work = self.work, []
+        return work
+
+    def debug_info(self):
+        """
+        Returns:
+            str describing the state of the display for debugging, or None if
+            debugging information is not requested.
+        """
+        if not self.debug:
+            return None
+        tiles = self.seqPanel.tiles
+        return "[tiles: {} cached, {:.0%} hits]".format(len(tiles.tiles),
+                tiles.hit_rate())
+
+    def toggle_latency(self):
+        """
+        Show or hide the latency overlay in the status bar.
+
+        Returns: None
+        """
+        self.show_latency = not self.show_latency
+
+    def record_latency(self, seconds):
+        """
+        Record the time from a key press until the update showing its effect
+        was drawn, for the latency overlay.
+        Args:
+            seconds (float): the latency
+
+        Returns: None
+        """
+        self.key_latency.record(seconds)
+
+    def latency_info(self):
+        """
+        Returns:
+            str for the latency overlay: the time taken to draw the last
+            frame, the latency of the last key press, the 95th percentile of
+            recent key press latencies and the memory in use; or None if the
+            overlay is hidden.
+        """
+        if not self.show_latency:
+            return None
+        def ms(seconds):
+            if seconds is None:
+                return "-"
+            return "{:.1f} ms".format(seconds * 1000)
+        info = "frame {}, key {}, p95 {}".format(ms(self.frame_time),
+                ms(self.key_latency.last()),
+                ms(self.key_latency.percentile(0.95)))
+        memory = memory_in_use()
+        if memory is not None:
+            info += ", mem {:.0f} MB".format(memory / 1e6)
+        return " " + info + " "
+
+    def prefetch(self):
+        """
+        Render the parts of the alignment the view is heading towards, before
+        they are displayed.
+
+        Pages of the alignment beyond the view are rendered in the direction
+        it last moved in, or below it if it hasn't moved yet. The faster the
+        view is scrolling, the further ahead this goes, up to the cache's
+        prefetch budget (see TileCache.prefetch).
+
+        Returns:
+            generator rendering one tile per step, so that the work can run
+            in the background between key presses and be abandoned when the
+            view moves
+        """
+        dy, dx = self.scroll.direction
+        if (dy, dx) == (0, 0):
+            dy = 1
+        depth = self.scroll.depth()
+        panel = self.seqPanel
+        view_width = self.x1 - self.id_width + 1 - self.minimap_width()
+        page_y = self.view_height * dy
+        page_x = view_width * dx
+        blocks = []
+        for page in range(1, depth + 1):
+            top = self.offset_y + page * page_y
+            left = self.offset_x + page * page_x
+            top, bottom = (max(0, top - panel.margin_y),
+                    min(self.total_seqs, top + self.view_height +
+                        panel.margin_y))
+            left, right = (max(0, left - panel.margin_x),
+                    min(self.align_width, left + view_width + panel.margin_x))
+            if bottom > top and right > left:
+                blocks.append((top, bottom, left, right))
+        return panel.tiles.prefetch(blocks)
 
     def move_view_left(self):
         """
@@ -522,15 +1479,17 @@ class MSAVis:
         self.offset_x -= 10
         if self.offset_x < 0: 
             self.offset_y = 0
+        self.scroll.record(0, -1)
 
     def move_view_right(self):
         """
         Move the view to the right by ten positions.
         """
-        view_width = self.x1 - self.id_width + 1
+        view_width = self.x1 - self.id_width + 1 - self.minimap_width()
         self.offset_x += 10
         if self.offset_x > self.align_width - view_width:
             self.offset_x = self.align_width - view_width
+        self.scroll.record(0, 1)
 
     def move_view_up(self):
         """
@@ -539,6 +1498,7 @@ class MSAVis:
         self.offset_y -= self.view_height
         if self.offset_y < 0:
             self.offset_y = 0
+        self.scroll.record(-1, 0)
 
     def move_view_down(self):
         """
@@ -547,6 +1507,7 @@ class MSAVis:
         self.offset_y += self.view_height
         if self.offset_y > self.total_seqs - self.view_height:
             self.offset_y = self.total_seqs - self.view_height
+        self.scroll.record(1, 0)
 
     def move_view_bottom(self):
         """
@@ -564,7 +1525,7 @@ class MSAVis:
         """
         Move the view to the last column of the MSA.
         """
-        view_width = self.x1 - self.id_width + 1
+        view_width = self.x1 - self.id_width + 1 - self.minimap_width()
         self.offset_x = self.align_width - view_width
 
     def move_view_begin_left(self):
@@ -601,3 +1562,593 @@ class MSAVis:
         Set width of display of sequence ids to zero.
         """
         self.id_width = 0
+
+    def view_size(self):
+        """
+        Returns:
+            (height, width) of the area displaying the sequences, when
+            there are enough sequences to fill it
+        """
+        if self.layout is None:
+            y0, x0, y1, x1 = self.y0, self.x0, self.y1, self.x1
+        else:
+            y0, x0, y1, x1, id_width, seq_x1 = self.layout
+        return max(1, y1 - y0 - 4), max(1, x1 - x0 - self.id_width + 1 -
+            self.minimap_width(x1 - x0 + 1))
+
+    def zoom_factors(self, level):
+        """
+        Args:
+            level (int): zoom level, 0 for the alignment itself
+
+        Returns:
+            (rows, cols) number of sequences and columns in each position
+            shown at that level. Each level doubles them, until the whole
+            alignment fits in the view.
+        """
+        height, width = self.view_size()
+        max_rows = max(1, math.ceil(self.alignment.num_seq / height))
+        max_cols = max(1, math.ceil(self.alignment.align_width / width))
+        return min(2 ** level, max_rows), min(2 ** level, max_cols)
+
+    def zoom_out(self):
+        """
+        Show twice as many sequences and columns in each position, unless
+        the whole alignment is already in view. Not available while the
+        alignment is loading, its column statistics are being computed or
+        an overview is being reduced.
+        """
+        if self.loader is not None or self.stats_job is not None or \
+                self.zoom_pending is not None:
+            return
+        if self.zoom_factors(self.zoom_level + 1) != self.zoom:
+            self.set_zoom(self.zoom_level + 1)
+
+    def zoom_in(self):
+        """
+        Show half as many sequences and columns in each position, or stop
+        zooming out if an overview is being reduced.
+        """
+        if self.zoom_pending is not None:
+            self.zoom_pending[1].cancel()
+            self.zoom_pending = None
+            self.profiler.end('Overview', 'Overview (cancelled)')
+            return
+        level = self.zoom_level - 1
+        while level > 0 and self.zoom_factors(level) == self.zoom:
+            level -= 1
+        if level >= 0:
+            self.set_zoom(level)
+
+    def set_zoom(self, level):
+        """
+        Switch to a zoom level, keeping the part of the alignment at the
+        centre of the view in the centre. The overview of the alignment
+        at each zoom level is reduced in the background the first time it
+        is needed, and kept; the switch happens once it is ready (see
+        finish_zoom).
+        Args:
+            level (int): zoom level, 0 for the alignment itself
+
+        Returns: None
+        """
+        factors = self.zoom_factors(level)
+        if factors != (1, 1) and factors not in self.overviews:
+            overview = Overview(self.alignment, *factors)
+            self.zoom_pending = (level, overview)
+            self.work.append(('overview', overview.reduce))
+            self.profiler.begin('Overview')
+            return
+        height, width = self.view_size()
+        if self.zoom_anchor is not None and \
+                self.zoom_anchor[:2] == (self.offset_y, self.offset_x):
+            # The view hasn't moved since the last zoom, so keep the same
+            # centre, even if the view couldn't be centred on it.
+            centre_y, centre_x = self.zoom_anchor[2:]
+        else:
+            rows, cols = self.zoom
+            centre_y = (self.offset_y + min(height, self.total_seqs) / 2) * \
+                    rows
+            centre_x = (self.offset_x + width / 2) * cols
+        if self.full_panels is None:
+            self.full_panels = (self.positionTrack, self.gapTrack,
+                    self.conservationTrack, self.consensusTrack,
+                    self.idPanel, self.seqPanel)
+        rows, cols = factors
+        if (rows, cols) == (1, 1):
+            self.shown = self.alignment
+            (self.positionTrack, self.gapTrack, self.conservationTrack,
+                    self.consensusTrack, self.idPanel,
+                    self.seqPanel) = self.full_panels
+        else:
+            self.shown = self.overviews[rows, cols]
+            y0, x0, y1, x1 = self.y0, self.x0, self.y1, self.x1
+            seq_x1 = x1
+            if self.layout is not None:
+                y0, x0, y1, x1, id_width, seq_x1 = self.layout
+            x0 += self.id_width
+            self.positionTrack = MSAVis.PositionTrack(y0, x0, y0, seq_x1,
+                    self.shown.align_width, scale=cols)
+            self.gapTrack = MSAVis.GapsTrack(y0 + 1, x0, y0 + 1, seq_x1,
+                    self.shown)
+            self.conservationTrack = MSAVis.ConservationTrack(y0 + 2, x0,
+                    y0 + 2, seq_x1, self.shown, self.nucleotide)
+            self.consensusTrack = MSAVis.ConsensusTrack(y0 + 3, x0, y0 + 3,
+                    seq_x1, self.shown, self.preserve_gaps)
+            self.idPanel = MSAVis.IDPanel(y0 + 4, self.x0, y1 - 1, x0,
+                    self.shown)
+            self.seqPanel = MSAVis.SeqPanel(y0 + 4, x0, y1 - 1, seq_x1,
+                    self.shown, preserve_gaps=self.preserve_gaps,
+                    cache_size=self.cache_size)
+        self.zoom = (rows, cols)
+        self.zoom_level = level
+        view_height = min(height, self.total_seqs)
+        self.offset_y = max(0, min(self.total_seqs - view_height,
+            int(centre_y / rows - view_height / 2)))
+        self.offset_x = max(0, min(self.align_width - width,
+            int(centre_x / cols - width / 2)))
+        self.zoom_anchor = (self.offset_y, self.offset_x, centre_y, centre_x)
+        self.invalidate()
+
+    def finish_zoom(self):
+        """
+        Switch to the zoom level of the overview being reduced, once it is
+        ready.
+
+        Returns: None
+        """
+        if self.zoom_pending is None or not self.zoom_pending[1].done:
+            return
+        level, overview = self.zoom_pending
+        self.zoom_pending = None
+        self.profiler.end('Overview')
+        self.overviews[overview.block_rows, overview.block_cols] = overview
+        self.set_zoom(level)
+
+    def zoom_info(self):
+        """
+        Returns:
+            str describing the zoom level, or None if not zoomed out
+        """
+        if self.zoom == (1, 1):
+            return None
+        return "[zoom: {}x{} per position]".format(*self.zoom)
+
+    def minimap_width(self, screen_width=None):
+        """
+        Args:
+            screen_width (int): width of the display, defaults to its width
+                when it was created
+
+        Returns:
+            int number of columns taken by the minimap pane, 0 if it is
+            hidden, if the alignment is still loading, or if the display is
+            too narrow for it
+        """
+        if screen_width is None:
+            screen_width = self.x1 - self.x0 + 1
+        width = MSAVis.Minimap.width + 1
+        if (not self.show_minimap or self.loader is not None or
+                screen_width < 3 * width):
+            return 0
+        return width
+
+    def toggle_minimap(self):
+        """
+        Show or hide the minimap pane.
+
+        Returns: None
+        """
+        self.show_minimap = not self.show_minimap
+
+    def update_minimap(self, y0, x0, y1, x1, view_width):
+        """
+        Draw the minimap pane, with the part of the alignment in view
+        marked. The alignment is summarised for the minimap in the
+        background the first time it is shown, and again only if the space
+        for it changes; the pane is left blank until then.
+        Args:
+            y0 (int): top boundary
+            x0 (int): left boundary
+            y1 (int): bottom boundary
+            x1 (int): right boundary
+            view_width (int): number of columns displayed in the sequence
+                area
+
+        Returns: None
+        """
+        size = MSAVis.Minimap.size(y0, x0, y1, x1, self.alignment)
+        if self.minimap is None or self.minimap_size != size:
+            summary = self.minimap_summary
+            if summary is None or summary[0] != size:
+                if self.minimap_pending != size:
+                    self.minimap_pending = size
+                    self.work.append(('minimap',
+                        lambda: self.summarise_minimap(size)))
+                    self.profiler.begin('Minimap')
+                return
+            self.minimap = MSAVis.Minimap(y0, x0, y1, x1, *summary[1])
+            self.minimap_size = size
+            self.profiler.end('Minimap')
+            self.drawn.pop('minimap', None)
+        # The view in sequences and columns of the alignment itself:
+        rows, cols = self.zoom
+        top = self.offset_y * rows
+        bottom = min(self.alignment.num_seq,
+                (self.offset_y + self.view_height) * rows)
+        left = self.offset_x * cols
+        right = min(self.alignment.align_width,
+                (self.offset_x + view_width) * cols)
+        if self.damaged('minimap', top, bottom, left, right):
+            self.minimap.update(y0, x0, y1, x1, top, bottom, left, right)
+
+    def summarise_minimap(self, size):
+        """
+        Summarise the alignment for a minimap. Runs on a background thread.
+        Args:
+            size (tuple): (height, width) of the minimap, in blocks
+
+        Returns: None
+        """
+        summary = block_gap_fractions(self.alignment, *size)
+        # Keep it only if the space for the minimap hasn't changed meanwhile.
+        if size == self.minimap_pending:
+            self.minimap_summary = (size, summary)
+
+    def prompt_key(self, inkey):
+        """
+        Pass a key press to the prompt in the status bar.
+        Args:
+            inkey (str): the key pressed
+
+        Returns: None
+        """
+        self.prompt.key(inkey)
+        if not self.prompt.active:
+            self.prompt = None
+
+    def clear_message(self):
+        """
+        Stop showing the outcome of the last command in the status bar.
+
+        Returns: None
+        """
+        self.message = None
+
+    def jump_to(self, seq, column):
+        """
+        Move the view to show a sequence at the top and a column at the
+        left, as far as the edges of the alignment allow.
+        Args:
+            seq (int): index of a sequence of the alignment
+            column (int): index of a column of the alignment
+
+        Returns: None
+        """
+        rows, cols = self.zoom
+        view_width = self.x1 - self.id_width + 1 - self.minimap_width()
+        self.offset_y = max(0, min(seq // rows,
+            self.total_seqs - self.view_height))
+        self.offset_x = max(0, min(column // cols,
+            self.align_width - view_width))
+
+    def start_search(self):
+        """
+        Prompt for a motif to search the sequences for, see search.
+
+        Returns: None
+        """
+        self.prompt = Prompt("/", self.search)
+
+    def search(self, pattern):
+        """
+        Find a motif in the sequences, ignoring gaps, and move the view to
+        the first hit in or below the view. The residues are indexed for
+        searching in the background the first time, and the search is made
+        once the index is ready (see finish_search). Not available while
+        the alignment is loading.
+        Args:
+            pattern (str): regular expression
+
+        Returns: None
+        """
+        if self.loader is not None:
+            self.message = "[search: not available while loading]"
+            return
+        if not pattern:
+            return
+        if self.residue_index is None:
+            self.residue_index = ResidueIndex(self.alignment)
+            self.work.append(('residue_index', self.residue_index.build))
+            self.profiler.begin('ResidueIndex')
+        if not self.residue_index.done:
+            self.search_pending = pattern
+            return
+        try:
+            hits = self.residue_index.search(pattern)
+        except re.error as e:
+            self.message = "[search: invalid pattern: {}]".format(e)
+            return
+        if len(hits[0]) == 0:
+            self.hits = None
+            self.message = "[search: not found: {}]".format(pattern)
+            return
+        self.hits = hits
+        first_seq = self.offset_y * self.zoom[0]
+        self.hit = int(np.searchsorted(hits[0], first_seq)) % len(hits[0])
+        self.show_hit()
+
+    def finish_search(self):
+        """
+        Make the search waiting for the residue index, once it is ready.
+
+        Returns: None
+        """
+        if self.search_pending is None or not self.residue_index.done:
+            return
+        pattern, self.search_pending = self.search_pending, None
+        self.profiler.end('ResidueIndex')
+        self.search(pattern)
+
+    def next_hit(self, step=1):
+        """
+        Move the view to the next hit of the last search, or the previous
+        one, wrapping around at the ends.
+        Args:
+            step (int): 1 for the next hit, -1 for the previous one
+
+        Returns: None
+        """
+        if self.hits is None:
+            return
+        self.hit = (self.hit + step) % len(self.hits[0])
+        self.show_hit()
+
+    def show_hit(self):
+        """
+        Move the view to the current hit, and describe it in the status bar.
+        Hits of an id search keep the view's columns.
+
+        Returns: None
+        """
+        seqs, positions = self.hits
+        seq = int(seqs[self.hit])
+        if positions is None:
+            self.jump_to(seq, self.offset_x * self.zoom[1])
+            self.message = "[id {}/{}: {}]".format(self.hit + 1, len(seqs),
+                    self.alignment.id(seq))
+            return
+        position = int(positions[self.hit])
+        self.jump_to(seq, self.residue_numbers.column(seq, position + 1))
+        self.message = "[hit {}/{}: {}/{}]".format(self.hit + 1, len(seqs),
+                self.alignment.id(seq), position + 1)
+
+    def start_id_search(self):
+        """
+        Prompt for the start of a sequence id, moving the view to the first
+        sequence in order of id which matches as it is typed. The ids are
+        indexed the first time. Not available while the alignment is
+        loading.
+
+        Returns: None
+        """
+        if self.loader is not None:
+            self.message = "[id search: not available while loading]"
+            return
+        if self.id_index is None:
+            with self.profiler.phase('IdIndex'):
+                self.id_index = IdIndex(self.alignment)
+        self.search_origin = (self.offset_y, self.offset_x)
+        self.prompt = Prompt("Sequence id: ", self.find_id, self.preview_id,
+                self.cancel_id_search)
+
+    def preview_id(self, prefix):
+        """
+        Move the view to the first sequence, in order of id, whose id starts
+        with what has been typed so far, and show how many match.
+        Args:
+            prefix (str): start of an id
+
+        Returns: None
+        """
+        if not prefix:
+            self.cancel_id_search()
+            self.prompt.note = ""
+            return
+        seqs = self.id_index.matches(prefix)
+        if len(seqs) == 0:
+            self.prompt.note = "  [no match]"
+            return
+        self.prompt.note = "  [{} match{}]".format(len(seqs),
+                "" if len(seqs) == 1 else "es")
+        self.jump_to(int(seqs[0]), self.offset_x * self.zoom[1])
+
+    def find_id(self, prefix):
+        """
+        Finish an id search, so that n and N move between the sequences
+        whose ids start with the prefix, in the order they are in the
+        alignment.
+        Args:
+            prefix (str): start of an id
+
+        Returns: None
+        """
+        if not prefix:
+            return
+        seqs = self.id_index.matches(prefix)
+        if len(seqs) == 0:
+            self.cancel_id_search()
+            self.message = "[id search: not found: {}]".format(prefix)
+            return
+        self.hits = (np.sort(seqs), None)
+        self.hit = int(np.searchsorted(self.hits[0], seqs[0]))
+        self.show_hit()
+
+    def cancel_id_search(self):
+        """
+        Move the view back to where it was when the id search started.
+
+        Returns: None
+        """
+        self.offset_y, self.offset_x = self.search_origin
+
+    def toggle_cursor(self):
+        """
+        Show the cursor in the middle of the view, or hide it. While it is
+        shown, the movement keys move it rather than the view.
+
+        Returns: None
+        """
+        if self.cursor is not None:
+            self.cursor = None
+            return
+        rows, cols = self.zoom
+        height, width = self.view_size()
+        height = min(height, self.total_seqs)
+        width = min(width, self.align_width)
+        self.cursor = (
+            min(self.alignment.num_seq - 1,
+                (self.offset_y + height // 2) * rows),
+            min(self.alignment.align_width - 1,
+                (self.offset_x + width // 2) * cols))
+
+    def move_cursor(self, dy, dx):
+        """
+        Move the cursor by a number of positions, as far as the edges of
+        the alignment allow, and move the view to keep it in sight.
+        Args:
+            dy (int): number of positions down, or up if negative
+            dx (int): number of positions right, or left if negative
+
+        Returns: None
+        """
+        rows, cols = self.zoom
+        seq, column = self.cursor
+        self.cursor = (max(0, min(self.alignment.num_seq - 1, seq + dy * rows)),
+                max(0, min(self.alignment.align_width - 1,
+                    column + dx * cols)))
+        self.follow_cursor()
+
+    def follow_cursor(self, jump=False):
+        """
+        Move the view so that the cursor is in it.
+        Args:
+            jump (bool): if the cursor is out of view, put it in the middle
+                of the view, e.g. after a goto, rather than just inside the
+                edge it went past.
+
+        Returns: None
+        """
+        rows, cols = self.zoom
+        y, x = self.cursor[0] // rows, self.cursor[1] // cols
+        height = min(self.view_height, self.total_seqs)
+        width = self.x1 - self.id_width + 1 - self.minimap_width()
+
+        def follow(offset, position, size):
+            if offset <= position < offset + size:
+                return offset
+            if jump:
+                return position - size // 2
+            if position < offset:
+                return position
+            return position - size + 1
+
+        self.offset_y = max(0, min(follow(self.offset_y, y, height),
+            self.total_seqs - height))
+        self.offset_x = max(0, min(follow(self.offset_x, x, width),
+            self.align_width - width))
+
+    def cursor_info(self):
+        """
+        Returns:
+            str describing the column and residue number under the cursor,
+            or None if the cursor isn't shown
+        """
+        if self.cursor is None:
+            return None
+        seq, column = self.cursor
+        number, is_residue = self.residue_numbers.residue(seq, column)
+        if is_residue:
+            residue = "residue {}".format(number)
+        elif number > 0:
+            residue = "gap after residue {}".format(number)
+        else:
+            residue = "gap before residue 1"
+        return "[{} column {}: {}]".format(self.alignment.id(seq), column + 1,
+                residue)
+
+    def start_goto_column(self):
+        """
+        Prompt for a column number to move the cursor to, see goto_column.
+
+        Returns: None
+        """
+        self.prompt = Prompt("Go to column: ", self.goto_column)
+
+    def goto_column(self, text):
+        """
+        Move the cursor to a column, in the sequence it is on or else the
+        top sequence in view, and move the view to show it.
+        Args:
+            text (str): number of the column, counting from 1
+
+        Returns: None
+        """
+        try:
+            column = int(text) - 1
+        except ValueError:
+            self.message = "[goto: not a column number: {}]".format(text)
+            return
+        if not 0 <= column < self.alignment.align_width:
+            self.message = "[goto: columns are numbered 1-{}]".format(
+                    self.alignment.align_width)
+            return
+        self.cursor = (self.cursor_seq(), column)
+        self.follow_cursor(jump=True)
+
+    def start_goto_residue(self):
+        """
+        Prompt for the number of a residue to move the cursor to, in the
+        sequence it is on or else the top sequence in view, see
+        goto_residue.
+
+        Returns: None
+        """
+        seq = self.cursor_seq()
+        self.prompt = Prompt("Go to residue of {}: ".format(
+            self.alignment.id(seq)), lambda text: self.goto_residue(seq, text))
+
+    def goto_residue(self, seq, text):
+        """
+        Move the cursor to a residue of a sequence, and move the view to
+        show it.
+        Args:
+            seq (int): index of a sequence
+            text (str): number of the residue, counting from 1, ignoring
+                gaps
+
+        Returns: None
+        """
+        try:
+            number = int(text)
+        except ValueError:
+            self.message = "[goto: not a residue number: {}]".format(text)
+            return
+        try:
+            column = self.residue_numbers.column(seq, number)
+        except IndexError:
+            self.message = "[goto: {} has {} residues]".format(
+                    self.alignment.id(seq), self.residue_numbers.length(seq))
+            return
+        self.cursor = (seq, column)
+        self.follow_cursor(jump=True)
+
+    def cursor_seq(self):
+        """
+        Returns:
+            int index of the sequence the cursor is on, or of the top
+            sequence in view if the cursor isn't shown
+        """
+        if self.cursor is not None:
+            return self.cursor[0]
+        return min(self.alignment.num_seq - 1, self.offset_y * self.zoom[0])
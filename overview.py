@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017 Gearóid Fox
+#
+# This file is part of Alvin.
+#
+# Alvin is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Alvin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Alvin.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Zoomed out views of an alignment, made by reducing blocks of residues """
+
+import math
+import numpy as np
+from alnmatrix import CLASS_CODES, GAP_CODES, NUM_CLASSES, RESIDUE_CLASS
+
+# Marks positions beyond the edge of the alignment in blocks at its edges.
+PADDING = 255
+
+# Blocks with at least this fraction of gaps are drawn as shades instead of
+# residues: SHADE_CODES[n] for a gap fraction reaching n of the bounds, so
+# blocks of only gaps are drawn as gaps. The shades aren't latin-1
+# characters, so they are stored as control codes and translated when drawn.
+GAP_SHADE_LEVELS = np.array([0.75, 1.0])
+SHADE_CODES = np.array([1, 2, ord('-')], dtype=np.uint8)
+SHADE_CHARS = {1: "\u2592", 2: "\u2591"}
+
+# Blocks of fewer residues than this are reduced by comparing each position
+# of a block with every other, which is faster than counting classes when
+# there are fewer positions than classes.
+SMALL_BLOCK = 32
+
+# Number of residues, and of class counts, to process at once, to bound the
+# size of temporary arrays.
+CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def reduce_small_blocks(classes, rows, cols):
+    """
+    Find the most common class in each block of a stripe of the alignment,
+    by counting how many positions of its block match each position.
+    Args:
+        classes (numpy.ndarray): residue class of each position in a stripe
+            of whole rows of blocks, except perhaps at the bottom edge
+        rows (int): number of sequences in a block
+        cols (int): number of columns in a block
+
+    Returns:
+        (majority, gaps, total) arrays with the most common residue class,
+        the number of gaps and the number of positions in each block
+    """
+    height = math.ceil(classes.shape[0] / rows)
+    width = math.ceil(classes.shape[1] / cols)
+    if classes.shape != (height * rows, width * cols):
+        padded = np.full((height * rows, width * cols), PADDING,
+                dtype=np.uint8)
+        padded[:classes.shape[0], :classes.shape[1]] = classes
+        classes = padded
+    blocks = classes.reshape(height, rows, width, cols)
+    # The class at each position of the blocks, position by position:
+    positions = [np.ascontiguousarray(blocks[:, i, :, j])
+            for i in range(rows) for j in range(cols)]
+    majority = np.zeros((height, width), dtype=np.uint8)
+    most = np.zeros((height, width), dtype=np.uint8)
+    gaps = np.zeros((height, width), dtype=np.int64)
+    total = np.zeros((height, width), dtype=np.int64)
+    count = np.empty((height, width), dtype=np.uint8)
+    same = np.empty((height, width), dtype=bool)
+    for position in positions:
+        gaps += position == 0
+        total += position != PADDING
+        count[:] = 0
+        for other in positions:
+            np.equal(position, other, out=same)
+            count += same
+        count[(position == 0) | (position == PADDING)] = 0
+        # Ties go to the lowest class, as with argmax.
+        better = (count > most) | ((count == most) & (position < majority))
+        np.copyto(majority, position, where=better)
+        np.copyto(most, count, where=better)
+    return majority, gaps, total
+
+
+def reduce_blocks(alignment, first, last, rows, cols):
+    """
+    Find the most common class in each block of a stripe of the alignment,
+    by counting the classes in every block at once with numpy.bincount, a
+    chunk of sequences at a time.
+    Args:
+        alignment (AlignmentMatrix): MSA
+        first (int): index of the first row of blocks in the stripe
+        last (int): index after the last row of blocks in the stripe
+        rows (int): number of sequences in a block
+        cols (int): number of columns in a block
+
+    Returns:
+        (majority, gaps, total) arrays with the most common residue class,
+        the number of gaps and the number of positions in each block
+    """
+    width = math.ceil(alignment.align_width / cols)
+    # Offset of the counts for each column's block within a row of blocks:
+    column_offsets = np.arange(alignment.align_width) // cols * NUM_CLASSES
+    counts = np.zeros((last - first) * width * NUM_CLASSES, dtype=np.int64)
+    end = min(alignment.num_seq, last * rows)
+    step = max(1, CHUNK_SIZE // max(1, alignment.align_width))
+    for top in range(first * rows, end, step):
+        bottom = min(end, top + step)
+        row_offsets = (np.arange(top, bottom) // rows - first) * \
+                (width * NUM_CLASSES)
+        index = row_offsets[:, None] + column_offsets
+        index += RESIDUE_CLASS[alignment.rows(top, bottom)]
+        counts += np.bincount(index.ravel(), minlength=len(counts))
+    counts = counts.reshape(last - first, width, NUM_CLASSES)
+    return (counts[:, :, 1:].argmax(axis=2) + 1, counts[:, :, 0],
+            counts.sum(axis=2))
+
+
+class Overview:
+    """
+    An alignment zoomed out, so that each position stands for a block of
+    rows x cols residues of the original alignment.
+
+    Each block is shown as its most common residue, or as a shade if it is
+    mostly gaps. An Overview has the same methods as an alignment that the
+    panels of the display use, so it can be displayed in its place once
+    reduce has finished.
+
+    Reducing reads the whole alignment, so it is meant to run on a
+    background thread, while other threads check its progress.
+    """
+    def __init__(self, alignment, rows, cols):
+        """
+        Args:
+            alignment (AlignmentMatrix): MSA, completely loaded
+            rows (int): number of sequences in a block
+            cols (int): number of columns in a block
+
+        Returns: None
+        """
+        self.alignment = alignment
+        self.block_rows = rows
+        self.block_cols = cols
+        self.num_seq = math.ceil(alignment.num_seq / rows)
+        self.align_width = math.ceil(alignment.align_width / cols)
+        self.column_stats = {}
+        self.chars = None
+        # Number of rows of blocks reduced so far.
+        self.rows_done = 0
+        self.done = False
+        self.cancelled = False
+
+    def reduce(self):
+        """
+        Find the most common residue class and the fraction of gaps in each
+        block, a stripe of blocks at a time, and choose the character drawn
+        for each block. Stops early if cancelled.
+
+        Returns: None
+        """
+        alignment = self.alignment
+        rows, cols = self.block_rows, self.block_cols
+        small = rows * cols < SMALL_BLOCK
+        if small:
+            stripe = max(1, CHUNK_SIZE // max(1,
+                rows * alignment.align_width))
+        else:
+            stripe = max(1, CHUNK_SIZE // (self.align_width * NUM_CLASSES))
+        chars = np.empty((self.num_seq, self.align_width), dtype=np.uint8)
+        for first in range(0, self.num_seq, stripe):
+            last = min(self.num_seq, first + stripe)
+            if small:
+                majority, gaps, total = reduce_small_blocks(
+                        RESIDUE_CLASS[alignment.rows(first * rows,
+                            last * rows)], rows, cols)
+            else:
+                majority, gaps, total = reduce_blocks(alignment, first, last,
+                        rows, cols)
+            gaps = gaps / total
+            shades = SHADE_CODES[np.searchsorted(GAP_SHADE_LEVELS, gaps,
+                side='right')]
+            chars[first:last] = np.where(gaps >= 0.5, shades,
+                    CLASS_CODES[majority])
+            self.rows_done = last
+            if self.cancelled:
+                return
+        self.chars = chars
+        self.column_class_counts()
+        self.done = True
+
+    def cancel(self):
+        """
+        Stop reducing the blocks, e.g. if the overview is no longer wanted.
+
+        Returns: None
+        """
+        self.cancelled = True
+
+    def progress(self):
+        """
+        Returns:
+            str describing how much of the alignment has been reduced
+        """
+        return "Zooming out: {}%".format(
+                100 * self.rows_done // max(1, self.num_seq))
+
+    def id(self, i):
+        """
+        Args:
+            i (int): index of a row of blocks
+
+        Returns:
+            str id of the first sequence in the row of blocks
+        """
+        return self.alignment.id(i * self.block_rows)
+
+    def max_id_length(self):
+        """
+        Returns:
+            int length of the longest sequence id, in bytes
+        """
+        return self.alignment.max_id_length()
+
+    def row(self, i, left=0, right=None):
+        """
+        Args:
+            i (int): index of a row of blocks
+            left (int): index of the first block to return
+            right (int): index after the last block to return
+
+        Returns:
+            str characters of the blocks in row i between left and right
+        """
+        return self.chars[i, left:right].tobytes().decode('latin-1'
+                ).translate(SHADE_CHARS)
+
+    def rows(self, top, bottom, left=0, right=None):
+        """
+        Args:
+            top (int): index of the first row of blocks to return
+            bottom (int): index after the last row of blocks to return
+            left (int): index of the first block to return
+            right (int): index after the last block to return
+
+        Returns:
+            numpy.ndarray (bottom - top, right - left) uint8 character codes
+            of the blocks, with control codes standing for the shades
+        """
+        return self.chars[top:bottom, left:right]
+
+    def column_means(self, values):
+        """
+        Args:
+            values (numpy.ndarray): a statistic of each column of the
+                alignment
+
+        Returns:
+            numpy.ndarray mean of the statistic over each column of blocks
+        """
+        starts = np.arange(0, self.alignment.align_width, self.block_cols)
+        if len(starts) == 0:
+            return np.zeros(0)
+        counts = np.diff(np.append(starts, self.alignment.align_width))
+        return np.add.reduceat(values, starts) / counts
+
+    def column_class_counts(self):
+        """
+        Returns:
+            numpy.ndarray (align_width, NUM_CLASSES) number of residues of
+            each class in each column of blocks
+        """
+        if 'class_counts' not in self.column_stats:
+            starts = np.arange(0, self.alignment.align_width, self.block_cols)
+            if len(starts) == 0:
+                return np.zeros((0, NUM_CLASSES), dtype=np.int64)
+            self.column_stats['class_counts'] = np.add.reduceat(
+                    self.alignment.column_class_counts(), starts, axis=0,
+                    dtype=np.int64)
+        return self.column_stats['class_counts']
+
+    def gap_fractions(self):
+        """
+        Returns:
+            numpy.ndarray fraction of gaps in each column of blocks
+        """
+        if 'gap_fractions' not in self.column_stats:
+            self.column_stats['gap_fractions'] = self.column_means(
+                    self.alignment.gap_fractions())
+        return self.column_stats['gap_fractions']
+
+    def column_entropy(self):
+        """
+        Returns:
+            numpy.ndarray mean entropy of the columns in each column of
+            blocks (see alnmatrix.entropy)
+        """
+        if 'entropy' not in self.column_stats:
+            self.column_stats['entropy'] = self.column_means(
+                    self.alignment.column_entropy())
+        return self.column_stats['entropy']
+
+
+def block_gap_fractions(alignment, height, width):
+    """
+    Summarise the whole alignment as a small grid of the fraction of gaps in
+    blocks of it, e.g. for a minimap.
+    Args:
+        alignment (AlignmentMatrix): MSA, completely loaded
+        height (int): number of rows of blocks, at most num_seq
+        width (int): number of columns of blocks, at most align_width
+
+    Returns:
+        (row_edges, col_edges, fractions): the first sequence and column of
+        each block, each followed by the end of the alignment, and a
+        (height, width) numpy.ndarray of the fraction of gaps in each block
+    """
+    num_seq = alignment.num_seq
+    row_edges = np.linspace(0, num_seq, height + 1).astype(np.int64)
+    col_edges = np.linspace(0, alignment.align_width,
+            width + 1).astype(np.int64)
+    block_of_row = np.searchsorted(row_edges, np.arange(num_seq),
+            side='right') - 1
+    gaps = np.zeros((height, width), dtype=np.int64)
+    step = alignment.chunk_rows()
+    for top in range(0, num_seq, step):
+        bottom = min(num_seq, top + step)
+        is_gap = np.isin(alignment.rows(top, bottom), GAP_CODES)
+        counts = np.add.reduceat(is_gap, col_edges[:-1], axis=1,
+                dtype=np.int64)
+        np.add.at(gaps, block_of_row[top:bottom], counts)
+    sizes = np.outer(np.diff(row_edges), np.diff(col_edges))
+    return row_edges, col_edges, gaps / sizes
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017 Gearóid Fox
+#
+# This file is part of Alvin.
+#
+# Alvin is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Alvin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Alvin.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Timings and memory use of the stages of displaying an alignment """
+
+from collections import deque
+import contextlib
+import cProfile
+import resource
+import time
+import tracemalloc
+
+
+
+def memory_in_use():
+    """
+    Returns:
+        resident memory of this process in bytes, or None where that can't
+        be found out (it is read from /proc)
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peak_memory():
+    """
+    Returns:
+        the most resident memory this process has used, in bytes, or None
+        where that can't be found out (it is read from /proc). Unlike
+        ru_maxrss, this doesn't count memory used by the parent process
+        before this process was started.
+    """
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def percentile(values, p):
+    """
+    Args:
+        values (list): numbers in ascending order, at least one
+        p (float): fraction between 0 and 1
+
+    Returns:
+        the value which that fraction of the values don't exceed
+    """
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+def summarise(values):
+    """
+    Args:
+        values (iterable): numbers, e.g. latencies
+
+    Returns:
+        dict with the count, mean, median, 95th percentile and maximum of
+        the values, or only the count if there are none
+    """
+    values = sorted(values)
+    if not values:
+        return {'count': 0}
+    return {'count': len(values), 'mean': sum(values) / len(values),
+            'median': percentile(values, 0.5),
+            'p95': percentile(values, 0.95), 'max': values[-1]}
+
+
+
+class RecentLatencies:
+    """
+    The most recent latencies of some operation, for a live summary.
+    """
+    def __init__(self, size=100):
+        """
+        Args:
+            size (int): number of latencies to keep
+
+        Returns: None
+        """
+        self.samples = deque(maxlen=size)
+
+    def record(self, seconds):
+        """
+        Args:
+            seconds (float): a latency
+
+        Returns: None
+        """
+        self.samples.append(seconds)
+
+    def last(self):
+        """
+        Returns:
+            the latest latency in seconds, or None if none were recorded
+        """
+        if not self.samples:
+            return None
+        return self.samples[-1]
+
+    def percentile(self, p):
+        """
+        Args:
+            p (float): fraction between 0 and 1
+
+        Returns:
+            latency in seconds which that fraction of the recent latencies
+            don't exceed, or None if none were recorded
+        """
+        if not self.samples:
+            return None
+        return percentile(sorted(self.samples), p)
+
+
+
+class Profiler:
+    """
+    Record the wall time and memory use of each phase of startup, and how
+    long the display takes to respond to key presses.
+
+    Phases may overlap, e.g. while the file loads in the background. The
+    peak memory of a phase is the most memory traced by tracemalloc, in any
+    thread, at any time during the phase.
+
+    A disabled profiler records nothing, so code can be instrumented
+    unconditionally.
+    """
+    def __init__(self, enabled=True, stats_path=None):
+        """
+        Args:
+            enabled (bool): record anything at all
+            stats_path (str): path to save cProfile statistics to, if any
+
+        Returns: None
+        """
+        self.enabled = enabled
+        self.stats_path = stats_path
+        self.cprofile = None
+        # name: [start time, traced memory at start, peak so far]
+        self.running = {}
+        # (name, seconds, peak bytes, net bytes) of each finished phase
+        self.phases = []
+        # seconds from a key press until the display was updated
+        self.latencies = []
+
+    def start(self):
+        """
+        Start tracing memory allocations and, if requested, profiling.
+
+        Returns: None
+        """
+        if not self.enabled:
+            return
+        tracemalloc.start()
+        if self.stats_path is not None:
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    def stop(self):
+        """
+        Stop tracing, and save the cProfile statistics if requested.
+
+        Returns: None
+        """
+        if not self.enabled:
+            return
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(self.stats_path)
+            self.cprofile = None
+        tracemalloc.stop()
+
+    def _update_peaks(self):
+        """
+        Fold the peak traced memory since the last call into the running
+        phases, then start measuring a new peak.
+
+        Returns:
+            bytes of memory currently traced
+        """
+        current, peak = tracemalloc.get_traced_memory()
+        for entry in self.running.values():
+            entry[2] = max(entry[2], peak)
+        tracemalloc.reset_peak()
+        return current
+
+    def begin(self, name):
+        """
+        Start timing a phase.
+        Args:
+            name (str): name of the phase
+
+        Returns: None
+        """
+        if not self.enabled:
+            return
+        current = self._update_peaks()
+        self.running[name] = [time.perf_counter(), current, current]
+
+    def end(self, name, label=None):
+        """
+        Finish timing a phase.
+        Args:
+            name (str): name the phase was started with
+            label (str): name to report the phase under, if different, e.g.
+                once it is known how the phase went
+
+        Returns: None
+        """
+        if not self.enabled or name not in self.running:
+            return
+        current = self._update_peaks()
+        start, start_memory, peak = self.running.pop(name)
+        self.phases.append((label or name, time.perf_counter() - start, peak,
+            current - start_memory))
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Context manager timing the code run inside it as a phase.
+        Args:
+            name (str): name of the phase
+        """
+        self.begin(name)
+        try:
+            yield
+        finally:
+            self.end(name)
+
+    def record_latency(self, seconds):
+        """
+        Args:
+            seconds (float): time from a key press until the display was
+                updated
+
+        Returns: None
+        """
+        if self.enabled:
+            self.latencies.append(seconds)
+
+    def report(self):
+        """
+        Returns:
+            str with a table of the phases and a summary of the key press
+            latencies
+        """
+        lines = ["{:<28}{:>12}{:>12}{:>12}".format("Phase", "Time (ms)",
+            "Peak (MB)", "Net (MB)")]
+        for name, seconds, peak, net in self.phases:
+            lines.append("{:<28}{:>12.1f}{:>12.1f}{:>12.1f}".format(name,
+                seconds * 1000, peak / 1e6, net / 1e6))
+        for name in self.running:
+            lines.append("{:<28}{:>12}".format(name, "unfinished"))
+        if self.latencies:
+            summary = summarise(seconds * 1000 for seconds in self.latencies)
+            lines.append("")
+            lines.append("update after key press: {count} updates, mean "
+                    "{mean:.1f} ms, median {median:.1f} ms, 95th percentile "
+                    "{p95:.1f} ms, max {max:.1f} ms".format(**summary))
+        if self.stats_path is not None:
+            lines.append("")
+            lines.append("cProfile statistics saved to " + self.stats_path)
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017 Gearóid Fox
+#
+# This file is part of Alvin.
+#
+# Alvin is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Alvin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Alvin.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Finding motifs, sequences and residue numbers in an alignment """
+
+from collections import OrderedDict
+import bisect
+import mmap
+import re
+import tempfile
+import numpy as np
+from alnmatrix import RESIDUE_CLASS
+
+# Separates the sequences in the text searched.
+LINE_END = ord('\n')
+
+
+class ResidueIndex:
+    """
+    The residues of every sequence of an alignment without gaps, for
+    searching.
+
+    The sequences are held as one block of bytes, a line per sequence, so
+    that a pattern can be searched for in every sequence with one regular
+    expression call. Hits are found as residue numbers; only the offset of
+    each line is kept besides the text, and the column of a hit is looked up
+    from its sequence when needed (see ResidueNumbers).
+
+    The text is about as large as the residues of the alignment, so it is
+    written to a temporary file (in the directory given by TMPDIR) and
+    mapped into memory rather than held in it, like the sequences of a
+    MappedFasta; the operating system pages it in as it is searched.
+
+    Building the index reads the whole alignment, so it is meant to run on
+    a background thread, while other threads check its progress.
+    """
+    def __init__(self, alignment):
+        """
+        Args:
+            alignment (AlignmentMatrix): MSA, completely loaded
+
+        Returns: None
+        """
+        self.alignment = alignment
+        self.text = None
+        # Offset of each line in the text, followed by the end of the text.
+        self.line_starts = None
+        # Number of sequences indexed so far.
+        self.rows_done = 0
+        self.done = False
+
+    def build(self):
+        """
+        Gather the residues of the sequences, a chunk of rows at a time.
+
+        Returns: None
+        """
+        alignment = self.alignment
+        num_seq = alignment.num_seq
+        width = alignment.align_width
+        text = tempfile.TemporaryFile()
+        line_starts = np.zeros(num_seq + 1, dtype=np.int64)
+        step = alignment.chunk_rows()
+        for top in range(0, num_seq, step):
+            bottom = min(num_seq, top + step)
+            # The rows of residues, each followed by a line end:
+            lines = np.empty((bottom - top, width + 1), dtype=np.uint8)
+            lines[:, :width] = alignment.rows(top, bottom)
+            lines[:, width] = LINE_END
+            residues = RESIDUE_CLASS[lines] != 0
+            text.write(lines[residues].tobytes())
+            np.cumsum(residues.sum(axis=1), out=line_starts[top+1:bottom+1])
+            line_starts[top+1:bottom+1] += line_starts[top]
+            self.rows_done = bottom
+        text.flush()
+        if line_starts[-1] > 0:
+            self.text = mmap.mmap(text.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            # An empty file cannot be mapped.
+            self.text = b''
+        # The mapping keeps the file open until it is closed itself.
+        text.close()
+        self.line_starts = line_starts
+        self.done = True
+
+    def progress(self):
+        """
+        Returns:
+            str describing how many of the sequences have been indexed
+        """
+        return "Indexing residues for search: {}%".format(
+                100 * self.rows_done // max(1, self.alignment.num_seq))
+
+    def search(self, pattern):
+        """
+        Find a motif in the sequences, ignoring gaps and case.
+        Args:
+            pattern (str): regular expression
+
+        Returns:
+            (rows, positions) numpy.ndarrays with the sequence and residue
+            number counting from 0 of the first residue of each hit, in
+            order of sequence then position. Overlapping hits are not found.
+        Raises:
+            re.error if the pattern is not a valid regular expression
+        """
+        regex = re.compile(pattern.encode('latin-1', 'replace'),
+                re.IGNORECASE | re.MULTILINE)
+        text = self.text
+        starts = []
+        pos = 0
+        while pos < len(text):
+            resume = None
+            for match in regex.finditer(text, pos):
+                start, end = match.span()
+                if text.find(b'\n', start, end) < 0:
+                    if end > start:
+                        starts.append(start)
+                    continue
+                # The hit runs into the next sequence, so search the rest of
+                # this one on its own.
+                line_end = text.find(b'\n', start)
+                starts.extend(match.start() for match in
+                        regex.finditer(text, start, line_end)
+                        if match.end() > match.start())
+                resume = line_end + 1
+                break
+            if resume is None:
+                break
+            pos = resume
+        starts = np.array(starts, dtype=np.int64)
+        rows = np.searchsorted(self.line_starts, starts, side='right') - 1
+        return rows, starts - self.line_starts[rows]
+
+
+class IdIndex:
+    """
+    The ids of the sequences of an alignment in sorted order, for finding
+    sequences by the start of their ids, ignoring case.
+
+    Finding the ids with a prefix takes two binary searches, so narrowing
+    the matches as each character of an id is typed is quick however many
+    sequences there are.
+    """
+    def __init__(self, alignment):
+        """
+        Args:
+            alignment (AlignmentMatrix): MSA, completely loaded
+
+        Returns: None
+        """
+        ids = [alignment.id(i).casefold() for i in range(alignment.num_seq)]
+        order = sorted(range(len(ids)), key=ids.__getitem__)
+        self.keys = [ids[i] for i in order]
+        self.order = np.array(order, dtype=np.int64)
+
+    def matches(self, prefix):
+        """
+        Args:
+            prefix (str): start of an id
+
+        Returns:
+            numpy.ndarray index of each sequence whose id starts with prefix,
+            in order of id
+        """
+        prefix = prefix.casefold()
+        first = bisect.bisect_left(self.keys, prefix)
+        last = bisect.bisect_left(self.keys, prefix + "\U0010ffff", first)
+        return self.order[first:last]
+
+
+class ResidueNumbers:
+    """
+    Maps between the aligned columns of sequences and the numbers of their
+    residues, counting from 1 and ignoring gaps.
+
+    For each sequence asked about, the number of residues before each
+    column (a prefix sum of its non-gap positions) and the column of each
+    residue are worked out once, so that either way of mapping is O(1).
+    The arrays of the sequences used most recently are kept, as they take
+    as much memory as a few rows of the alignment each.
+    """
+    def __init__(self, alignment, max_rows=64):
+        """
+        Args:
+            alignment (AlignmentMatrix): MSA
+            max_rows (int): number of sequences whose arrays are kept
+
+        Returns: None
+        """
+        self.alignment = alignment
+        self.max_rows = max_rows
+        self.numbered = OrderedDict()
+
+    def numbering(self, seq):
+        """
+        Args:
+            seq (int): index of a sequence
+
+        Returns:
+            (counts, columns) numpy.ndarrays with the number of residues
+            before each column of the sequence, followed by its number of
+            residues, and the column of each of its residues
+        """
+        if seq in self.numbered:
+            self.numbered.move_to_end(seq)
+            return self.numbered[seq]
+        residues = RESIDUE_CLASS[self.alignment.rows(seq, seq + 1)[0]] != 0
+        counts = np.zeros(len(residues) + 1, dtype=np.int32)
+        np.cumsum(residues, out=counts[1:])
+        columns = np.flatnonzero(residues).astype(np.int32)
+        self.numbered[seq] = counts, columns
+        if len(self.numbered) > self.max_rows:
+            self.numbered.popitem(last=False)
+        return counts, columns
+
+    def length(self, seq):
+        """
+        Args:
+            seq (int): index of a sequence
+
+        Returns:
+            int number of residues in the sequence
+        """
+        return int(self.numbering(seq)[0][-1])
+
+    def residue(self, seq, column):
+        """
+        Args:
+            seq (int): index of a sequence
+            column (int): index of a column
+
+        Returns:
+            (number, is_residue): the number of the residue in the column,
+            counting from 1, or of the last residue before it if the
+            sequence has a gap there (0 if there is none), and whether it
+            has a residue there
+        """
+        counts = self.numbering(seq)[0]
+        return int(counts[column + 1]), bool(counts[column + 1] >
+                counts[column])
+
+    def column(self, seq, number):
+        """
+        Args:
+            seq (int): index of a sequence
+            number (int): number of a residue, counting from 1
+
+        Returns:
+            int index of the column of the residue
+        Raises:
+            IndexError if the sequence has no residue with that number
+        """
+        columns = self.numbering(seq)[1]
+        if not 1 <= number <= len(columns):
+            raise IndexError(number)
+        return int(columns[number - 1])
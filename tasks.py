@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017 Gearóid Fox
+#
+# This file is part of Alvin.
+#
+# Alvin is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Alvin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Alvin.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Background work for the asyncio event loop which drives the display """
+
+import asyncio
+import threading
+
+
+
+def run_in_thread(func, *args):
+    """
+    Call a function on a new daemon thread.
+
+    Unlike loop.run_in_executor, the thread doesn't stop the program from
+    exiting while it is still running, so quitting doesn't have to wait for
+    a large file to finish loading.
+
+    Args:
+        func: function to call
+        *args: arguments to call it with
+
+    Returns:
+        asyncio.Future which is resolved with func's return value or
+        exception. Cancelling it discards the result, but doesn't stop func.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def resolve(result, error):
+        if future.cancelled():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def target():
+        result, error = None, None
+        try:
+            result = func(*args)
+        except Exception as e:
+            error = e
+        try:
+            loop.call_soon_threadsafe(resolve, result, error)
+        except RuntimeError:
+            # The event loop has been closed, so nobody is waiting.
+            pass
+
+    thread = threading.Thread(target=target)
+    thread.daemon = True
+    thread.start()
+    return future
+
+
+
+async def wake_every(event, interval):
+    """
+    Set an event periodically, e.g. to redraw the display while a file is
+    loading.
+
+    Args:
+        event (asyncio.Event): event to set
+        interval (float): seconds between wake ups
+
+    Returns: None, runs until cancelled
+    """
+    while True:
+        await asyncio.sleep(interval)
+        event.set()
+
+
+
+async def run_steps(steps):
+    """
+    Run a generator one step at a time, letting the event loop handle other
+    events, such as key presses, between steps.
+
+    Args:
+        steps: iterable doing a piece of work for each item
+
+    Returns: None
+    """
+    for _ in steps:
+        await asyncio.sleep(0)
+
+
+
+class BackgroundTasks:
+    """
+    Named asyncio tasks running alongside the display.
+
+    A task can be tied to a view of the alignment, e.g. work preparing the
+    area around the visible part of the alignment. Such tasks are cancelled
+    once the view has moved on, so that they don't hold up work for the new
+    view.
+    """
+    def __init__(self):
+        # name: (task, view it was started for, or None)
+        self.tasks = {}
+
+    def start(self, name, coro, view=None):
+        """
+        Start a task, cancelling any running task of the same name.
+
+        Args:
+            name (str): name of the task
+            coro: coroutine to run
+            view: anything identifying the view the task was started for,
+                or None if the task doesn't depend on the view
+
+        Returns:
+            asyncio.Task
+        """
+        self.cancel(name)
+        task = asyncio.ensure_future(coro)
+        self.tasks[name] = (task, view)
+        task.add_done_callback(lambda t: self._forget(name, t))
+        return task
+
+    def _forget(self, name, task):
+        if name in self.tasks and self.tasks[name][0] is task:
+            del self.tasks[name]
+
+    def running(self, name):
+        """
+        Args:
+            name (str): name of a task
+
+        Returns:
+            True if a task of that name is running
+        """
+        return name in self.tasks
+
+    def cancel(self, name):
+        """
+        Cancel a task, if it is running.
+
+        Args:
+            name (str): name of the task
+
+        Returns: None
+        """
+        if name in self.tasks:
+            task, view = self.tasks.pop(name)
+            task.cancel()
+
+    def cancel_stale(self, view):
+        """
+        Cancel tasks which were started for a different view.
+
+        Args:
+            view: the current view
+
+        Returns: None
+        """
+        for name, (task, task_view) in list(self.tasks.items()):
+            if task_view is not None and task_view != view:
+                self.cancel(name)
+
+    async def cancel_all(self):
+        """
+        Cancel every task and wait for them to finish.
+
+        Returns: None
+        """
+        tasks = [task for task, view in self.tasks.values()]
+        for task in tasks:
+            task.cancel()
+        self.tasks.clear()
+        await asyncio.gather(*tasks, return_exceptions=True)
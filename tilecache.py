@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017 Gearóid Fox
+#
+# This file is part of Alvin.
+#
+# Alvin is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Alvin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Alvin.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Cache of pre-rendered blocks ("tiles") of an alignment """
+
+from collections import OrderedDict
+import curses
+import re
+import vcolours
+
+
+# Rough per-span overhead of a rendered tile in bytes: a tuple, an int, an
+# attribute and a str object.
+SPAN_BYTES = 120
+
+# Matches a run of one repeated character.
+_same_char_run = re.compile(r'(.)\1*', re.DOTALL)
+
+
+class Tile:
+    """
+    A pre-rendered block of the alignment.
+
+    Each row is a list of (x, text, attr) spans, with x counted from the left
+    edge of the tile, ready to be passed to addstr.
+    """
+    __slots__ = ['top', 'left', 'rows', 'nbytes']
+
+    def __init__(self, top, left, rows):
+        """
+        Args:
+            top (int): index of the first sequence in the tile
+            left (int): index of the first column in the tile
+            rows (list): list of span lists, one per sequence
+
+        Returns: None
+        """
+        self.top = top
+        self.left = left
+        self.rows = rows
+        self.nbytes = 0
+        for row in rows:
+            self.nbytes += SPAN_BYTES * len(row)
+            for span in row:
+                self.nbytes += len(span[1])
+
+    def paint(self, pad, top, bottom, left, right):
+        """
+        Paint the part of the tile that lies inside a block of the alignment.
+        Args:
+            pad: curses pad, with the block painted at its top left corner
+            top (int): index of the first sequence to paint
+            bottom (int): index after the last sequence to paint
+            left (int): index of the first column to paint
+            right (int): index after the last column to paint
+
+        Returns: None
+        """
+        first = max(top, self.top)
+        last = min(bottom, self.top + len(self.rows))
+        for y in range(first, last):
+            for x, text, attr in self.rows[y - self.top]:
+                x0 = self.left + x
+                x1 = x0 + len(text)
+                if x1 <= left or x0 >= right:
+                    continue
+                if x0 < left:
+                    text = text[left - x0:]
+                    x0 = left
+                if x1 > right:
+                    text = text[:right - x0]
+                pad.addstr(y - top, x0 - left, text, attr)
+
+
+def render_row(seq, preserve_gaps, attr_gap, attr_dict):
+    """
+    Split a row of residues into spans to draw.
+
+    Neighbouring characters which are drawn with the same attribute, such as
+    runs of gaps or residues sharing a colour pair, are merged into a single
+    span, so that each span costs one addstr call.
+    Args:
+        seq (str): residues in the row
+        preserve_gaps (bool): keep the original gap characters, instead of
+            drawing all gaps as '.' characters.
+        attr_gap (int): attribute for gaps and unrecognised characters
+        attr_dict (dict): attribute for each recognised residue
+
+    Returns:
+        list of (x, text, attr) spans
+    """
+    if not preserve_gaps:
+        seq = seq.replace('-', '.')
+    spans = []
+    start = 0
+    attr = None
+    for run in _same_char_run.finditer(seq):
+        run_attr = attr_dict.get(run.group(1), attr_gap)
+        if run_attr != attr:
+            x = run.start()
+            if x > start:
+                spans.append((start, seq[start:x], attr))
+            start = x
+            attr = run_attr
+    if len(seq) > start:
+        spans.append((start, seq[start:], attr))
+    return spans
+
+
+class TileCache:
+    """
+    Least-recently-used cache of rendered tiles of an alignment, limited by
+    an estimate of the memory the tiles use.
+    """
+    def __init__(self, alignment, preserve_gaps=False, max_bytes=64*1024*1024,
+            tile_height=64, tile_width=256):
+        """
+        Args:
+            alignment (AlignmentMatrix): MSA
+            preserve_gaps (bool): display the original gap characters from
+                MSA file, instead of displaying all gaps as '.' characters.
+            max_bytes (int): memory budget for cached tiles
+            tile_height (int): number of sequences in a tile
+            tile_width (int): number of columns in a tile
+
+        Returns: None
+        """
+        self.alignment = alignment
+        self.preserve_gaps = preserve_gaps
+        self.max_bytes = max_bytes
+        self.tile_height = tile_height
+        self.tile_width = tile_width
+        self.tiles = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def hit_rate(self):
+        """
+        Returns:
+            fraction of tile lookups served from the cache
+        """
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            return 0.0
+        return self.hits / lookups
+
+    def get(self, tile_y, tile_x):
+        """
+        Fetch a tile, rendering it if it is not cached.
+        Args:
+            tile_y (int): row of the tile in the grid of tiles
+            tile_x (int): column of the tile in the grid of tiles
+
+        Returns:
+            Tile
+        """
+        key = (tile_y, tile_x)
+        tile = self.tiles.get(key)
+        if tile is not None and self.complete(tile):
+            self.hits += 1
+            self.tiles.move_to_end(key)
+            return tile
+        self.misses += 1
+        return self.store(key, self.render(tile_y, tile_x))
+
+    def cached(self, tile_y, tile_x):
+        """
+        Args:
+            tile_y (int): row of the tile in the grid of tiles
+            tile_x (int): column of the tile in the grid of tiles
+
+        Returns:
+            True if the tile is cached and up to date
+        """
+        tile = self.tiles.get((tile_y, tile_x))
+        return tile is not None and self.complete(tile)
+
+    def store(self, key, tile):
+        """
+        Add a rendered tile to the cache, evicting the least recently used
+        tiles if the cache is over budget.
+        Args:
+            key (tuple): (tile_y, tile_x) position of the tile in the grid
+            tile (Tile): the rendered tile
+
+        Returns:
+            Tile
+        """
+        old = self.tiles.pop(key, None)
+        if old is not None:
+            self.nbytes -= old.nbytes
+        self.tiles[key] = tile
+        self.nbytes += tile.nbytes
+        while self.nbytes > self.max_bytes and len(self.tiles) > 1:
+            _, old = self.tiles.popitem(last=False)
+            self.nbytes -= old.nbytes
+        return tile
+
+    def complete(self, tile):
+        """
+        Args:
+            tile (Tile): a rendered tile
+
+        Returns:
+            False if more sequences belonging in the tile have been loaded
+            since it was rendered
+        """
+        return (len(tile.rows) == self.tile_height or
+                tile.top + len(tile.rows) >= self.alignment.num_seq)
+
+    def render(self, tile_y, tile_x):
+        """
+        Render a tile from the alignment.
+        Args:
+            tile_y (int): row of the tile in the grid of tiles
+            tile_x (int): column of the tile in the grid of tiles
+
+        Returns:
+            Tile
+        """
+        if curses.has_colors():
+            attr_gap = curses.color_pair(11)
+            attr_dict = {char: curses.color_pair(pair)
+                    for char, pair in vcolours.aa_dict.items()}
+        else:
+            attr_gap = curses.A_NORMAL
+            attr_dict = {char: curses.A_NORMAL for char in vcolours.aa_dict}
+        top = tile_y * self.tile_height
+        left = tile_x * self.tile_width
+        bottom = min(self.alignment.num_seq, top + self.tile_height)
+        right = left + self.tile_width
+        rows = []
+        for i in range(top, bottom):
+            rows.append(render_row(self.alignment.row(i, left, right),
+                self.preserve_gaps, attr_gap, attr_dict))
+        return Tile(top, left, rows)
+
+    def paint(self, pad, top, bottom, left, right):
+        """
+        Paint a block of the alignment into a pad from cached tiles.
+        Args:
+            pad: curses pad, with the block painted at its top left corner
+            top (int): index of the first sequence to paint
+            bottom (int): index after the last sequence to paint
+            left (int): index of the first column to paint
+            right (int): index after the last column to paint
+
+        Returns: None
+        """
+        for tile_y, tile_x in self.keys(top, bottom, left, right):
+            self.get(tile_y, tile_x).paint(pad, top, bottom, left, right)
+
+    def keys(self, top, bottom, left, right):
+        """
+        Find the tiles covering a block of the alignment.
+        Args:
+            top (int): index of the first sequence in the block
+            bottom (int): index after the last sequence in the block
+            left (int): index of the first column in the block
+            right (int): index after the last column in the block
+
+        Returns:
+            list of (tile_y, tile_x) positions of tiles in the grid
+        """
+        if bottom <= top or right <= left:
+            return []
+        return [(tile_y, tile_x)
+                for tile_y in range(top // self.tile_height,
+                    (bottom - 1) // self.tile_height + 1)
+                for tile_x in range(left // self.tile_width,
+                    (right - 1) // self.tile_width + 1)]
+
+    def prefetch(self, blocks, max_bytes=None):
+        """
+        Render the tiles covering some blocks of the alignment ahead of
+        time, one tile per step.
+
+        A generator, so that the work can be spread out between other
+        events and abandoned when it is no longer useful. Tiles which are
+        already cached are skipped, and lookups made here don't count
+        towards the hit rate.
+        Args:
+            blocks (list): (top, bottom, left, right) blocks of the
+                alignment, most urgent first
+            max_bytes (int): stop after rendering about this many bytes of
+                tiles. Defaults to a quarter of the cache's budget, so that
+                prefetching doesn't evict the tiles currently displayed.
+
+        Yields:
+            (tile_y, tile_x) position of each tile rendered
+        """
+        if max_bytes is None:
+            max_bytes = self.max_bytes // 4
+        rendered = 0
+        for top, bottom, left, right in blocks:
+            for key in self.keys(top, bottom, left, right):
+                if self.cached(*key):
+                    continue
+                if rendered >= max_bytes:
+                    return
+                tile = self.store(key, self.render(*key))
+                rendered += tile.nbytes
+                yield key
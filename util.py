@@ -19,7 +19,11 @@
 
 import curses
 import sys
-import re
+import numpy as np
+from compressed import open_text
+
+# Byte values of the characters allowed in a nucleotide sequence.
+NUCLEOTIDE_CODES = np.frombuffer(b'actgunACTGUN-.', dtype=np.uint8)
 
 def die_curses(stdscr, message, e=None):
     """
@@ -53,14 +57,15 @@ def die(message, e=None):
 def guess_format(alignment_file):
     """Guess the format of a multiple sequence alignment file
     
-    Makes a rough guess at the format of an MSA file.
+    Makes a rough guess at the format of an MSA file, which may be
+    compressed with gzip, bgzip or xz.
 
     Returns:
         a str from ['fasta', 'clustal', 'phylip' 'nexus', 'stockholm']
         None if no guess could be made
     
     """
-    with open(alignment_file, 'rU') as infile:
+    with open_text(alignment_file) as infile:
         line1 = next(infile)
         while line1.strip() == "":
             line1 = next(infile)
@@ -96,13 +101,11 @@ def guess_nucleotide(alignment):
     or an amino acid alignment
     
     Args:
-        alignment
+        alignment (AlignmentMatrix or MappedFasta)
     Returns:
         True if alignment seems to contain DNA or RNA sequences
         False otherwise
     """
-    pattern = re.compile("^[actgunACTGUN\-\.]+$") 
-    if pattern.match(str(alignment[0].seq)) is not None:
-        return True
-    else:
+    if alignment.num_seq == 0:
         return False
+    return bool(np.isin(alignment.rows(0, 1)[0], NUCLEOTIDE_CODES).all())